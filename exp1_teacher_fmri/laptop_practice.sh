@@ -1,4 +1,4 @@
 SUB=$1
 
-python teaching_mazes.py
+python teaching_mazes.py --sub=$SUB
 python teaching_practice.py --sub=$SUB
\ No newline at end of file
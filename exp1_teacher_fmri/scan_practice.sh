@@ -1,4 +1,4 @@
 SUB=$1
 
-python teaching_mazes.py -scan
+python teaching_mazes.py --sub=$SUB -scan
 python teaching_practice.py --sub=$SUB -scan
@@ -1,8 +1,5 @@
 SUB=$1
 START=${2:-1}
 
-# main task
-for RUN in $(seq $START 10)
-do
-	python teaching_task.py --sub=$SUB --run=$RUN
-done
+# main task: every run from START on, in one process and window (see teaching_session.py)
+python teaching_session.py --sub=$SUB --start=$START
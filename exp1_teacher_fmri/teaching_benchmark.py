@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, contextlib, json, os, platform, socket, subprocess, sys, tempfile, time, timeit
+import numpy as np
+
+# Experiment-specific modules
+import teaching_game_logic as game
+import teaching_stimuli as stim
+import teaching_window as window
+import teaching_datalog as datalog
+import teaching_simulate as sim
+import teaching_timing
+
+# Results are saved here (one baseline per machine)
+results_dir = 'benchmarks'
+
+# Run used for the trial log and full-run benchmarks
+bench_sub, bench_run = '01', 1
+
+# Modules teaching_task.py imports at startup, and how long their own
+# top-level code may take to import (in seconds; NumPy is not counted).
+# psychopy should only be imported once a window is opened.
+startup_modules = ('teaching_game_logic', 'teaching_window', 'teaching_frames', 'teaching_datalog', 'teaching_timing')
+import_budget = .05
+
+### BENCHMARKS ###
+# Each benchmark sets up its inputs, then returns a function that does the
+# thing being timed once (one call, one frame, one trial, one run)
+def open_window(render=False):
+    return window.open_window(headless=True, size=(800, 600), color='black', render=render)
+
+# Helper function: Board state with a few examples on the true hypothesis
+def example_state(prob, n):
+    state = game.new_board()
+    for r, c in np.argwhere(prob['A'] == 1)[:n]:
+        state = game.add_example(state, r, c)
+    return state
+
+def bench_draw_canvas(w):
+    prob = game.load()[0]
+    state = example_state(prob, 2)
+    def call():
+        stim.draw_canvas(prob, state, w, True)
+        w.draw_calls.clear()
+    return call
+
+# Canvas with a new board state on every call (recolors every tile)
+def bench_draw_canvas_recolor(w):
+    prob = game.load()[0]
+    states = [example_state(prob, n) for n in range(3)]
+    i = 0
+    def call():
+        nonlocal i
+        i = (i + 1) % len(states)
+        stim.draw_canvas(prob, states[i], w, True)
+        w.draw_calls.clear()
+    return call
+
+def bench_draw_hypotheses(w):
+    prob = game.load()[0]
+    order = ['B', 'A', 'D', 'C']
+    def call():
+        stim.draw_hypotheses(prob, order, w, True)
+        w.draw_calls.clear()
+    return call
+
+def bench_draw_cursor(w):
+    positions = [(r, c, color) for r in range(6) for c in range(6) for color in range(4)]
+    i = 0
+    def call():
+        nonlocal i
+        i = (i + 1) % len(positions)
+        stim.draw_cursor(*positions[i], w)
+        w.draw_calls.clear()
+    return call
+
+def bench_draw_scale(w):
+    def call():
+        stim.draw_scale(w)
+        w.draw_calls.clear()
+    return call
+
+# Everything drawn on one frame of a choose trial (see game.choose), then flipped
+def bench_frame_choose(w):
+    prob = game.load()[0]
+    state = example_state(prob, 1)
+    order = ['B', 'A', 'D', 'C']
+    def call():
+        stim.draw_cursor(2, 3, 1, w)
+        stim.draw_canvas(prob, state, w, True)
+        stim.draw_hypotheses(prob, order, w, True)
+        w.flip()
+    return call
+
+# Everything drawn on one frame of a study trial (see game.study), then flipped
+def bench_frame_study(w):
+    visual = window.visual_for(w)
+    prob = game.load()[0]
+    state = game.new_board()
+    order = ['B', 'A', 'D', 'C']
+    study_stim = visual.TextStim(w, text='Study problem', pos=(0, -.72))
+    def call():
+        stim.draw_canvas(prob, state, w, True)
+        stim.draw_hypotheses(prob, order, w, True)
+        study_stim.draw()
+        w.flip()
+    return call
+
+# One keypress during a choose trial (prints included, as in the task)
+def bench_update_location(w):
+    prob = game.load()[0]
+    sqs = np.add(prob['A'], example_state(prob, 1))
+    keys = [key for key in game.keylist if key != 'q']
+    i = 0
+    def call():
+        nonlocal i
+        i = (i + 1) % len(keys)
+        game.update_location(sqs, 2, 3, keys[i])
+    return call
+
+# Helper function: Trial records of a simulated run, as saved by the task
+def run_records():
+    timing = teaching_timing.load().load_run(bench_sub, bench_run)
+    game.key_source = sim.RandomKeys(seed=0)
+    try:
+        w = open_window()
+        return game.run(w, window.run_clock(w), timing, [], corners=[(0,0),(0,5),(5,0),(5,5)])
+    finally:
+        game.key_source = None
+
+# Saving one trial: handing the record off to the trial log (what the trial
+# loop waits for), and serializing it (what the writer thread does)
+def bench_trial_log_append(w):
+    records = run_records()
+    log = datalog.TrialLog(os.path.join(tempfile.mkdtemp(), 'bench_behavioral.json'))
+    i = 0
+    def call():
+        nonlocal i
+        i = (i + 1) % len(records)
+        log.append(records[i])
+    return call
+
+# Helper function: Checkpoint in the middle of a run (see teaching_game_logic.run)
+def bench_checkpoint():
+    return {'ons': 100.5, 'problem_counter': 1, 'last_problem': 1, 'state': game.new_board(),
+            'cursor': (2, 3), 'corners': [(0, 0), (5, 5)], 'highlight': (2, 3)}
+
+# Saving one trial with a checkpoint of the trial loop (see teaching_checkpoint),
+# and saving the checkpoint (what the writer thread does after each record)
+def bench_trial_log_checkpoint(w):
+    records = run_records()
+    out_file = os.path.join(tempfile.mkdtemp(), 'bench_behavioral.json')
+    log = datalog.TrialLog(out_file, datalog.checkpoint_file(out_file))
+    i = 0
+    def call():
+        nonlocal i
+        i = (i + 1) % len(records)
+        log.append(records[i], bench_checkpoint())
+    return call
+
+def bench_checkpoint_save(w):
+    out_file = os.path.join(tempfile.mkdtemp(), 'bench_checkpoint.json')
+    checkpoint = bench_checkpoint()
+    return lambda: datalog.save_checkpoint(out_file, checkpoint)
+
+def bench_trial_serialize(w):
+    records = [rec for rec in run_records() if rec['type'] == 'choose']
+    i = 0
+    def call():
+        nonlocal i
+        i = (i + 1) % len(records)
+        json.dumps(records[i], default=datalog.to_json)
+    return call
+
+# Saving a whole run at the end (see save_data in teaching_task.py)
+def bench_save_data(w):
+    records = run_records()
+    out_dir = tempfile.mkdtemp()
+    def call():
+        out_file = os.path.join(out_dir, 'bench_behavioral.json')
+        log = datalog.TrialLog(out_file)
+        for rec in records:
+            log.append(rec)
+        log.finalize()
+        os.remove(datalog.stream_file(out_file))
+    return call
+
+# A full run (timing file) with a simulated participant, on a virtual clock
+def bench_full_run(w):
+    timing = teaching_timing.load().load_run(bench_sub, bench_run)
+    def call():
+        run_w = open_window(w.render)
+        game.key_source = sim.RandomKeys(seed=0)
+        try:
+            game.run(run_w, window.run_clock(run_w), timing, [], corners=[(0,0),(0,5),(5,0),(5,5)])
+        finally:
+            game.key_source = None
+    return call
+
+benchmarks = {
+    'draw_canvas': bench_draw_canvas,
+    'draw_canvas_recolor': bench_draw_canvas_recolor,
+    'draw_hypotheses': bench_draw_hypotheses,
+    'draw_cursor': bench_draw_cursor,
+    'draw_scale': bench_draw_scale,
+    'frame_choose': bench_frame_choose,
+    'frame_study': bench_frame_study,
+    'update_location': bench_update_location,
+    'trial_log_append': bench_trial_log_append,
+    'trial_log_checkpoint': bench_trial_log_checkpoint,
+    'checkpoint_save': bench_checkpoint_save,
+    'trial_serialize': bench_trial_serialize,
+    'save_data': bench_save_data,
+    'full_run': bench_full_run,
+}
+
+### TIMING ###
+# Helper function: Seconds per call (best of repeat rounds, each at least .2 s long)
+def time_call(fn, repeat=5):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number))/number
+
+# Helper function: Benchmarks whose names contain any of patterns (all by default)
+def select(patterns=None):
+    return [name for name in benchmarks if not patterns or any(p in name for p in patterns)]
+
+# main method: run benchmarks, as {name: seconds per call}
+def run_benchmarks(names, repeat=5, render=False):
+    results = {}
+    w = open_window(render)
+    for name in names:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results[name] = time_call(benchmarks[name](w), repeat)
+        print('%-22s %12.3f us' % (name, results[name]*1e6))
+    return results
+
+### IMPORT TIME ###
+# Import times of every module imported by importing modules, in a fresh
+# interpreter: {name: (own time, time including its imports)}, in seconds,
+# and the total time
+def import_times(modules=startup_modules):
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + ', '.join(modules)],
+                         capture_output=True, text=True, check=True)
+    times, total = {}, 0.
+    for line in out.stderr.splitlines():
+        fields = line.replace('import time:', '').split('|')
+        if len(fields) == 3 and fields[0].strip().isdigit():
+            times[fields[2].strip()] = (int(fields[0])/1e6, int(fields[1])/1e6)
+            if not fields[2][1:].startswith(' '): # imported by -c, not by another module
+                total += int(fields[1])/1e6
+    return times, total
+
+# Check startup imports against import_budget: returns a list of problems
+def check_imports(budget=import_budget):
+    times, total = import_times()
+    own = sum(own for name, (own, _) in times.items() if name.startswith('teaching_'))
+    print('%-22s %12.3f ms (budget: %.0f ms; %.0f ms with NumPy etc.)' % ('import', own*1000, budget*1000, total*1000))
+
+    errors = []
+    if own > budget:
+        errors.append('Importing the task takes %.1f ms (budget: %.0f ms)' % (own*1000, budget*1000))
+    heavy = sorted(name for name in times if name.split('.')[0] == 'psychopy')
+    if heavy:
+        errors.append('psychopy is imported at startup (%s)' % ', '.join(heavy[:3]))
+    return errors
+
+### BASELINES ###
+def machine_info(render):
+    return {'host': socket.gethostname(), 'platform': platform.platform(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'render': render}
+
+def baseline_file(render=False):
+    return os.path.join(results_dir, 'baseline_%s%s.json' % (socket.gethostname(), '_render' if render else ''))
+
+def save_results(out_file, results, render):
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    with open(out_file + '.tmp', 'w') as out:
+        json.dump({'machine': machine_info(render), 'time': time.time(), 'results': results}, out, indent=1)
+    os.replace(out_file + '.tmp', out_file)
+
+# Benchmarks that got slower than the baseline by more than threshold (e.g.
+# .2 = 20%), as {name: (baseline, now)}
+def regressions(results, baseline, threshold):
+    return {name: (baseline[name], secs) for name, secs in results.items()
+            if name in baseline and secs > baseline[name]*(1 + threshold)}
+
+# Helper function: Time benchmarks that look slower again (timings are
+# noisy), keeping the faster of the two times
+def confirm(results, names, repeat=5, render=False):
+    print('Timing %i benchmarks again: %s' % (len(names), ', '.join(names)))
+    again = run_benchmarks(names, repeat, render)
+    return dict(results, **{name: min(results[name], secs) for name, secs in again.items()})
+
+if __name__ == '__main__':
+    # Usage: python teaching_benchmark.py                  (compare against this machine's baseline)
+    #        python teaching_benchmark.py -save            (make these results the new baseline)
+    #        python teaching_benchmark.py --only draw_     (only some benchmarks)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', nargs='+', help='Only run benchmarks whose names contain these (or "import")')
+    parser.add_argument('--repeat', type=int, default=5, help='Rounds per benchmark (the best one counts)')
+    parser.add_argument('--threshold', type=float, default=.25,
+                        help='Fail if a benchmark is slower than the baseline by more than this fraction')
+    parser.add_argument('--baseline', help='Baseline file (default: one per machine, in %s/)' % results_dir)
+    parser.add_argument('-save', action='store_true', help='Use this flag to save results as the new baseline')
+    parser.add_argument('-render', action='store_true', help='Use this flag to rasterize frames (headless window)')
+    args = parser.parse_args()
+
+    import_errors = check_imports() if not args.only or 'import' in args.only else []
+    for msg in import_errors:
+        print('IMPORT %s' % msg)
+    names = select(args.only)
+    if not names:
+        sys.exit(1 if import_errors else 0)
+
+    results = run_benchmarks(names, args.repeat, args.render)
+    save_results(os.path.join(results_dir, 'results_%i.json' % time.time()), results, args.render)
+
+    # Baselines are updated with the benchmarks that were run
+    in_file = args.baseline or baseline_file(args.render)
+    baseline = {'results': {}}
+    if os.path.exists(in_file):
+        with open(in_file) as f:
+            baseline = json.load(f)
+    if args.save or not baseline['results']:
+        save_results(in_file, dict(baseline['results'], **results), args.render)
+        print('Saved baseline: %s' % in_file)
+        sys.exit(1 if import_errors else 0)
+
+    if baseline['machine'] != machine_info(args.render):
+        print('Warning: baseline was measured on a different setup: %s' % baseline['machine'])
+
+    slower = regressions(results, baseline['results'], args.threshold)
+    if slower:
+        results = confirm(results, list(slower), args.repeat, args.render)
+        slower = regressions(results, baseline['results'], args.threshold)
+    for name, (before, now) in slower.items():
+        print('REGRESSION %s: %.3f us -> %.3f us (%+.0f%%)' % (name, before*1e6, now*1e6, (now/before - 1)*100))
+    if slower or import_errors:
+        sys.exit(1)
+    print('No regressions (threshold: %+.0f%%, baseline: %s)' % (args.threshold*100, in_file))
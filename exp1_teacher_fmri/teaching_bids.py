@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, glob, hashlib, json, os, re, time
+from concurrent.futures import ProcessPoolExecutor
+
+import teaching_datalog as datalog
+
+# Behavioral files from the scanner task (practice and simulated runs are skipped)
+behavioral_pattern = re.compile(r'sub-(\d+)_task-teaching_run-(\d+)_behavioral_(\d+)\.jsonl?$')
+
+# Bookkeeping of converted files, saved in the output folder (dotfiles are
+# ignored by the BIDS validator)
+manifest_name = '.teaching_bids_manifest.json'
+
+# Trial types written to events.tsv (pauses are the implicit baseline)
+event_types = ('study', 'choose', 'pre', 'show', 'rate')
+
+columns = ('onset', 'duration', 'trial_type', 'scheduled_onset', 'problem', 'problem_idx', 'ex_idx',
+           'order', 'example_row', 'example_col', 'cursor_row', 'cursor_col', 'n_moves',
+           'response_time', 'rating')
+
+# Column descriptions (task-teaching_events.json)
+sidecar = {
+    'onset': {'Description': 'Onset from the first volume kept (true onset, as measured by the task)', 'Units': 's'},
+    'duration': {'Description': 'Time the trial was on screen (true duration, as measured by the task)', 'Units': 's'},
+    'trial_type': {'Description': 'Trial or event type',
+                   'Levels': {'study': 'Teacher studies the problem',
+                              'choose': 'Teacher picks an example',
+                              'pre': 'Cue before the student\'s view',
+                              'show': 'Example shown from the student\'s view',
+                              'rate': 'Teacher rates how likely the student is to be right',
+                              'move': 'Keypress during a choose trial'}},
+    'scheduled_onset': {'Description': 'Onset in the timing file, from the scanner trigger', 'Units': 's'},
+    'problem': {'Description': 'Index of the teaching problem in inputs/problems.json'},
+    'problem_idx': {'Description': 'Position of the problem in the run (0-3)'},
+    'ex_idx': {'Description': 'Example # within the problem (0-2)'},
+    'order': {'Description': 'Order in which hypotheses were shown (A is the true hypothesis)'},
+    'example_row': {'Description': 'Row of the example chosen (choose) or shown (pre, show)'},
+    'example_col': {'Description': 'Column of the example chosen (choose) or shown (pre, show)'},
+    'cursor_row': {'Description': 'Cursor row after the keypress (move)'},
+    'cursor_col': {'Description': 'Cursor column after the keypress (move)'},
+    'n_moves': {'Description': 'Keypresses during the choose trial'},
+    'response_time': {'Description': 'Time from the scheduled trial onset to the response', 'Units': 's'},
+    'rating': {'Description': 'Rating on the 0-4 scale (rate)'}
+}
+
+### READING BEHAVIORAL FILES ###
+# Yield trial records one at a time, without loading the whole file: either
+# a JSON array (saved at the end of a run) or one record per line (streamed
+# during the run, see teaching_datalog)
+def iter_records(in_file, chunk_size=1 << 16):
+    with open(in_file) as f:
+        if in_file.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buf = f.read(chunk_size).lstrip()
+        if not buf.startswith('['):
+            raise ValueError('Not a JSON array: %s' % in_file)
+        buf = buf[1:]
+        while True:
+            buf = buf.lstrip(' \t\r\n,')
+            if buf.startswith(']'):
+                return
+            try:
+                record, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buf += more
+                continue
+            yield record
+            buf = buf[end:]
+
+### CONVERTING TO EVENTS ###
+# Helper function: Value as written to a TSV file
+def to_tsv(x):
+    if x is None:
+        return 'n/a'
+    if isinstance(x, float):
+        return '%.4f' % x
+    return str(x)
+
+# Turn trial records into BIDS events (dicts with keys in columns); times are
+# shifted so that 0 is the first volume kept (offset = dummy scans * TR)
+def to_events(records, offset=0.):
+    example = None
+    for rec in records:
+        if rec['type'] not in event_types:
+            continue
+
+        event = dict.fromkeys(columns)
+        event.update({
+            'onset': rec['true_ons'] - offset,
+            'duration': rec['true_dur'],
+            'trial_type': rec['type'],
+            'scheduled_onset': float(rec['ons']),
+            'problem': rec['problem'],
+            'problem_idx': rec['problem_idx'],
+            'ex_idx': rec.get('ex_idx'),
+            'order': ''.join(rec['order'])
+        })
+
+        if rec['type'] == 'choose':
+            example = rec['example']
+            event['n_moves'] = len(rec['movements'])
+            event['response_time'] = rec['rt']
+        elif rec['type'] == 'rate':
+            event['rating'] = rec['rating']
+            event['response_time'] = rec['rt']
+        if rec['type'] in ('choose', 'pre', 'show') and example is not None:
+            event['example_row'], event['example_col'] = example
+        yield event
+
+        # Every keypress during choose trials
+        if rec['type'] == 'choose':
+            for (r, c), rt in rec['movements']:
+                move = dict.fromkeys(columns)
+                move.update({
+                    'onset': rec['ons'] + rt - offset,
+                    'duration': 0.,
+                    'trial_type': 'move',
+                    'problem': rec['problem'],
+                    'problem_idx': rec['problem_idx'],
+                    'ex_idx': rec['ex_idx'],
+                    'cursor_row': r,
+                    'cursor_col': c,
+                    'response_time': rt
+                })
+                yield move
+
+# Helper function: BIDS name of one part of a run. A resumed run is scanned
+# again from its own trigger, so each resumed part is its own scan, labeled
+# acq-resume1, acq-resume2... (see find_runs)
+def scan_name(sub, run, part=0):
+    acq = '_acq-resume%i' % part if part else ''
+    return 'sub-%s_task-teaching%s_run-%s' % (sub, acq, run)
+
+# Helper function: Where to save a run's events
+def events_file(out_dir, sub, run, part=0):
+    return os.path.join(out_dir, 'sub-%s' % sub, 'func', scan_name(sub, run, part) + '_events.tsv')
+
+# Convert one behavioral file (runs in a worker process)
+def convert(args):
+    in_file, out_file, offset = args
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+
+    # Events come out in time order (keypresses fall within their choose trial)
+    n_events = 0
+    tmp_file = out_file + '.%i.tmp' % os.getpid()
+    with open(tmp_file, 'w') as out:
+        out.write('\t'.join(columns) + '\n')
+        for event in to_events(iter_records(in_file), offset):
+            out.write('\t'.join(to_tsv(event[col]) for col in columns) + '\n')
+            n_events += 1
+    os.replace(tmp_file, out_file)
+    return in_file, n_events
+
+### BOOKKEEPING ###
+# Helper function: Hash of a file's contents
+def file_hash(in_file):
+    h = hashlib.sha1()
+    with open(in_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, manifest_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(out_dir, manifest):
+    out_file = os.path.join(out_dir, manifest_name)
+    tmp_file = out_file + '.tmp'
+    with open(tmp_file, 'w') as out:
+        json.dump(manifest, out, indent=1, sort_keys=True)
+    os.replace(tmp_file, out_file)
+
+# Helper function: Has a file changed since it was last converted? Files with
+# a new mtime are compared by hash. Returns (changed, manifest entry).
+def check_file(in_file, entry):
+    stat = os.stat(in_file)
+    if entry is not None and os.path.exists(entry['out_file']):
+        if (entry['mtime'], entry['size']) == (stat.st_mtime, stat.st_size):
+            return False, entry
+        sha1 = file_hash(in_file)
+        if entry['sha1'] == sha1:
+            return False, dict(entry, mtime=stat.st_mtime)
+    else:
+        sha1 = file_hash(in_file)
+    return True, {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': sha1}
+
+# Latest recording of every run in a folder: {(sub, run): [file, ...]}. A
+# run that was interrupted and resumed (see teaching_checkpoint) has several
+# parts, in order: the file it was resumed from, then the resumed file(s).
+# Finalized (.json) files are used over streamed ones (.jsonl) from the same run.
+def find_runs(data_dir):
+    files, latest = {}, {}
+    for in_file in glob.glob(os.path.join(data_dir, '*_behavioral_*.json*')):
+        match = behavioral_pattern.match(os.path.basename(in_file))
+        if match is None:
+            continue
+        sub, run, tstamp = match.groups()
+        name = os.path.splitext(os.path.basename(in_file))[0]
+        if name not in files or in_file.endswith('.json'):
+            files[name] = in_file
+        if (sub, run) not in latest or int(tstamp) > latest[(sub, run)][0]:
+            latest[(sub, run)] = (int(tstamp), name)
+
+    runs = {}
+    for key, (_, name) in latest.items():
+        parts = []
+        while name in files and files[name] not in parts:
+            parts.append(files[name])
+            resume = datalog.load_resume(files[name])
+            name = resume['resumed_from'] if resume is not None else None
+        runs[key] = parts[::-1]
+    return runs
+
+# main method: convert every run in data_dir that changed since the last export
+def export(data_dir='data', out_dir='bids', offset=0., workers=None, force=False):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {} if force else load_manifest(out_dir)
+
+    # Files are converted again when the converter changes
+    version = file_hash(__file__)
+
+    jobs, entries = [], {}
+    for (sub, run), parts in sorted(find_runs(data_dir).items()):
+        for part, in_file in enumerate(parts):
+            out_file = events_file(out_dir, sub, run, part)
+            changed, entry = check_file(in_file, manifest.get(in_file))
+            if (entry.get('offset', offset) != offset or entry.get('version', version) != version or
+                    entry.get('out_file', out_file) != out_file):
+                changed = True
+            entry.update(out_file=out_file, offset=offset, version=version)
+            entries[in_file] = entry
+            if changed:
+                jobs.append((in_file, out_file, offset))
+
+    results = []
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(convert, jobs))
+
+    # Column descriptions, shared by all runs
+    sidecar_file = os.path.join(out_dir, 'task-teaching_events.json')
+    if not os.path.exists(sidecar_file):
+        with open(sidecar_file, 'w') as out:
+            json.dump(sidecar, out, indent=4)
+
+    manifest.update(entries)
+    save_manifest(out_dir, manifest)
+    return results, len(entries) - len(jobs)
+
+if __name__ == '__main__':
+    # Usage: python teaching_bids.py --data data --out bids
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default='data', help='Folder with behavioral files')
+    parser.add_argument('--out', default='bids', help='BIDS folder to write events.tsv files to')
+    parser.add_argument('--dummy-scans', type=int, default=0,
+                        help='Volumes discarded at the start of each run (onsets are shifted by this many TRs)')
+    parser.add_argument('--tr', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('-force', action='store_true', help='Use this flag to convert every file again')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    results, n_skipped = export(args.data, args.out, args.dummy_scans*args.tr, args.workers, args.force)
+    for in_file, n_events in results:
+        print('%s: %i events' % (in_file, n_events))
+    print('Converted %i runs, skipped %i unchanged (%.1f s)' % (len(results), n_skipped, time.time() - t0))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, ast, functools, hashlib, importlib.util, json, os, time
+import numpy as np
+
+import teaching_bids as bids
+import teaching_problems
+
+# Derived products of behavioral files (learner posteriors, confounds...) are
+# cached here, one file per product: <kind>/<key>.npy for arrays, .json for
+# anything else. The key is a hash of everything the product depends on: the
+# contents of its source files (behavioral file, problems.json...), the
+# source code of the modules that compute it, and its parameters. A product
+# is never out of date: when anything changes, it gets a new key, and the old
+# one is evicted once the cache is full (least recently used first).
+cache_dir = os.path.join(teaching_problems.cache_dir, 'derived')
+max_bytes = 1 << 30
+
+# Hashes of source files, by path, mtime and size, so unchanged files are not read again
+hash_index_name = 'hashes.json'
+
+### KEYS ###
+# Helper function: Source file of a module, by name (without importing it)
+def module_file(name):
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.origin is None:
+        raise ImportError('No module named %s' % name)
+    return spec.origin
+
+# Helper function: Source files of modules and of every module of this
+# experiment they import, directly or not (imports inside functions too), so
+# a change anywhere in the code a product depends on gives it a new key
+@functools.lru_cache(maxsize=None)
+def module_files(names):
+    files = {}
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        if name in files:
+            continue
+        files[name] = module_file(name)
+        with open(files[name]) as f:
+            tree = ast.parse(f.read(), files[name])
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imported = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                imported = [node.module]
+            else:
+                continue
+            for other in imported:
+                spec = importlib.util.find_spec(other.split('.')[0])
+                if (spec is not None and spec.origin is not None and
+                    os.path.dirname(spec.origin) == os.path.dirname(files[name])):
+                    todo.append(spec.name)
+    return [files[name] for name in sorted(files)]
+
+### CACHE ###
+class DerivedCache:
+    def __init__(self, cache_dir=cache_dir, max_bytes=max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hashes = self.load_hashes()
+        self.n_hits, self.n_misses = 0, 0
+
+    def load_hashes(self):
+        try:
+            with open(os.path.join(self.cache_dir, hash_index_name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # Hash of a file's contents; files with a new mtime or size are hashed again
+    def file_hash(self, in_file):
+        path = os.path.abspath(in_file)
+        stat = os.stat(path)
+        entry = self.hashes.get(path)
+        if entry is None or (entry[0], entry[1]) != (stat.st_mtime, stat.st_size):
+            entry = self.hashes[path] = [stat.st_mtime, stat.st_size, bids.file_hash(path)]
+        return entry[2]
+
+    # Key of a product: source files, files it depends on (e.g. problems.json),
+    # modules that compute it (by name, e.g. 'teaching_model', along with
+    # everything they import) and parameters
+    def key(self, kind, in_files, deps=(), modules=(), params=None):
+        h = hashlib.sha1(kind.encode())
+        for in_file in list(in_files) + list(deps) + module_files(tuple(modules)):
+            h.update(self.file_hash(in_file).encode())
+        h.update(json.dumps(params, sort_keys=True).encode())
+        return h.hexdigest()
+
+    # Helper function: Where a product is saved
+    def entry_file(self, kind, key, ext):
+        return os.path.join(self.cache_dir, kind, key + ext)
+
+    # main method: a product (None if it is not cached). Reading it marks it
+    # as recently used.
+    def get(self, kind, key):
+        for ext in ('.npy', '.json'):
+            in_file = self.entry_file(kind, key, ext)
+            try:
+                if ext == '.npy':
+                    value = np.load(in_file)
+                else:
+                    with open(in_file) as f:
+                        value = json.load(f)
+            except (OSError, ValueError):
+                continue
+            try:
+                os.utime(in_file)
+            except OSError:
+                pass
+            self.n_hits += 1
+            return value
+        self.n_misses += 1
+        return None
+
+    def put(self, kind, key, value):
+        ext = '.npy' if isinstance(value, np.ndarray) else '.json'
+        out_file = self.entry_file(kind, key, ext)
+        try:
+            os.makedirs(os.path.dirname(out_file), exist_ok=True)
+            tmp_file = out_file + '.%i.tmp' % os.getpid()
+            with open(tmp_file, 'wb' if ext == '.npy' else 'w') as out:
+                if ext == '.npy':
+                    np.save(out, value)
+                else:
+                    json.dump(value, out, separators=(',', ':'))
+            os.replace(tmp_file, out_file)
+        except OSError:
+            print('Could not cache %s to: %s' % (kind, out_file))
+
+    # Every cached product, as (last used, size, file), least recently used first
+    def entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if root == self.cache_dir:
+                    continue # the hash index
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    # Remove least recently used products until the cache fits in max_bytes
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        n_removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            n_removed += 1
+        return n_removed, total
+
+    # Save the hash index (dropping files that are gone) and evict
+    def save(self):
+        self.hashes = {path: entry for path, entry in self.hashes.items() if os.path.exists(path)}
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            out_file = os.path.join(self.cache_dir, hash_index_name)
+            tmp_file = out_file + '.%i.tmp' % os.getpid()
+            with open(tmp_file, 'w') as out:
+                json.dump(self.hashes, out, separators=(',', ':'))
+            os.replace(tmp_file, out_file)
+        except OSError:
+            print('Could not save file hashes to: %s' % self.cache_dir)
+        return self.evict()
+
+if __name__ == '__main__':
+    # Usage: python teaching_cache.py (shows what is in the cache)
+    #        python teaching_cache.py --max-mb 200 (evicts down to 200 MB)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=cache_dir)
+    parser.add_argument('--max-mb', type=float, default=max_bytes/2**20, help='Cache size limit (MB)')
+    args = parser.parse_args()
+
+    cache = DerivedCache(args.dir, int(args.max_mb*2**20))
+    n_removed, total = cache.save()
+    by_kind = {}
+    for last_used, size, path in cache.entries():
+        kind = os.path.basename(os.path.dirname(path))
+        n, kind_size, oldest = by_kind.get(kind, (0, 0, last_used))
+        by_kind[kind] = (n + 1, kind_size + size, min(oldest, last_used))
+    for kind, (n, size, oldest) in sorted(by_kind.items()):
+        print('%s: %i products, %.1f MB, oldest used %s' %
+              (kind, n, size/2**20, time.strftime('%Y-%m-%d %H:%M', time.localtime(oldest))))
+    print('Evicted %i products; %.1f MB of %.0f MB used' % (n_removed, total/2**20, args.max_mb))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import glob, json, os, re
+
+import teaching_datalog as datalog
+import teaching_timing
+
+# A checkpoint holds the state of the trial loop (see teaching_game_logic.run)
+# after the last trial that was saved: that trial's onset in the timing file,
+# the problem counter, the last problem that had a trial, board state,
+# cursor, remaining corners and highlighted example. It is written by the
+# trial log's writer thread (see teaching_datalog.TrialLog), after the trial
+# itself, so it never runs ahead of the saved data and costs the trial loop
+# nothing beyond the hand-off.
+
+### RESUMING RUNS ###
+def load(in_file):
+    with open(in_file) as f:
+        return json.load(f)
+
+# Latest checkpoint for a run (None if there is none)
+def latest(sub, run, data_dir='data'):
+    pattern = os.path.join(data_dir, 'sub-%s_task-teaching_run-%02d_checkpoint_*.json' %
+                           (teaching_timing.sub_label(sub), run))
+    files = [(int(re.search(r'_checkpoint_(\d+)', f).group(1)), f) for f in glob.glob(pattern)]
+    return max(files)[1] if files else None
+
+# Trials left after a checkpoint, from the next problem boundary: a problem
+# that was interrupted is skipped, and onsets are shifted so that
+# the first problem left starts after the run's usual lead-in (rounded up to
+# whole images, so trials keep their place relative to image onsets). Returns
+# (timing, offset, corners): add offset to the new onsets to get the ones in
+# the timing file; corners are where the cursor starts on the problems left.
+def resume_timing(timing, checkpoint, tr=teaching_timing.tr):
+    last_ons = checkpoint['ons']
+    start = next((i for i, trial in enumerate(timing)
+                  if trial['ons'] > last_ons and trial.get('problem_idx', -1) > checkpoint['last_problem']), None)
+    if start is None:
+        raise ValueError('No problems left after the checkpoint (last trial at %.2f s)' % last_ons)
+
+    lead_in = timing[0]['dur'] if timing[0]['type'] == 'pause' else 0.
+    offset = (timing[start]['ons'] - lead_in)//tr*tr
+    lead_in = timing[start]['ons'] - offset
+
+    resumed = [{'type': 'pause', 'ons': 0, 'dur': teaching_timing.to_number(round(lead_in, 6))}]
+    for trial in timing[start:]:
+        resumed.append(dict(trial, ons=teaching_timing.to_number(round(trial['ons'] - offset, 6))))
+
+    # The cursor for a problem is drawn when the problem comes up (or when the
+    # run starts), so put it back if that problem never started
+    corners = checkpoint['corners']
+    if checkpoint['last_problem'] < checkpoint['problem_counter']:
+        corners = corners + [checkpoint['cursor']]
+    return resumed, offset, [tuple(corner) for corner in corners]
+
+# Save how a run was resumed next to its behavioral file: the checkpoint, the
+# behavioral file it continues, the offset, # of images and the trials left
+# (onsets from the new scanner trigger). Analyses use it to keep every part of
+# the run and line them up with their scans (see teaching_bids.find_runs).
+def save_resume(out_file, ckpt_file, timing, offset, n_images):
+    resumed_from = os.path.basename(ckpt_file).replace('_checkpoint_', '_behavioral_')
+    datalog.save_checkpoint(datalog.resume_file(out_file), {
+        'checkpoint': ckpt_file,
+        'resumed_from': os.path.splitext(resumed_from)[0],
+        'offset': offset,
+        'n_images': int(n_images),
+        'timing': timing
+    })
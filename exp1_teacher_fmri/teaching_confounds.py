@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, collections, functools, os, time
+import numpy as np
+
+import teaching_bids as bids
+import teaching_datalog as datalog
+import teaching_problems
+import teaching_stimuli as stim
+import teaching_timing
+
+# Screen size in pixels (as in teaching_task.py); line widths are in pixels
+screen_size = (800, 600)
+
+# Luminance of RGB (0-255) colors, Rec. 709 weights on gamma-encoded values
+# (0-1), as in teaching_render
+luma_weights = np.array([.2126, .7152, .0722])/255
+
+columns = ('luminance', 'lit_tiles', 'cursor_displacement', 'keypresses')
+
+### SCREEN GEOMETRY ###
+# Everything on screen is a rectangle; areas are fractions of the screen
+# (normalized units: 2 x 2). Text (fixation cross, instructions, letters,
+# rating scale) is not modelled.
+def to_luminance(colors):
+    return np.asarray(colors, dtype=float) @ luma_weights
+
+# Helper function: Rectangle (x0, x1, y0, y1) from its center and size
+def rect(pos, size):
+    return np.array([pos[0] - size[0]/2, pos[0] + size[0]/2, pos[1] - size[1]/2, pos[1] + size[1]/2])
+
+# Helper function: Area where rectangles a (..., 4) and b (4,) overlap
+def overlap(a, b):
+    dx = np.minimum(a[..., 1], b[1]) - np.maximum(a[..., 0], b[0])
+    dy = np.minimum(a[..., 3], b[3]) - np.maximum(a[..., 2], b[2])
+    return np.clip(dx, 0, None)*np.clip(dy, 0, None)
+
+def area(r):
+    return (r[..., 1] - r[..., 0])*(r[..., 3] - r[..., 2])
+
+canvas_area = stim.canv_sq_size**2*stim.aspect/4
+hypothesis_tile = (stim.sq_size, stim.sq_size*stim.aspect)
+hypothesis_area = stim.sq_size**2*stim.aspect/4
+
+# The cursor is drawn under its tile, so only a ring around it shows
+cursor_area = (1.2**2 - 1)*canvas_area
+
+# Border around the true hypothesis (teacher view): lines are centered on
+# the edge of the rectangle, and cover part of the hypothesis' tiles.
+# Returns (area, visible fraction of each tile).
+@functools.lru_cache(maxsize=None)
+def border_geometry():
+    center = stim.hypothesis_centers[0]
+    size = (6*stim.sq_size + .085, (4/3)*(6*stim.sq_size + .085))
+    line = (30*2/screen_size[0], 30*2/screen_size[1])
+    outer = rect(center, (size[0] + line[0], size[1] + line[1]))
+    inner = rect(center, (size[0] - line[0], size[1] - line[1]))
+
+    tiles = np.array([rect(xy, hypothesis_tile) for xy in stim.layout()['hypothesis_locations'][0]])
+    covered = (overlap(tiles, outer) - overlap(tiles, inner))/area(tiles)
+    return (area(outer) - area(inner))/4, (1 - covered).reshape(6, 6)
+
+# Luminance of every color in colordict
+canvas_lum = to_luminance(stim.colordict['canvas'])
+cursor_lum = to_luminance(stim.colordict['cursor'])
+hypothesis_lum = to_luminance(stim.colordict['hypothesis'])
+true_lum = to_luminance(stim.colordict['true'])
+
+# Compiled problems (scanner runs only; see teaching_bids.behavioral_pattern),
+# loaded on first use
+problems_file = 'inputs/problems.json'
+
+@functools.lru_cache(maxsize=None)
+def load_problems():
+    return teaching_problems.load_grids(problems_file)
+
+# Code the confounds depend on (cached confounds are computed again if it, or
+# anything it imports, changes: see teaching_cache.module_files)
+cache_modules = ('teaching_confounds',)
+
+### SCREEN STATES ###
+# Views of the board (no board: text-only trials)
+no_board, teacher_view, student_view = 0, 1, 2
+
+# Helper function: Where the cursor starts on a problem (see
+# teaching_simulate.replay_corners): one keypress away from the first move
+def start_cursor(rec):
+    if not rec['movements']:
+        return tuple(rec['cursor'])
+    r1, c1 = rec['movements'][0][0]
+    return [corner for corner in [(0,0),(0,5),(5,0),(5,5)] if abs(corner[0] - r1) + abs(corner[1] - c1) <= 1][0]
+
+# Split a run into stretches of time where the screen doesn't change, as
+# (start, end, problem, view, cursor color or -1, board state), following
+# teaching_game_logic.run(). Also returns keypresses as (time, tiles moved).
+def run_segments(records):
+    segments, moves = [], []
+    state = np.zeros((6, 6), dtype=np.uint8)
+    highlight = None
+    cursor = None
+
+    for rec in records:
+        start, end = rec['true_ons'], rec['true_ons'] + rec['true_dur']
+        problem = rec.get('problem', -1)
+
+        if rec['type'] == 'study':
+            state = np.zeros((6, 6), dtype=np.uint8)
+            segments.append((start, end, problem, teacher_view, -1, state))
+
+        elif rec['type'] == 'choose':
+            if rec['ex_idx'] == 0:
+                cursor = start_cursor(rec)
+            sqs = load_problems()[problem, 0] + state
+
+            # The cursor changes color as it moves, then when an example is picked
+            t0, (r, c) = start, cursor
+            for (r1, c1), rt in rec['movements']:
+                key_t = min(max(rec['ons'] + rt, start), end)
+                moves.append((key_t, abs(r1 - r) + abs(c1 - c)))
+                segments.append((t0, key_t, problem, teacher_view, sqs[r, c], state))
+                t0, (r, c) = key_t, (r1, c1)
+            segments.append((t0, end, problem, teacher_view, 3 if rec['example'] is not None else sqs[r, c], state))
+
+            state = np.array(rec['state'], dtype=np.uint8)
+            cursor = tuple(rec['cursor'])
+            highlight = cursor if rec['example'] is not None else None
+
+        elif rec['type'] == 'show':
+            segments.append((start, end, problem, student_view, -1 if highlight is None else 3, state))
+
+        else: # pause, pre, rate: text only
+            segments.append((start, end, -1, no_board, -1, state))
+
+    return segments, moves
+
+# Luminance and lit tiles of many screen states at once
+def screen_values(problem, view, cursor_color, states):
+    grids = load_problems()[np.clip(problem, 0, None)] # (n, 4, 6, 6)
+    border_area, border_visible = border_geometry()
+    board = view != no_board
+    teacher = view == teacher_view
+
+    # Canvas: the true hypothesis and examples (teacher) or examples only (student)
+    sqs = grids[:, 0] + states
+    sqs = np.where(teacher[:, None, None], sqs, sqs*(sqs > 1))
+    lum = canvas_lum[sqs].sum(axis=(1, 2))*canvas_area
+    lit = (sqs > 0).sum(axis=(1, 2))
+
+    # Hypotheses, with the true one partly covered by its border (teacher)
+    visible = np.where(teacher[:, None, None], border_visible, 1.)
+    lum += (hypothesis_lum[grids[:, 1:]].sum(axis=(1, 2, 3)) +
+            (hypothesis_lum[grids[:, 0]]*visible).sum(axis=(1, 2)))*hypothesis_area
+    lum += teacher*border_area*true_lum
+    lit += (grids == 1).sum(axis=(1, 2, 3))
+
+    lum += np.where(cursor_color >= 0, cursor_lum[cursor_color], 0)*cursor_area
+    return np.where(board, lum, 0.), np.where(board, lit, 0)
+
+### REGRESSORS ###
+# Helper function: Mean of piecewise-constant values over every bin [edges[i], edges[i+1])
+def bin_means(starts, ends, values, edges):
+    integral = np.cumsum((ends - starts)*values)
+    times = np.stack([starts, ends], axis=1).ravel()
+    at_times = np.stack([integral - (ends - starts)*values, integral], axis=1).ravel()
+    return np.diff(np.interp(edges, times, at_times))/np.diff(edges)
+
+# main method: confounds of many runs, computed together. Runs are laid out
+# one after the other on a single timeline, so that every step works on
+# all of them at once. Returns one (n_images, n_columns) array per run.
+def compute(in_files, n_images, tr=teaching_timing.tr):
+    n_images = np.asarray(n_images)
+    run_length = (n_images.max() + 1)*tr
+    first_image = np.concatenate([[0], np.cumsum(n_images)])
+
+    segments, moves = [], []
+    for i, in_file in enumerate(in_files):
+        run_segs, run_moves = run_segments(bids.iter_records(in_file))
+        offset, end_of_run = i*run_length, n_images[i]*tr
+        segments += [(offset + start, offset + min(end, end_of_run), *seg) for start, end, *seg in run_segs]
+        moves += [(i, key_t, dist) for key_t, dist in run_moves]
+
+    starts, ends, problem, view, cursor_color, states = (np.array(x) for x in zip(*segments))
+    ends = np.maximum(ends, starts)
+    lum, lit = screen_values(problem, view, cursor_color, states)
+
+    # Mean luminance and lit tiles in every image (TR), time-weighted
+    edges = np.concatenate([i*run_length + np.arange(n + 1)*tr for i, n in enumerate(n_images)])
+    is_image = np.ones(len(edges) - 1, dtype=bool)
+    is_image[np.cumsum(n_images + 1)[:-1] - 1] = False # between runs
+    out = np.zeros((first_image[-1], len(columns)))
+    out[:, 0] = bin_means(starts, ends, lum, edges)[is_image]
+    out[:, 1] = bin_means(starts, ends, lit, edges)[is_image]
+
+    # Cursor displacement (in tiles) and keypresses in every image
+    if moves:
+        run, key_t, dist = np.array(moves).T
+        run = run.astype(int)
+        image = np.floor(key_t/tr).astype(int)
+        keep = (image >= 0) & (image < n_images[run])
+        idx = first_image[run[keep]] + image[keep]
+        out[:, 2] = np.bincount(idx, weights=dist[keep], minlength=len(out))
+        out[:, 3] = np.bincount(idx, minlength=len(out))
+
+    return np.split(out, first_image[1:-1])
+
+# Helper function: Where to save a run's confounds (one file per part of a
+# resumed run, named as in teaching_bids)
+def confounds_file(out_dir, sub, run, part=0):
+    return os.path.join(out_dir, 'sub-%s' % sub, 'func', bids.scan_name(sub, run, part) + '_desc-visual_timeseries.tsv')
+
+# Helper function: # of images of each part of a run (see teaching_bids.find_runs).
+# A resumed part has its own count (see teaching_checkpoint.save_resume); a
+# part that was interrupted ends with the image its last saved trial ends in.
+def part_images(parts, n_images, tr=teaching_timing.tr):
+    counts = []
+    for i, in_file in enumerate(parts):
+        resume = datalog.load_resume(in_file)
+        n = resume['n_images'] if resume is not None else n_images
+        if i < len(parts) - 1:
+            last = collections.deque(bids.iter_records(in_file), maxlen=1)
+            if last:
+                n = min(n, np.ceil(np.round((last[0]['true_ons'] + last[0]['true_dur'])/tr, 6)))
+        counts.append(int(n))
+    return counts
+
+def save_tsv(out_file, values):
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    tmp_file = out_file + '.tmp'
+    with open(tmp_file, 'w') as out:
+        out.write('\t'.join(columns) + '\n')
+        for row in values:
+            out.write('%.6f\t%.4f\t%i\t%i\n' % tuple(row))
+    os.replace(tmp_file, out_file)
+
+# Confounds of every run in data_dir, one TSV per run (the first dummy_scans
+# images are dropped, as in teaching_bids). Confounds are kept in the derived
+# cache (see teaching_cache), so only runs that are new or changed (or every
+# run, if this code or the problems change) are computed again.
+def export(data_dir='data', out_dir='bids/derivatives/teaching-confounds', dummy_scans=0, use_cache=True):
+    import teaching_cache
+    timings = teaching_timing.load()
+    runs, n_images = [], []
+    for (sub, run), parts in sorted(bids.find_runs(data_dir).items()):
+        runs += [(sub, run, part, in_file) for part, in_file in enumerate(parts)]
+        n_images += part_images(parts, int(timings.run_info(sub, int(run))['n_images']))
+
+    derived = teaching_cache.DerivedCache()
+    keys = [derived.key('confounds', [in_file], deps=[problems_file], modules=cache_modules,
+                        params={'n_images': n, 'tr': teaching_timing.tr})
+            for (_, _, _, in_file), n in zip(runs, n_images)]
+    results = [derived.get('confounds', key) if use_cache else None for key in keys]
+    todo = [i for i, values in enumerate(results) if values is None]
+    if todo:
+        for i, values in zip(todo, compute([runs[i][3] for i in todo], [n_images[i] for i in todo])):
+            derived.put('confounds', keys[i], values)
+            results[i] = values
+    derived.save()
+
+    for (sub, run, part, in_file), values in zip(runs, results):
+        save_tsv(confounds_file(out_dir, sub, run, part), values[dummy_scans:])
+    return len(runs), sum(n_images), len(todo)
+
+if __name__ == '__main__':
+    # Usage: python teaching_confounds.py --data data --out bids/derivatives/teaching-confounds
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default='data', help='Folder with behavioral files')
+    parser.add_argument('--out', default='bids/derivatives/teaching-confounds')
+    parser.add_argument('--dummy-scans', type=int, default=0, help='Volumes discarded at the start of each run')
+    parser.add_argument('-force', action='store_true', help='Use this flag to compute every run again (ignoring the cache)')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    n_runs, n_images, n_computed = export(args.data, args.out, args.dummy_scans, not args.force)
+    print('Saved confounds for %i scans (%i images, %i scans computed) in %.1f s' %
+          (n_runs, n_images, n_computed, time.time() - t0))
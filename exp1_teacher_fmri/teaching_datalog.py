@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, json, os, queue, threading, time
+
+# Flush to disk at least this often (in seconds), or after this many trials
+fsync_interval = 1.0
+fsync_every = 10
+
+# Helper function: Serialize NumPy values (e.g., board states) like lists/numbers
+def to_json(obj):
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+# Helper function: Where to stream records for a behavioral file
+def stream_file(out_file):
+    return os.path.splitext(out_file)[0] + '.jsonl'
+
+# Helper function: Where to save checkpoints for a behavioral file (see teaching_checkpoint)
+def checkpoint_file(out_file):
+    return os.path.splitext(out_file)[0].replace('_behavioral_', '_checkpoint_') + '.json'
+
+# Helper function: Where to save how a run was resumed (see teaching_checkpoint)
+def resume_file(out_file):
+    return os.path.splitext(out_file)[0].replace('_behavioral_', '_resume_') + '.json'
+
+# How a behavioral file was resumed (None if it is not a resumed run)
+def load_resume(in_file):
+    try:
+        with open(resume_file(in_file)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# Write a checkpoint compactly and atomically (a crash leaves the previous one in place)
+def save_checkpoint(out_file, checkpoint):
+    tmp_file = out_file + '.tmp'
+    with open(tmp_file, 'w') as out:
+        out.write(json.dumps(checkpoint, separators=(',', ':'), default=to_json))
+    os.replace(tmp_file, out_file)
+
+### TRIAL LOG ###
+# Append-only log of trial records: one JSON object per line. The trial loop
+# only hands records off to a queue; a dedicated writer thread serializes,
+# writes and fsyncs them, so disk I/O never happens on the render thread.
+# Records must not be changed after they are appended. The queue is a
+# SimpleQueue, whose put() is reentrant: the emergency exit (a signal handler)
+# can close the log even if it interrupts append(). Optionally, each record
+# comes with a checkpoint of the trial loop, which the writer thread saves to
+# checkpoint_file after the record (see teaching_checkpoint).
+class TrialLog:
+    def __init__(self, out_file, checkpoint_file=None):
+        self.out_file = out_file
+        self.stream_file = stream_file(out_file)
+        self.checkpoint_file = checkpoint_file
+        self.f = open(self.stream_file, 'a', buffering=1024*1024)
+        self.queue = queue.SimpleQueue()
+        self.closed = False
+
+        # I/O stats
+        self.n_records = 0
+        self.max_depth = 0 # most trials waiting at once
+        self.max_append = 0 # longest time the trial loop spent handing off a record
+        self.max_latency = 0 # longest time from hand-off until the record was written
+        self.max_write = 0 # longest time spent serializing + writing one record
+
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def append(self, record, checkpoint=None):
+        t0 = time.perf_counter()
+        self.queue.put((t0, record, checkpoint))
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        self.max_append = max(self.max_append, time.perf_counter() - t0)
+
+    def _write_loop(self):
+        n_unsynced = 0
+        last_sync = time.perf_counter()
+        checkpoint = None # newest checkpoint not saved yet
+        while True:
+            try:
+                item = self.queue.get(timeout=fsync_interval)
+            except queue.Empty:
+                item = ()
+
+            if item:
+                t_queued, record, item_checkpoint = item
+                t0 = time.perf_counter()
+                self.f.write(json.dumps(record, default=to_json) + '\n')
+                checkpoint = item_checkpoint if item_checkpoint is not None else checkpoint
+
+                # Only the newest checkpoint is saved, once the queue is empty
+                if checkpoint is not None and self.checkpoint_file is not None and self.queue.empty():
+                    self.f.flush() # the checkpoint never runs ahead of the stream
+                    save_checkpoint(self.checkpoint_file, checkpoint)
+                    checkpoint = None
+                t1 = time.perf_counter()
+                self.n_records += 1
+                n_unsynced += 1
+                self.max_write = max(self.max_write, t1 - t0)
+                self.max_latency = max(self.max_latency, t1 - t_queued)
+
+            # Periodically flush to disk
+            done = item is None
+            if n_unsynced and (done or n_unsynced >= fsync_every or
+                               time.perf_counter() - last_sync > fsync_interval):
+                self.f.flush()
+                os.fsync(self.f.fileno())
+                n_unsynced = 0
+                last_sync = time.perf_counter()
+
+            if done:
+                if checkpoint is not None and self.checkpoint_file is not None:
+                    save_checkpoint(self.checkpoint_file, checkpoint)
+                break
+
+    def stats(self):
+        return {
+            'n_records': self.n_records,
+            'max_depth': self.max_depth,
+            'max_append': self.max_append,
+            'max_latency': self.max_latency,
+            'max_write': self.max_write
+        }
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        # Let the writer flush the tail, then shut it down
+        self.queue.put(None)
+        self.writer.join()
+        self.f.close()
+
+        print('Trial log: %i trials, max queue depth %i, max hand-off %.3f ms, max write latency %.1f ms' %
+              (self.n_records, self.max_depth, self.max_append*1000, self.max_latency*1000))
+
+    def finalize(self):
+        self.close()
+        return finalize(self.stream_file, self.out_file)
+
+# Convert a streamed log into the usual JSON array of trials
+def finalize(in_file, out_file):
+    with open(in_file, 'r') as f:
+        lines = [line.strip() for line in f if line.strip()]
+
+    # Same layout as json.dump(data, out)
+    with open(out_file, 'w') as out:
+        out.write('[' + ', '.join(lines) + ']')
+    return len(lines)
+
+if __name__ == '__main__':
+    # Usage: python teaching_datalog.py data/sub-01_..._behavioral_<tstamp>.jsonl
+    parser = argparse.ArgumentParser()
+    parser.add_argument('logs', nargs='+', help='Streamed trial logs (.jsonl) to convert')
+    args = parser.parse_args()
+
+    for log in args.logs:
+        out_file = os.path.splitext(log)[0] + '.json'
+        n = finalize(log, out_file)
+        print('Saved %i trials to: %s' % (n, out_file))
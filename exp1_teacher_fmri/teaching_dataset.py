@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, json, os, shutil, time
+import numpy as np
+
+import teaching_bids as bids
+import teaching_timing
+
+# Where the index is saved
+index_dir = 'data/index'
+
+### TABLES ###
+# Columns of each table (one .npy file per column). Missing values are -1
+# for integers, NaN for floats and '' for strings.
+trial_columns = {
+    'sub': 'i2', 'run': 'i2', 'tstamp': 'i8', 'trial': 'i2',
+    'type': 'i1', 'ons': 'f8', 'dur': 'f8', 'true_ons': 'f8', 'true_dur': 'f8',
+    'problem': 'i2', 'problem_idx': 'i1', 'ex_idx': 'i1', 'order': 'U4',
+    'example_row': 'i1', 'example_col': 'i1', 'cursor_row': 'i1', 'cursor_col': 'i1',
+    'n_moves': 'i2', 'rt': 'f8', 'rating': 'i1'
+}
+movement_columns = {
+    'sub': 'i2', 'run': 'i2', 'tstamp': 'i8', 'trial': 'i2',
+    'problem': 'i2', 'problem_idx': 'i1', 'ex_idx': 'i1',
+    'move': 'i2', 'row': 'i1', 'col': 'i1', 'rt': 'f8'
+}
+tables = {'trials': trial_columns, 'movements': movement_columns}
+
+# Helper function: Missing value for a column type
+def missing(dtype):
+    kind = np.dtype(dtype).kind
+    return np.nan if kind == 'f' else '' if kind == 'U' else -1
+
+# Rows of both tables for one behavioral file, as {table: {column: array}}
+def file_rows(in_file, sub, run, tstamp):
+    rows = {name: {col: [] for col in columns} for name, columns in tables.items()}
+    base = {'sub': int(sub), 'run': int(run), 'tstamp': int(tstamp)}
+
+    for i, rec in enumerate(bids.iter_records(in_file)):
+        trial = dict.fromkeys(trial_columns)
+        trial.update(base, trial=i, type=teaching_timing.type_idx[rec['type']],
+                     ons=rec['ons'], dur=rec['dur'], true_ons=rec['true_ons'], true_dur=rec['true_dur'],
+                     problem=rec.get('problem'), problem_idx=rec.get('problem_idx'), ex_idx=rec.get('ex_idx'),
+                     order=''.join(rec.get('order', '')), rt=rec.get('rt'), rating=rec.get('rating'))
+        if rec.get('example') is not None:
+            trial['example_row'], trial['example_col'] = rec['example']
+        if rec.get('cursor') is not None:
+            trial['cursor_row'], trial['cursor_col'] = rec['cursor']
+        if 'movements' in rec:
+            trial['n_moves'] = len(rec['movements'])
+        for col in trial_columns:
+            rows['trials'][col].append(trial[col])
+
+        for j, ((r, c), rt) in enumerate(rec.get('movements', [])):
+            move = dict(base, trial=i, problem=rec['problem'], problem_idx=rec['problem_idx'],
+                        ex_idx=rec['ex_idx'], move=j, row=r, col=c, rt=rt)
+            for col in movement_columns:
+                rows['movements'][col].append(move[col])
+
+    return {name: {col: np.array([missing(dtype) if x is None else x for x in rows[name][col]], dtype=dtype)
+                   for col, dtype in columns.items()}
+            for name, columns in tables.items()}
+
+### BUILDING THE INDEX ###
+# Helper function: Save one part of a table (one .npy file per column)
+def save_part(part_dir, columns):
+    tmp_dir = part_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for col, arr in columns.items():
+        np.save(os.path.join(tmp_dir, col + '.npy'), arr)
+    os.replace(tmp_dir, part_dir)
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, 'index.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'files': {}, 'parts': []}
+
+def save_manifest(out_dir, manifest):
+    out_file = os.path.join(out_dir, 'index.json')
+    with open(out_file + '.tmp', 'w') as out:
+        json.dump(manifest, out, indent=1, sort_keys=True)
+    os.replace(out_file + '.tmp', out_file)
+
+# main method: add behavioral files that are not in the index yet, as a new
+# part of each table. Every part of a resumed run is indexed (rows are told
+# apart by tstamp). Files that changed since they were indexed (or runs
+# that were re-recorded) mean the index has to be rebuilt.
+def update(data_dir='data', out_dir=index_dir, rebuild=False):
+    manifest = {'files': {}, 'parts': []} if rebuild else load_manifest(out_dir)
+    runs = [(sub, run, in_file) for (sub, run), parts in bids.find_runs(data_dir).items() for in_file in parts]
+
+    # Indexed files that changed (files only touched are compared by hash)
+    stale = []
+    for sub, run, in_file in runs:
+        entry = manifest['files'].get(os.path.basename(in_file))
+        if entry is None:
+            continue
+        stat = os.stat(in_file)
+        if (entry['mtime'], entry['size']) != (stat.st_mtime, stat.st_size):
+            if entry['size'] != stat.st_size or bids.file_hash(in_file) != entry['sha1']:
+                stale.append(in_file)
+            entry['mtime'] = stat.st_mtime
+
+    # Indexed files that are no longer part of their run
+    current = {os.path.basename(in_file) for _, _, in_file in runs}
+    found_runs = {(sub, run) for sub, run, _ in runs}
+    replaced = [name for name, entry in manifest['files'].items()
+                if name not in current and (entry['sub'], entry['run']) in found_runs]
+    if (stale or replaced) and not rebuild:
+        print('%i indexed files changed, rebuilding index' % len(stale + replaced))
+        return update(data_dir, out_dir, rebuild=True)
+    if rebuild:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    new_files = sorted((in_file, sub, run) for sub, run, in_file in runs
+                       if os.path.basename(in_file) not in manifest['files'])
+    if not new_files:
+        if manifest['files']:
+            save_manifest(out_dir, manifest)
+        return 0
+
+    # Rows of every new file, concatenated into one part per table
+    parts = {name: [] for name in tables}
+    part = 'part-%04i' % len(manifest['parts'])
+    for in_file, sub, run in new_files:
+        tstamp = bids.behavioral_pattern.match(os.path.basename(in_file)).group(3)
+        for name, columns in file_rows(in_file, sub, run, tstamp).items():
+            parts[name].append(columns)
+        stat = os.stat(in_file)
+        manifest['files'][os.path.basename(in_file)] = {
+            'sub': sub, 'run': run, 'part': part, 'mtime': stat.st_mtime, 'size': stat.st_size,
+            'sha1': bids.file_hash(in_file)}
+
+    for name, columns in tables.items():
+        save_part(os.path.join(out_dir, name, part),
+                  {col: np.concatenate([p[col] for p in parts[name]]) for col in columns})
+    manifest['parts'].append(part)
+    save_manifest(out_dir, manifest)
+    return len(new_files)
+
+### QUERIES ###
+# One table, spread over parts; columns are memory-mapped and only read
+# when a query needs them
+class Table:
+    def __init__(self, table_dir, parts, columns):
+        self.part_dirs = [os.path.join(table_dir, part) for part in parts]
+        self.columns = columns
+
+    def column(self, part_dir, col):
+        return np.load(os.path.join(part_dir, col + '.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return sum(len(self.column(part_dir, 'sub')) for part_dir in self.part_dirs)
+
+    # Rows where every filter matches, as {column: array}. Filters are
+    # values or lists of values, e.g. select(type='choose', problem=22)
+    def select(self, columns=None, **filters):
+        columns = list(self.columns) if columns is None else list(columns)
+        for col in list(filters) + columns:
+            if col not in self.columns:
+                raise KeyError('No column: %s' % col)
+        if 'type' in filters:
+            types = np.atleast_1d(filters['type'])
+            filters['type'] = [teaching_timing.type_idx[t] if isinstance(t, str) else t for t in types]
+
+        out = {col: [] for col in columns}
+        for part_dir in self.part_dirs:
+            mask = None
+            for col, value in filters.items():
+                match = np.isin(self.column(part_dir, col), value)
+                mask = match if mask is None else mask & match
+            idx = np.flatnonzero(mask) if mask is not None else slice(None)
+            for col in columns:
+                out[col].append(self.column(part_dir, col)[idx])
+
+        out = {col: np.concatenate(arrs) if arrs else np.array([], dtype=self.columns[col])
+               for col, arrs in out.items()}
+        if 'type' in out:
+            out['type'] = np.array(teaching_timing.trial_types)[out['type']]
+        return out
+
+class Dataset:
+    def __init__(self, out_dir=index_dir):
+        manifest = load_manifest(out_dir)
+        self.files = manifest['files']
+        self.trials = Table(os.path.join(out_dir, 'trials'), manifest['parts'], trial_columns)
+        self.movements = Table(os.path.join(out_dir, 'movements'), manifest['parts'], movement_columns)
+
+# main method: open the index, updating it first if asked to
+def load(out_dir=index_dir, data_dir=None):
+    if data_dir is not None:
+        update(data_dir, out_dir)
+    return Dataset(out_dir)
+
+if __name__ == '__main__':
+    # Usage: python teaching_dataset.py --data data --out data/index
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default='data', help='Folder with behavioral files')
+    parser.add_argument('--out', default=index_dir, help='Where to save the index')
+    parser.add_argument('-rebuild', action='store_true', help='Use this flag to rebuild the index from scratch')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    n_new = update(args.data, args.out, args.rebuild)
+    ds = Dataset(args.out)
+    print('Indexed %i new files in %.1f s (%i files, %i trials, %i movements)' %
+          (n_new, time.time() - t0, len(ds.files), len(ds.trials), len(ds.movements)))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, functools, json, math, os, time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import teaching_problems
+import teaching_timing
+
+### RUN STRUCTURE ###
+# Trial durations (in seconds)
+durations = {'pause': 5, 'study': 25, 'choose': 5, 'pre': 1, 'show': 2, 'rate': 2}
+n_examples = 3 # examples per problem
+problems_per_run = 4
+
+# Jittered pauses after choose, show and rate trials; every value is used
+# once per run when there are as many pauses as values
+jitters = np.round(np.arange(.75, 2.5 + 1e-9, teaching_timing.grid_step), 2)
+
+# Pauses between problems (one of each per run)
+problem_pauses = (3., 5., 7.)
+
+# Order of trials in a run, as (type, problem_idx, ex_idx, slot). Slots are
+# 'jitter' or 'problem_pause' for pauses whose length is drawn per run, and
+# None for fixed durations.
+def run_template():
+    template = [('pause', None, None, None)]
+    for problem_idx in range(problems_per_run):
+        template.append(('study', problem_idx, None, None))
+        for ex_idx in range(n_examples):
+            template += [('choose', problem_idx, ex_idx, None),
+                         ('pause', None, None, 'jitter'),
+                         ('pre', problem_idx, ex_idx, None),
+                         ('show', problem_idx, ex_idx, None),
+                         ('pause', None, None, 'jitter'),
+                         ('rate', problem_idx, ex_idx, None),
+                         ('pause', None, None, 'jitter')]
+        if problem_idx < problems_per_run - 1:
+            template.append(('pause', None, None, 'problem_pause'))
+    template.append(('pause', None, None, None))
+    return template
+
+# Helper function: Draw pause lengths for a batch of candidate runs (n, n_slots)
+def draw_pauses(rng, values, n, n_slots):
+    values = np.asarray(values)
+    if n_slots == len(values):
+        return values[np.argsort(rng.random((n, n_slots)), axis=1)] # shuffle
+    return rng.choice(values, (n, n_slots))
+
+# Durations and onsets of a batch of candidate runs: (n, n_trials) each
+def draw_timings(rng, template, n):
+    slots = np.array([slot for _, _, _, slot in template], dtype=object)
+    durs = np.tile([float(durations[name]) for name, _, _, _ in template], (n, 1))
+    for slot, values in (('jitter', jitters), ('problem_pause', problem_pauses)):
+        cols = np.flatnonzero(slots == slot)
+        durs[:, cols] = draw_pauses(rng, values, n, len(cols))
+    ons = np.cumsum(durs, axis=1) - durs
+    return np.round(durs, 2), np.round(ons, 2)
+
+### DESIGN EFFICIENCY ###
+# Modelled conditions (pauses are the baseline)
+conditions = ('study', 'choose', 'pre', 'show', 'rate')
+
+# Canonical (double gamma) HRF, sampled every dt seconds
+def hrf(dt, length=32.):
+    t = np.arange(0, length, dt)
+    h = t**5*np.exp(-t)/math.gamma(6) - t**15*np.exp(-t)/(6*math.gamma(16))
+    return h/h.sum()
+
+# Predicted response to one trial of every condition, from trial onset:
+# (n_conditions, n_lags + 1), with a trailing 0 for lags out of range
+def condition_responses(dt):
+    h = hrf(dt)
+    resps = [np.convolve(np.ones(int(round(durations[name]/dt))), h) for name in conditions]
+    table = np.zeros((len(conditions), max(map(len, resps)) + 1))
+    for i, resp in enumerate(resps):
+        table[i, :len(resp)] = resp
+    return table
+
+# Sampled response to a trial of each condition starting at every step of the
+# dt grid: (n_conditions, n_steps, n_images). Computed once per process, so
+# building design matrices only has to look up and add rows.
+@functools.lru_cache(maxsize=4)
+def response_rows(n_images, dt):
+    table = condition_responses(dt).astype(np.float32)
+    n_lags = table.shape[1] - 1
+    steps_per_tr = int(round(teaching_timing.tr/dt))
+    lags = np.arange(n_images)*steps_per_tr - np.arange(n_images*steps_per_tr)[:, None]
+    np.clip(lags, -1, n_lags, out=lags) # -1 and n_lags both point at the trailing 0
+    return table[:, lags]
+
+# Design matrices of a batch of runs, sampled at every image:
+# (n, n_images, n_conditions + 2), with an intercept and a linear drift
+def design_matrices(template, ons, n_images, dt=teaching_timing.grid_step):
+    events = [i for i, (name, _, _, _) in enumerate(template) if name in conditions]
+    cond = np.array([conditions.index(template[i][0]) for i in events])
+
+    # Group events by condition
+    order = np.argsort(cond, kind='stable')
+    cond, events = cond[order], np.array(events)[order]
+    starts = np.searchsorted(cond, np.arange(len(conditions)))
+
+    # Look up each event's response, then add up responses within each condition
+    onset_steps = np.round(ons[:, events]/dt).astype(np.intp) # (n, n_events)
+    responses = response_rows(n_images, dt)[cond, onset_steps] # (n, n_events, n_images)
+    X = np.add.reduceat(responses, starts, axis=1).transpose(0, 2, 1)
+
+    drift = np.linspace(-1, 1, n_images)
+    nuisance = np.broadcast_to(np.stack([np.ones(n_images), drift], axis=1), X.shape[:2] + (2,))
+    return np.concatenate([X, nuisance], axis=2)
+
+# A-optimal efficiency of a batch of design matrices: 1/trace(C (X'X)^-1 C').
+# By default, contrasts are each condition vs. baseline.
+def efficiency(X, contrasts=None):
+    if contrasts is None:
+        contrasts = np.eye(len(conditions), X.shape[-1])
+    XtX = np.einsum('nip,niq->npq', X, X)
+    cov = np.linalg.inv(XtX)
+    return 1/np.einsum('ij,njk,ik->n', contrasts, cov, contrasts)
+
+### SEARCH ###
+# Most efficient of n_candidates random runs: returns (durs, ons, efficiency,
+# mean efficiency of all candidates)
+def search_run(rng, template, n_candidates=5000, batch_size=1000):
+    best = (None, None, -np.inf)
+    total = 0.
+    for start in range(0, n_candidates, batch_size):
+        n = min(batch_size, n_candidates - start)
+        durs, ons = draw_timings(rng, template, n)
+        n_images = int(np.ceil(np.round((ons[:, -1] + durs[:, -1]).max()/teaching_timing.tr, 6)))
+        eff = efficiency(design_matrices(template, ons, n_images))
+        total += eff.sum()
+
+        i = np.argmax(eff)
+        if eff[i] > best[2]:
+            best = (durs[i], ons[i], eff[i])
+    return best + (total/n_candidates,)
+
+# Helper function: Timing file contents (same keys as the existing files)
+def to_timing(template, durs, ons, problems, orders):
+    timing = []
+    for (name, problem_idx, ex_idx, _), dur, on in zip(template, durs, ons):
+        trial = {'type': name, 'ons': teaching_timing.to_number(on), 'dur': teaching_timing.to_number(dur)}
+        if problem_idx is not None:
+            trial['problem'] = int(problems[problem_idx])
+            trial['problem_idx'] = problem_idx
+            if ex_idx is not None:
+                trial['ex_idx'] = ex_idx
+            trial['order'] = list(orders[problem_idx])
+        timing.append(trial)
+    return timing
+
+# Problems for each run of a subject, and the order hypotheses are shown in:
+# every subject sees every problem once, in a random order
+def assign_problems(rng, n_problems):
+    n_runs = n_problems // problems_per_run
+    problems = rng.permutation(n_problems)[:n_runs*problems_per_run].reshape(n_runs, problems_per_run)
+    orders = [[''.join(rng.permutation(teaching_problems.hypothesis_keys)) for _ in run] for run in problems]
+    return problems, orders
+
+# Design one run (runs in a worker process)
+def design_run(args):
+    sub, run, problems, orders, seed, n_candidates = args
+    rng = np.random.default_rng([seed, sub, run])
+    template = run_template()
+    durs, ons, eff, mean_eff = search_run(rng, template, n_candidates)
+    return sub, run, to_timing(template, durs, ons, problems, orders), eff, mean_eff
+
+# main method: design every run of a list of subjects, in parallel
+def design_cohort(subs, n_problems, seed=0, n_candidates=5000, workers=None):
+    jobs = []
+    for sub in subs:
+        problems, orders = assign_problems(np.random.default_rng([seed, sub]), n_problems)
+        jobs += [(sub, run + 1, problems[run], orders[run], seed, n_candidates) for run in range(len(problems))]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(design_run, jobs))
+
+# Helper function: Where to save a timing file
+def timing_path(out_dir, sub, run):
+    return os.path.join(out_dir, 'sub-%02d_task-teaching_run-%02d_timing.json' % (sub, run))
+
+if __name__ == '__main__':
+    # Usage: python teaching_design.py --sub 32 33 34
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sub', type=int, nargs='+', required=True, help='Subject #s (int)')
+    parser.add_argument('--problems', default='inputs/problems.json')
+    parser.add_argument('--candidates', type=int, default=5000, help='Candidate runs to search, per run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=teaching_timing.timing_dir)
+    parser.add_argument('-force', action='store_true',
+                        help='Use this flag to overwrite existing timing files')
+    args = parser.parse_args()
+
+    existing = [timing_path(args.out, sub, 1) for sub in args.sub if os.path.exists(timing_path(args.out, sub, 1))]
+    if existing and not args.force:
+        parser.error('Timing files already exist (use -force to overwrite): %s' % ', '.join(existing))
+
+    t0 = time.time()
+    n_problems = len(teaching_problems.load_grids(args.problems))
+    results = design_cohort(args.sub, n_problems, args.seed, args.candidates, args.workers)
+
+    # Check designs before saving them
+    trials, runs = teaching_timing.compile_runs([('%02d' % sub, run, timing) for sub, run, timing, _, _ in results])
+    errors = teaching_timing.validate(trials, runs, n_problems)
+    if errors:
+        for sub, run, msg in errors:
+            print('sub-%s, run-%02d: %s' % (sub, run, msg))
+        raise SystemExit('Generated timings failed validation, nothing was saved')
+
+    os.makedirs(args.out, exist_ok=True)
+    for sub, run, timing, eff, mean_eff in results:
+        with open(timing_path(args.out, sub, run), 'w') as out:
+            json.dump(timing, out, indent=4)
+
+    effs = np.array([[eff, mean_eff] for _, _, _, eff, mean_eff in results])
+    print('Designed %i runs in %.1f s (efficiency: %.3f, vs. %.3f for a random design)' %
+          (len(results), time.time() - t0, effs[:, 0].mean(), effs[:, 1].mean()))
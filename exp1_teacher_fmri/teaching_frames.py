@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json, time
+import numpy as np
+
+# Frames that take longer than this many refreshes, from the start of drawing
+# to the end of the flip, count as dropped frames
+drop_threshold = 1.5
+
+### FRAME TIMER ###
+# Optional instrumentation: wraps w.flip() to time every frame, and splits
+# frames up by trial (teaching_game_logic.present calls start/end_trial).
+# Every flip is checked against its own target: a frame is dropped if it
+# took over drop_threshold refreshes from begin_frame() to the end of the
+# flip, or if it landed after the refresh it was meant for (e.g. a trial's
+# onset, see teaching_schedule).
+class FrameTimer:
+    def __init__(self, w, refresh=None):
+        self.w = w
+        self.refresh = refresh if refresh is not None else w.monitorFramePeriod
+        self.trials = []
+        self.current = None
+        self.clock = None
+        self.last_flip = None # perf_counter() at the end of the last flip
+        self.frame_start = None # perf_counter() when drawing of this frame started
+        self.start_stamp = None # run clock time when drawing of this frame started
+        self.target = None # run clock time of the refresh this frame is meant for
+
+        # Patch the window's flip, so stimuli keep drawing to the real window
+        self._flip = w.flip
+        w.flip = self.flip
+
+    def flip(self, *args, **kwargs):
+        t_draw = time.perf_counter()
+        out = self._flip(*args, **kwargs)
+        t_flip = time.perf_counter()
+
+        t_start = self.frame_start if self.frame_start is not None else self.last_flip
+        rec = self.current
+        if rec is not None:
+            # Latency is measured on the run clock (virtual on headless
+            # windows), for frames whose start was marked with begin_frame()
+            stamp = self.clock.getTime()
+            latency = stamp - self.start_stamp if self.start_stamp is not None else 0.
+            late = self.target is not None and stamp > self.target + self.refresh/2
+
+            rec['flips'].append(stamp)
+            rec['latency'].append(latency)
+            if latency > drop_threshold*self.refresh or late:
+                rec['n_dropped'] += 1
+            if t_start is not None:
+                rec['draw'].append(t_draw - t_start)
+            rec['flip'].append(t_flip - t_draw)
+
+        self.last_flip = t_flip
+        self.frame_start = None
+        self.start_stamp = None
+        self.target = None
+        return out
+
+    # Mark the start of drawing a new frame, and (optionally) the run clock
+    # time of the refresh it should land on
+    def begin_frame(self, target=None):
+        self.frame_start = time.perf_counter()
+        self.target = target
+        if self.clock is not None:
+            self.start_stamp = self.clock.getTime()
+
+    def start_trial(self, t, trial):
+        self.clock = t
+        self.current = {
+            'type': trial['type'],
+            'ons': trial['ons'],
+            'flips': [],
+            'latency': [],
+            'n_dropped': 0,
+            'draw': [],
+            'flip': []
+        }
+
+    def end_trial(self):
+        rec = self.current
+        self.current = None
+        if rec is None:
+            return None
+
+        # Keep a compact summary of each trial
+        summary = {
+            'type': rec['type'],
+            'ons': rec['ons'],
+            'n_frames': len(rec['flips']),
+            'n_dropped': rec['n_dropped'],
+            'max_latency': float(max(rec['latency'])) if rec['latency'] else None,
+            'draw_time': float(np.sum(rec['draw'])),
+            'flip_time': float(np.sum(rec['flip'])),
+            'flips': [round(f, 5) for f in rec['flips']]
+        }
+        self.trials.append(summary)
+        return summary
+
+    def close(self):
+        self.w.flip = self._flip
+
+    ### REPORTING ###
+    def summary(self):
+        by_type = {}
+        for rec in self.trials:
+            s = by_type.setdefault(rec['type'], {
+                'n_trials': 0,
+                'n_frames': 0,
+                'n_dropped': 0,
+                'max_latency': 0,
+                'draw_time': 0,
+                'flip_time': 0
+            })
+            s['n_trials'] += 1
+            s['n_frames'] += rec['n_frames']
+            s['n_dropped'] += rec['n_dropped']
+            s['max_latency'] = max(s['max_latency'], rec['max_latency'] or 0)
+            s['draw_time'] += rec['draw_time']
+            s['flip_time'] += rec['flip_time']
+
+        total = {k: sum(s[k] for s in by_type.values())
+                 for k in ('n_trials', 'n_frames', 'n_dropped', 'draw_time', 'flip_time')}
+        total['max_latency'] = max([s['max_latency'] for s in by_type.values()], default=0)
+
+        return {
+            'refresh': self.refresh,
+            'drop_threshold': drop_threshold,
+            'total': total,
+            'by_type': by_type,
+            'trials': self.trials
+        }
+
+    def save(self, out_file):
+        summary = self.summary()
+        with open(out_file, 'w') as out:
+            json.dump(summary, out)
+
+        total = summary['total']
+        print('Frames: %i drawn, %i dropped (max latency: %.1f ms)' %
+              (total['n_frames'], total['n_dropped'], total['max_latency']*1000))
+        return summary
+
+# Helper function: Where to save frame timings for a behavioral file
+def frames_file(out_file):
+    return out_file.replace('_behavioral_', '_frames_')
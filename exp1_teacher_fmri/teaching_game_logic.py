@@ -5,16 +5,30 @@ Created on Mon Aug 9 12:44:01 2021
 
 @author: aliciachen, nataliavelez
 """
-import copy, json
+import random
 import numpy as np
-from psychopy import gui, core, visual, event, data # Stimulus presentation
 
 # experiment-specific modules
+import teaching_window as window # Stimulus presentation (psychopy or headless)
 import teaching_stimuli as stim
+import teaching_problems
+import teaching_schedule as schedule
 
-# Load teaching problems
-with open('inputs/problems.json') as file:
-    problems = json.load(file)
+# Teaching problems (compiled into NumPy arrays, see teaching_problems) are
+# loaded on first use, or ahead of time with load()
+problems_file = 'inputs/problems.json'
+problems = None
+
+def load(in_file=None):
+    global problems
+    global problems_file
+
+    if in_file is not None and in_file != problems_file:
+        problems_file = in_file
+        problems = None
+    if problems is None:
+        problems = teaching_problems.load(problems_file, stim.colordict)
+    return problems
 
 # Hardware setup
 keylist = ('0', '1', '2', '3', '4', 'q') # uncomment for production
@@ -29,15 +43,49 @@ def laptop_keys():
     keymap = dict(zip(keylist, ((0,0,True), (0,-1,False), (-1,0,False),(1,0,False),(0,1,False),(0,0,False))))
 
 # Helper function: Override key list, problems for practice task
-def practice_mode():
-    global problems
-
-    print('Loading practice problems...')
-    with open('inputs/practice_problems.json') as file:
-        problems = json.load(file)
+def practice_mode(sub=None):
+    in_file = teaching_problems.practice_problems(sub)
+    print('Loading practice problems from: %s' % in_file)
+    load(in_file)
 
     print(keymap)
 
+### BOARD STATE ###
+# Board states (examples shown so far) are small read-only uint8 arrays, so
+# they can be shared between trials and trial records without copying
+def new_board():
+    state = np.zeros((6,6), dtype=np.uint8)
+    state.flags.writeable = False
+    return state
+
+# Helper function: Copy of the board with one more example
+def add_example(state, r, c):
+    new_state = state.copy()
+    new_state[r,c] = 1
+    new_state.flags.writeable = False
+    return new_state
+
+### KEYPRESSES ###
+# Where keypresses come from: psychopy's event module by default, an input
+# backend that timestamps keypresses on its own thread (see teaching_input),
+# or a simulated participant (see teaching_simulate)
+key_source = None
+
+# Helper function: Get keypresses as (key, time on the run clock t)
+def get_keys(t):
+    if key_source is not None:
+        return key_source.get_keys(keylist, t)
+    from psychopy import event
+    return event.getKeys(keyList = keylist, timeStamped=t)
+
+# Helper function: Clear any pending keypresses
+def clear_keys():
+    if key_source is not None:
+        key_source.clear_keys()
+    else:
+        from psychopy import event
+        event.clearEvents(eventType='keyboard')
+
 ### CURSOR MOVEMENTS ###
 # Helper function: Keep locations within map bounds
 def bound_loc(c_orig):
@@ -68,181 +116,185 @@ def update_location(sqs,r0,c0,key):
     return row,col,win_state
 
 ### PRESENTATION FUNCTIONS ###
+# Each function sets up its stimuli, then hands a draw() function (and, if
+# it takes input, an update() function) over to the scheduler, which keeps
+# the trial on screen until it ends
 def pause(w,t,trial,state,cursor):
+    visual = window.visual_for(w)
     pause_stim = visual.TextStim(w, text="+", pos=(0,0), height=.2)
-    data = {
-        'true_ons': t.getTime()
-    }
+    data = {}
 
     # Keep fixation cross up on screen
-    while t.getTime() < trial['ons'] + trial['dur']:
-        pause_stim.draw()
-        w.flip()
+    data['true_ons'] = get_scheduler(w,t).hold(trial, pause_stim.draw)
     data['true_dur'] = t.getTime() - data['true_ons']
 
     # Save data
-    out = copy.deepcopy(trial)
+    out = dict(trial)
     out.update(data)
     return out
 
 def study(w,t,trial,state,cursor):
-    data = {
-        'true_ons': t.getTime()
-    }
-    prob = problems[trial['problem']]
+    visual = window.visual_for(w)
+    data = {}
+    prob = load()[trial['problem']]
+    study_stim = visual.TextStim(w, text='Study problem', pos=(0, -.72))
+    sec_stim = visual.TextStim(w, text='', pos=(0, -.88))
+
+    # Start countdown at the end
+    def update():
+        t_remaining = np.ceil(trial['ons'] + trial['dur'] - t.getTime())
+        sec_txt = '%i'%t_remaining if (t_remaining < 4) & (t_remaining > 0) else ''
+        if sec_stim.text != sec_txt:
+            sec_stim.text = sec_txt
+            return True
+        return False
 
-    # Keep fixation cross up on screen
-    while t.getTime() < trial['ons'] + trial['dur']:
+    def draw():
         # Draw teaching problem
         stim.draw_canvas(prob, state, w, True)
         stim.draw_hypotheses(prob, trial['order'], w, True)
 
         # Tell participants to study
-        study_stim = visual.TextStim(w, text='Study problem', pos=(0, -.72))
         study_stim.draw()
-
-        # Start countdown at the end
-        t_remaining = np.ceil(trial['ons'] + trial['dur'] - t.getTime())
-        if (t_remaining < 4) & (t_remaining > 0):
-            sec_stim = visual.TextStim(w, text='%i'%t_remaining, pos=(0, -.88))
+        if sec_stim.text:
             sec_stim.draw()
-        w.flip()
 
+    # Keep problem up on screen
+    data['true_ons'] = get_scheduler(w,t).hold(trial, draw, update)
     data['true_dur'] = t.getTime() - data['true_ons']
 
     # Save data
-    out = copy.deepcopy(trial)
+    out = dict(trial)
     out.update(data)
     return out
 
 def choose(w,t,trial,state,cursor):
     # unpack trial params
     r,c = cursor
-    prob = problems[trial['problem']]
+    prob = load()[trial['problem']]
     sqs = np.add(prob['A'], state)
 
     # init data
     mvmts = [] # track all movements
-    data = {
-        'true_ons': t.getTime()
-    }
+    data = {}
 
-    # init loop
-    keys=[]
+    # init loop (RTs are measured from the scheduled onset)
+    rt=None
     selected=False
-    rt_clock = core.Clock()
-
-    # main loop
-    while t.getTime() < trial['ons'] + trial['dur']:
-                
-        if not selected: # if there's a keypress, update cursor
-            keys = event.getKeys(keyList = keylist, timeStamped=rt_clock)
-            if keys:
-                r,c,selected=update_location(sqs,r,c,keys[0][0])
-                mvmts.append(((r,c),keys[0][1]))
-            cursor_color = sqs[r][c]
-        else: # stop updating after selection is made
-            cursor_color=3
-
-        # Draw stimuli
+    rt_start = trial['ons']
+
+    # if there are keypresses, update cursor (in the order they were made)
+    def update():
+        nonlocal rt, r, c, selected
+        if selected: # stop updating after selection is made
+            return False
+
+        moved = False
+        for key, key_t in get_keys(t):
+            r,c,selected=update_location(sqs,r,c,key)
+            mvmts.append(((r,c),key_t - rt_start))
+            moved = True
+            if selected: # RT is the time of the selection (None if no example was picked)
+                rt = key_t - rt_start
+                break
+        return moved
+
+    def draw():
+        cursor_color = 3 if selected else sqs[r][c]
         stim.draw_cursor(r, c, cursor_color, w)
         stim.draw_canvas(prob, state, w, True)
         stim.draw_hypotheses(prob, trial['order'], w, True)
 
-        w.flip()
-    
+    # main loop
+    data['true_ons'] = get_scheduler(w,t).hold(trial, draw, update)
+
     # Update state
-    new_state=copy.deepcopy(state)
-    if selected:
-        new_state[r][c] = 1
+    new_state = add_example(state, r, c) if selected else state
         
     # save data
     data['true_dur'] = t.getTime() - data['true_ons']
     data['example'] = (r,c) if selected else None
-    data['rt'] = keys[0][1] if keys else None
+    data['rt'] = rt
     data['movements'] = mvmts
     data['state'] = new_state
     data['cursor'] = (r,c)
 
-    out = copy.deepcopy(trial)
+    out = dict(trial)
     out.update(data)
     return out
 
 
 def pre(w,t,trial,state,cursor):
+    visual = window.visual_for(w)
     pre_stim = visual.TextStim(w, text="Here's what students would see:", pos=(0,0), wrapWidth=2)
-    data = {
-        'true_ons': t.getTime()
-    }
+    data = {}
 
     # Keep text on screen
-    while t.getTime() < trial['ons'] + trial['dur']:
-        pre_stim.draw()
-        w.flip()
+    data['true_ons'] = get_scheduler(w,t).hold(trial, pre_stim.draw)
     data['true_dur'] = t.getTime() - data['true_ons']
 
     # Save data
-    out = copy.deepcopy(trial)
+    out = dict(trial)
     out.update(data)
     return out
 
 def show(w,t,trial,state,highlight):
-    data = {
-        'true_ons': t.getTime()
-    }
-    prob = problems[trial['problem']]
+    data = {}
+    prob = load()[trial['problem']]
 
-    # Keep fixation cross up on screen
-    while t.getTime() < trial['ons'] + trial['dur']:
+    def draw():
         if highlight is not None:
             r,c=highlight
             stim.draw_cursor(r, c, 3, w)
         stim.draw_canvas(prob, state, w, False)
         stim.draw_hypotheses(prob, trial['order'], w, False)
-        w.flip()
 
+    # Keep student's view up on screen
+    data['true_ons'] = get_scheduler(w,t).hold(trial, draw)
     data['true_dur'] = t.getTime() - data['true_ons']
 
     # Save data
-    out = copy.deepcopy(trial)
+    out = dict(trial)
     out.update(data)
     return out
 
 def rate(w,t,trial,state,cursor):
-    data = {
-        'true_ons': t.getTime()
-    }
+    visual = window.visual_for(w)
+    data = {}
 
-    # Initialize response vars
-    event.clearEvents(eventType='keyboard')
+    # Initialize response vars (RTs are measured from the scheduled onset)
+    clear_keys()
     keys = []
-    rt_clock = core.Clock()
+    rt_start = trial['ons']
 
     # Get ready to draw feedback
     scale_xs = np.linspace(-.66,.66,5)
     fdbk_stim = visual.Rect(w,
-    						size=(0.1,0.1),
-    						lineColor='black',
-    						fillColor='black',
-    						pos=(0,0)) # empty fdbk stim
+    						size=(.15, .2),
+    						lineWidth=2,
+    						lineColor='white',
+    						fillColor=None,
+    						pos=(0,-.01)) # shown once a response is made
+
+    def update():
+        nonlocal keys
+        if keys:
+            return False
+
+        keys = [(key, key_t - rt_start) for key, key_t in get_keys(t)]
+        if keys:
+            idx = keylist.index(keys[0][0])
+            fdbk_stim.pos = (scale_xs[idx], -.01)
+            return True
+        return False
+
+    def draw():
+        if keys:
+            fdbk_stim.draw()
+        stim.draw_scale(w)
 
     # Run trial
-    while t.getTime() < trial['ons'] + trial['dur']:
-
-        if not keys:
-            keys = event.getKeys(keyList = keylist, timeStamped=rt_clock)
-        else:
-        	idx = keylist.index(keys[0][0])
-        	fdbk_stim = visual.Rect(w,
-        		size=(.15, .2),
-        		lineWidth=2,
-        		lineColor='white',
-        		fillColor=None,
-        		pos=(scale_xs[idx], -.01))
-        
-        fdbk_stim.draw()
-        stim.draw_scale(w)
-        w.flip()
+    data['true_ons'] = get_scheduler(w,t).hold(trial, draw, update)
     print(keys)
 
     # Save participant's response
@@ -251,7 +303,7 @@ def rate(w,t,trial,state,cursor):
     data['rt'] = keys[0][1] if keys else None
 
     # Save data
-    out = copy.deepcopy(trial)
+    out = dict(trial)
     out.update(data)
     return out
 
@@ -266,8 +318,100 @@ fun_dict = {
     'rate': rate,
 }
 
+# optional frame timing (see teaching_frames.FrameTimer)
+frame_timer = None
+
+# scheduler for the current run (see teaching_schedule.Scheduler)
+scheduler = None
+
+# Helper function: Scheduler for a window and clock (a new one, if trials
+# are presented outside of run())
+def get_scheduler(w,t):
+    global scheduler
+    if scheduler is None or scheduler.w is not w or scheduler.t is not t:
+        scheduler = schedule.Scheduler(w, t, frame_timer=frame_timer)
+    return scheduler
+
 # main method: call the presentation function corresponding to the current trial
 def present(w,t,trial,state,cursor):
     fun = fun_dict[trial['type']]
+    if key_source is not None:
+        key_source.start_trial(t, trial, state, cursor)
+    if frame_timer is not None:
+        frame_timer.start_trial(t, trial)
     data = fun(w,t,trial,state,cursor)
-    return data
\ No newline at end of file
+    if frame_timer is not None:
+        frame_timer.end_trial()
+    return data
+
+# run all trials in a timing file, appending each trial's data to data
+# (and to trial_log, if given, with a checkpoint of the loop state: see
+# teaching_checkpoint); corners are where the cursor starts on each
+# problem (shuffled if not given); offset is added to onsets in checkpoints
+# (for runs resumed partway, whose onsets were shifted)
+def run(w,t,timing,data,trial_log=None,corners=None,offset=0.):
+    global scheduler
+    scheduler = schedule.Scheduler(w, t, timing, frame_timer)
+    load() # already loaded, if the task called load() before starting the clock
+
+    # starting points
+    new_state = new_board() # read-only, so it can be shared between problems
+    if corners is None:
+        corners = [(0,0),(0,5),(5,0),(5,5)] # where to start cursor
+        random.shuffle(corners)
+    corners = list(corners)
+
+    # init exp loop (resumed runs start partway through the problems)
+    problem_counter = next((trial['problem_idx'] for trial in timing if 'problem_idx' in trial), 0)
+    last_problem = -1 # last problem with a trial (for checkpoints)
+    state = new_state
+    cursor = corners.pop()
+    highlight = None
+
+    for trial in timing:
+        # is this a new problem?
+        if 'problem_idx' in trial:
+            if  trial['problem_idx'] > problem_counter:
+
+                # if so, refresh the game state
+                print('\n==== NEW PROBLEM: %i ====' % trial['problem'])
+                state = new_state
+                cursor = corners.pop()
+
+                # and update counter
+                problem_counter = trial['problem_idx']
+
+        # hacky workaround to show off the last-selected example
+        if trial['type'] == 'show':
+            trial_data = present(w,t,trial,state,highlight)
+        else:
+            trial_data = present(w,t,trial,state,cursor)
+        data.append(trial_data)
+        if 'problem_idx' in trial:
+            last_problem = trial['problem_idx']
+
+        # update state and cursor after choose trials
+        if trial['type'] == 'choose':
+
+            state = trial_data['state']
+            cursor = trial_data['cursor']
+
+            last_example = trial_data['example']
+            if last_example is not None:
+                highlight = cursor
+            else:
+                highlight = None
+
+        if trial_log is not None:
+            # new: save data after each trial, with the state after it
+            trial_log.append(trial_data, {
+                'ons': round(trial['ons'] + offset, 6),
+                'problem_counter': problem_counter,
+                'last_problem': last_problem,
+                'state': state,
+                'cursor': cursor,
+                'corners': list(corners),
+                'highlight': highlight
+            })
+
+    return data
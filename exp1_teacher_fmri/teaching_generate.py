@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, functools, json, os, re, time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import teaching_maze_paths as paths
+import teaching_model
+import teaching_problems
+
+n_rows, n_cols = 6, 6
+
+### CONSTRAINTS ###
+# Defaults are loose enough to include every hand-made maze and problem in
+# inputs/. Sizes are in tiles, path lengths in moves.
+maze_constraints = {
+    'min_open': 10, 'max_open': 32, # open tiles
+    'min_path': 3, 'max_path': 22, # fewest moves from start to goal
+    'min_detour': 0 # ... minus moves if there were no walls
+}
+
+problem_constraints = {
+    'min_size': 4, 'max_size': 30, # tiles in each hypothesis
+    'min_overlap': 0., 'max_overlap': .9, # overlap of A with each other hypothesis (intersection / union)
+    'min_diff': 2, # tiles that tell any two hypotheses apart
+    'max_unique': 0, # tiles of A that are in no other hypothesis (one such example gives A away)
+    'max_first': .65, # learner's posterior on A after the best single example (strong sampling)
+    'min_second': .4 # ... and after the best pair of examples
+}
+
+### RANDOM SHAPES ###
+# Unions of 1 to max_rects random rectangles, (n, 6, 6) bool. Rectangles are
+# heights x widths tiles, with sides drawn from (lo, hi) inclusive; with
+# bars=True, either side can be the long one.
+def random_shapes(rng, n, max_rects, heights, widths, bars=False):
+    h = rng.integers(heights[0], heights[1] + 1, (n, max_rects))
+    w = rng.integers(widths[0], widths[1] + 1, (n, max_rects))
+    if bars:
+        flip = rng.random((n, max_rects)) < .5
+        h, w = np.where(flip, w, h), np.where(flip, h, w)
+    r0 = (rng.random((n, max_rects))*(n_rows - h + 1)).astype(int)
+    c0 = (rng.random((n, max_rects))*(n_cols - w + 1)).astype(int)
+
+    rows, cols = np.arange(n_rows), np.arange(n_cols)
+    in_rows = (rows >= r0[..., None]) & (rows < (r0 + h)[..., None]) # (n, max_rects, 6)
+    in_cols = (cols >= c0[..., None]) & (cols < (c0 + w)[..., None])
+    used = np.arange(max_rects) < rng.integers(1, max_rects + 1, n)[:, None]
+    return (in_rows[..., :, None] & in_cols[..., None, :] & used[..., None, None]).any(axis=1)
+
+# Helper function: One number per 6 x 6 grid (..., 6, 6), to compare grids quickly
+def grid_codes(grids):
+    bits = np.asarray(grids, dtype=np.int64).reshape(np.shape(grids)[:-2] + (n_rows*n_cols,))
+    return bits @ (np.int64(1) << np.arange(n_rows*n_cols, dtype=np.int64))
+
+# Helper function: A random open tile of each grid, (n, 2)
+def random_tiles(rng, grids):
+    noise = np.where(grids.reshape(len(grids), -1), rng.random((len(grids), n_rows*n_cols)), -1)
+    return np.stack(np.divmod(noise.argmax(axis=1), n_cols), axis=1)
+
+### MAZES ###
+# Mazes are corridors: unions of 1-2 tile wide bars, as in inputs/mazes.json
+def random_mazes(rng, n):
+    grids = random_shapes(rng, n, 4, (1, 2), (3, 6), bars=True)
+    return grids, random_tiles(rng, grids), random_tiles(rng, grids)
+
+# Which candidate mazes meet the constraints: every open tile can be
+# reached, and the goal is neither too close nor too far (or too direct)
+def check_mazes(grids, starts, goals, c):
+    n = len(grids)
+    n_open = grids.sum(axis=(1, 2))
+    dist = paths.distances_from(grids, starts)
+    to_goal = dist[np.arange(n), goals[:, 0]*n_cols + goals[:, 1]]
+
+    ok = (n_open >= c['min_open']) & (n_open <= c['max_open'])
+    ok &= ((dist >= 0) | ~grids.reshape(n, -1)).all(axis=1)
+    ok &= (to_goal >= c['min_path']) & (to_goal <= c['max_path'])
+    ok &= to_goal - np.abs(goals - starts).sum(axis=1) >= c['min_detour']
+    return ok
+
+### TEACHING PROBLEMS ###
+# Every single example and pair of examples (see teaching_model)
+@functools.lru_cache(maxsize=None)
+def example_sets():
+    masks = teaching_model.enumerate_example_sets(2)
+    return masks[1:], masks[1:].sum(axis=1)
+
+# Hypotheses A-D are unions of 1-2 rectangles
+def random_problems(rng, n):
+    return random_shapes(rng, 4*n, 2, (1, 6), (1, 6)).reshape(n, 4, n_rows, n_cols)
+
+# Which candidate problems meet the constraints; problems that share a
+# hypothesis with any of exclude (grid codes) are left out
+def check_problems(grids, c, exclude=()):
+    hyps = grids.reshape(len(grids), 4, -1)
+    sizes = hyps.sum(axis=-1)
+    ok = ((sizes >= c['min_size']) & (sizes <= c['max_size'])).all(axis=1)
+
+    # Every pair of hypotheses differs in enough tiles
+    i, j = np.triu_indices(4, 1)
+    ok &= ((hyps[:, i] ^ hyps[:, j]).sum(axis=-1) >= c['min_diff']).all(axis=1)
+
+    # A overlaps with every other hypothesis, but not too much
+    overlap = (hyps[:, :1] & hyps[:, 1:]).sum(axis=-1)/np.maximum((hyps[:, :1] | hyps[:, 1:]).sum(axis=-1), 1)
+    ok &= ((overlap >= c['min_overlap']) & (overlap <= c['max_overlap'])).all(axis=1)
+    ok &= (hyps[:, 0] & ~hyps[:, 1:].any(axis=1)).sum(axis=-1) <= c['max_unique']
+    ok &= ~np.isin(grid_codes(grids), exclude).any(axis=1)
+
+    # Discriminability under the learner model, for problems that are left
+    idx = np.flatnonzero(ok)
+    if len(idx):
+        masks, n_examples = example_sets()
+        post = np.nan_to_num(teaching_model.posterior(hyps[idx], masks)[..., 0]) # (len(idx), n_sets)
+        ok[idx] = ((post[:, n_examples == 1].max(axis=1) <= c['max_first']) &
+                   (post[:, n_examples == 2].max(axis=1) >= c['min_second']))
+    return ok
+
+# Helper function: Problem as saved in problems files
+def to_problem(grids):
+    return {key: grids[i].astype(int).tolist() for i, key in enumerate(teaching_problems.hypothesis_keys)}
+
+### GENERATING SETS ###
+# Draw and check one batch of candidates (runs in a worker process). Returns
+# the ones that pass as (key, item) pairs, with key to tell duplicates apart.
+def generate_batch(args):
+    kind, seed, sub, batch, batch_size, constraints, exclude = args
+    rng = np.random.default_rng([seed, sub, batch])
+
+    if kind == 'mazes':
+        grids, starts, goals = random_mazes(rng, batch_size)
+        ok = check_mazes(grids, starts, goals, constraints)
+        return [(int(grid_codes(grids[i])),
+                 {'maze': grids[i].astype(int).tolist(), 'start': starts[i].tolist(), 'goal': goals[i].tolist()})
+                for i in np.flatnonzero(ok)]
+
+    grids = random_problems(rng, batch_size)
+    ok = check_problems(grids, constraints, exclude)
+    return [(tuple(grid_codes(grids[i]).tolist()), to_problem(grids[i])) for i in np.flatnonzero(ok)]
+
+# main method: n distinct mazes or problems (kind) for a subject, checked in
+# batches of batch_size candidates in parallel. The same seed and subject
+# always give the same set.
+def generate(kind, n, sub=0, seed=0, constraints=None, exclude=(), batch_size=2000, workers=None, max_batches=500):
+    constraints = dict(maze_constraints if kind == 'mazes' else problem_constraints, **(constraints or {}))
+    exclude = np.asarray(exclude, dtype=np.int64)
+    n_jobs = workers or os.cpu_count() or 1
+
+    items, seen = [], set()
+    batch = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while len(items) < n:
+            if batch >= max_batches:
+                raise RuntimeError('Found %i of %i %s in %i candidates; try looser constraints' %
+                                   (len(items), n, kind, batch*batch_size))
+            jobs = [(kind, seed, sub, batch + i, batch_size, constraints, exclude) for i in range(n_jobs)]
+            for results in pool.map(generate_batch, jobs):
+                for key, item in results:
+                    if key not in seen:
+                        seen.add(key)
+                        items.append(item)
+            batch += n_jobs
+    return items[:n], batch*batch_size
+
+# Helper function: Grid codes of every hypothesis in a problems file (to exclude)
+def problem_codes(in_file):
+    return grid_codes(teaching_problems.compile_problems(in_file)).ravel()
+
+# Helper function: Where to save a subject's practice set
+def practice_path(out_dir, sub, kind):
+    return os.path.join(out_dir, 'sub-%02d_%s.json' % (sub, 'mazes' if kind == 'mazes' else 'practice_problems'))
+
+def save_json(out_file, items):
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    tmp_file = out_file + '.tmp'
+    with open(tmp_file, 'w') as out:
+        # One row of tiles per line, as in the hand-made files
+        text = json.dumps(items, indent=4)
+        out.write(re.sub(r'\[[\d,\s]+\]', lambda m: json.dumps(json.loads(m.group())), text))
+    os.replace(tmp_file, out_file)
+
+if __name__ == '__main__':
+    # Usage: python teaching_generate.py --sub 32 33 34
+    #        (teaching_mazes.py and teaching_practice.py then use them for --sub=32)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sub', type=int, nargs='+', required=True, help='Subject #s (int)')
+    parser.add_argument('--mazes', type=int, default=8, help='Mazes per subject')
+    parser.add_argument('--problems', type=int, default=4, help='Practice problems per subject')
+    parser.add_argument('--exclude', default='inputs/problems.json',
+                        help='Scanner problems: practice problems never share a hypothesis with them')
+    parser.add_argument('--set', nargs='+', default=[], metavar='NAME=VALUE',
+                        help='Change constraints (see maze_constraints, problem_constraints), e.g. --set min_detour=4 max_overlap=.8')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=2000, help='Candidates checked at once, per worker')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=teaching_problems.practice_dir)
+    parser.add_argument('-force', action='store_true',
+                        help='Use this flag to overwrite existing practice sets')
+    args = parser.parse_args()
+
+    existing = [f for sub in args.sub for kind in ('mazes', 'problems')
+                for f in [practice_path(args.out, sub, kind)] if os.path.exists(f)]
+    if existing and not args.force:
+        parser.error('Practice sets already exist (use -force to overwrite): %s' % ', '.join(existing))
+
+    constraints = {}
+    for setting in args.set:
+        name, _, value = setting.partition('=')
+        if name not in maze_constraints and name not in problem_constraints:
+            parser.error('Unknown constraint: %s' % name)
+        constraints[name] = float(value)
+
+    exclude = problem_codes(args.exclude)
+    for sub in args.sub:
+        for kind, n in (('mazes', args.mazes), ('problems', args.problems)):
+            t0 = time.time()
+            kind_constraints = {name: value for name, value in constraints.items()
+                                if name in (maze_constraints if kind == 'mazes' else problem_constraints)}
+            items, n_checked = generate(kind, n, sub, args.seed, kind_constraints, exclude,
+                                        batch_size=args.batch_size, workers=args.workers)
+            out_file = practice_path(args.out, sub, kind)
+            save_json(out_file, items)
+            secs = time.time() - t0
+            print('sub-%02d: %i %s, %i candidates checked in %.1f s (%.0f/s) -> %s' %
+                  (sub, len(items), kind, n_checked, secs, n_checked/secs, out_file))
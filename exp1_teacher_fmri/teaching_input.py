@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import collections, select, struct, threading, time
+
+# How often the psychopy keyboard backend checks for new keypresses (in seconds)
+poll_interval = .0005
+
+### INPUT BACKENDS ###
+# Base class: a background thread reads keypresses, with timestamps from the
+# device, into a deque (appends and pops are atomic, so no lock is needed).
+# Same interface as game.key_source (see teaching_simulate.KeySource):
+# get_keys() hands out keypresses as (key, time on the run clock t).
+class InputThread:
+    def __init__(self):
+        self.events = collections.deque() # (key, time on the device's clock)
+        self.clock = None # run clock the offset below was measured for
+        self.clock_offset = 0.
+        self.running = True
+        self.thread = threading.Thread(target=self._read_loop, daemon=True)
+        self.thread.start()
+
+    def _read_loop(self):
+        while self.running:
+            for key, key_t in self.read():
+                self.events.append((key, key_t))
+
+    # Helper function: Current time on the device's clock
+    def now(self):
+        return time.monotonic()
+
+    # Helper function: Keypresses since the last call, as (key, device time)
+    def read(self):
+        return []
+
+    # Helper function: Device time - run clock time (measured once per clock)
+    def offset(self, t):
+        if t is not self.clock:
+            before = self.now()
+            t_now = t.getTime()
+            after = self.now()
+            self.clock = t
+            self.clock_offset = (before + after)/2 - t_now
+        return self.clock_offset
+
+    def start_trial(self, t, trial, state, cursor):
+        pass
+
+    def get_keys(self, keylist, t):
+        offset = self.offset(t)
+        keys = []
+        while self.events:
+            key, key_t = self.events.popleft()
+            if keylist is None or key in keylist:
+                keys.append((key, key_t - offset))
+        return keys
+
+    def clear_keys(self):
+        self.events.clear()
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1)
+
+# psychopy's keyboard (psychtoolbox backend): keypresses are timestamped
+# when they happen, not when they are polled
+class PsychopyKeys(InputThread):
+    def __init__(self):
+        from psychopy import core
+        from psychopy.hardware import keyboard
+        self.core = core
+        self.keyboard = keyboard.Keyboard()
+        super().__init__()
+
+    def now(self):
+        return self.core.getTime()
+
+    def read(self):
+        time.sleep(poll_interval)
+        return [(key.name, key.tDown) for key in self.keyboard.getKeys(waitRelease=False, clear=True)]
+
+# Linux input device (e.g. the button box, /dev/input/by-id/...), read with
+# evdev: timestamps come from the kernel
+EVIOCSCLOCKID = 0x400445a0 # ioctl: which clock to timestamp events with
+
+class EvdevKeys(InputThread):
+    def __init__(self, device):
+        import evdev
+        self.ecodes = evdev.ecodes
+        self.device = evdev.InputDevice(device)
+
+        # Ask for timestamps on the monotonic clock (the default, wall-clock
+        # time, can jump)
+        try:
+            import fcntl
+            fcntl.ioctl(self.device.fd, EVIOCSCLOCKID, struct.pack('i', time.CLOCK_MONOTONIC))
+            self.now = time.monotonic
+        except OSError:
+            print('Could not switch %s to the monotonic clock, using wall-clock time' % device)
+            self.now = time.time
+        super().__init__()
+
+    # Helper function: evdev key code -> psychopy key name (KEY_EQUAL -> 'equal')
+    def key_name(self, code):
+        name = self.ecodes.KEY.get(code, '')
+        if isinstance(name, list):
+            name = name[0]
+        return name[4:].lower() if name.startswith('KEY_') else name.lower()
+
+    def read(self):
+        ready, _, _ = select.select([self.device.fd], [], [], .1)
+        if not ready:
+            return []
+        return [(self.key_name(ev.code), ev.timestamp()) for ev in self.device.read()
+                if ev.type == self.ecodes.EV_KEY and ev.value == 1] # key down only
+
+    def close(self):
+        super().close()
+        self.device.close()
+
+# Clock on a backend's own timebase, starting now (for checking devices)
+class DeviceClock:
+    def __init__(self, source):
+        self.source = source
+        self.t0 = source.now()
+
+    def getTime(self):
+        return self.source.now() - self.t0
+
+def make_input(backend, device=None):
+    if backend == 'keyboard':
+        return PsychopyKeys()
+    if backend == 'evdev':
+        if device is None:
+            raise ValueError('The evdev backend needs an input device (e.g. /dev/input/event3)')
+        return EvdevKeys(device)
+    raise ValueError('Unknown input backend: %s' % backend)
+
+if __name__ == '__main__':
+    # Usage: python teaching_input.py --input evdev --input-device /dev/input/event3
+    # (prints keypresses and their timestamps, to check a button box)
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default='keyboard', choices=['keyboard', 'evdev'])
+    parser.add_argument('--input-device', help='Input device (evdev backend)')
+    args = parser.parse_args()
+
+    source = make_input(args.input, args.input_device)
+    t = DeviceClock(source)
+    print('Press keys (Ctrl+C to quit)')
+    try:
+        while True:
+            for key, key_t in source.get_keys(None, t):
+                print('%s at %.4f s (%.2f ms ago)' % (key, key_t, (t.getTime() - key_t)*1000))
+            time.sleep(.01)
+    except KeyboardInterrupt:
+        source.close()
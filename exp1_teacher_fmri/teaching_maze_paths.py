@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json, os
+import numpy as np
+
+import teaching_problems
+
+# Mazes are 6 x 6; tiles are numbered row by row (idx = row*6 + col)
+n_rows, n_cols = 6, 6
+
+# Participants who haven't learned the button box by the last few mazes
+# are flagged: paths much longer than needed, or slow keypresses
+check_mazes = 3 # last # of mazes to check
+min_efficiency = .6 # optimal # of keypresses / # of keypresses
+max_latency = 1.5 # seconds per keypress (median)
+
+### COMPILING MAZES ###
+# Turn a mazes file into arrays: open tiles (n_mazes, 6, 6) bool, and
+# start and goal tiles (n_mazes, 2)
+def compile_mazes(in_file):
+    with open(in_file) as file:
+        mazes = json.load(file)
+    grids = np.array([m['maze'] for m in mazes]) > 0
+    starts = np.array([m['start'] for m in mazes])
+    goals = np.array([m['goal'] for m in mazes])
+    return grids, starts, goals
+
+# Shortest paths from one tile of each maze to every other tile (breadth-first
+# search, for all mazes at once): (n_mazes, 36) # of moves, -1 if there is no
+# path. Moves go up, down, left or right into open tiles (see
+# teaching_mazes.update_location).
+def distances_from(grids, sources):
+    n = len(grids)
+    is_open = np.asarray(grids, dtype=bool)
+    sources = np.asarray(sources)
+
+    dist = np.full((n, n_rows, n_cols), -1, dtype=np.int16)
+    frontier = np.zeros(is_open.shape, dtype=bool)
+    frontier[np.arange(n), sources[:, 0], sources[:, 1]] = True
+    frontier &= is_open
+    reached = frontier.copy()
+    dist[frontier] = 0
+    for d in range(1, n_rows*n_cols):
+        # Open tiles next to the frontier
+        step = np.zeros_like(frontier)
+        step[:, 1:] |= frontier[:, :-1]
+        step[:, :-1] |= frontier[:, 1:]
+        step[:, :, 1:] |= frontier[:, :, :-1]
+        step[:, :, :-1] |= frontier[:, :, 1:]
+        frontier = step & is_open & ~reached
+        if not frontier.any():
+            break
+        dist[frontier] = d
+        reached |= frontier
+    return dist.reshape(n, -1)
+
+# Shortest paths between every pair of tiles in every maze: (n_mazes, 36, 36)
+def distance_tables(grids):
+    n = len(grids)
+    tiles = np.stack(np.divmod(np.arange(n_rows*n_cols), n_cols), axis=1)
+    dist = distances_from(np.repeat(grids, len(tiles), axis=0), np.tile(tiles, (n, 1)))
+    return dist.reshape(n, len(tiles), len(tiles))
+
+# Helper function: Where to cache a maze file's distance tables
+def cache_file(in_file):
+    name = os.path.splitext(os.path.basename(in_file))[0]
+    return os.path.join(teaching_problems.cache_dir, name + '_distances.npy')
+
+# Load distance tables (memory-mapped), recomputing them if the cache is stale
+def load_distances(in_file, grids):
+    npy_file = cache_file(in_file)
+    if os.path.exists(npy_file) and os.path.getmtime(npy_file) >= os.path.getmtime(in_file):
+        return np.load(npy_file, mmap_mode='r')
+
+    dist = distance_tables(grids)
+    try:
+        os.makedirs(teaching_problems.cache_dir, exist_ok=True)
+        tmp_file = npy_file + '.%i.tmp' % os.getpid()
+        with open(tmp_file, 'wb') as f:
+            np.save(f, dist)
+        os.replace(tmp_file, npy_file)
+    except OSError:
+        print('Could not cache maze distances to: %s' % npy_file)
+        return dist
+    return np.load(npy_file, mmap_mode='r')
+
+### MAZE STORE ###
+class MazeStore:
+    def __init__(self, grids, starts, goals, dist):
+        self.grids = grids
+        self.starts = starts
+        self.goals = goals
+        self.dist = dist
+
+    def __len__(self):
+        return len(self.grids)
+
+    # Fewest moves between two tiles of a maze (-1: no path)
+    def distance(self, idx, a, b):
+        return int(self.dist[idx, a[0]*n_cols + a[1], b[0]*n_cols + b[1]])
+
+    # Fewest keypresses to solve a maze: moves to the goal, then ACTION
+    def optimal(self, idx):
+        return self.distance(idx, self.starts[idx], self.goals[idx]) + 1
+
+# Mazes for a subject: their own set if one was generated (see teaching_generate)
+def mazes_file(sub=None):
+    if sub is not None:
+        sub_file = os.path.join(teaching_problems.practice_dir, 'sub-%02d_mazes.json' % int(sub))
+        if os.path.exists(sub_file):
+            return sub_file
+    return 'inputs/mazes.json'
+
+# main method: load a mazes file into a maze store
+def load(in_file='inputs/mazes.json'):
+    grids, starts, goals = compile_mazes(in_file)
+    return MazeStore(grids, starts, goals, load_distances(in_file, grids))
+
+### PATH LOG ###
+# Keeps every keypress of a participant's run through the mazes, and scores
+# each maze as soon as it is solved: efficiency (optimal # of keypresses /
+# # of keypresses) and keypress latency (time since the maze or the last
+# keypress). Finished mazes are appended to trial_log (see teaching_datalog).
+class MazeLog:
+    def __init__(self, store, trial_log=None):
+        self.store = store
+        self.trial_log = trial_log
+        self.records = []
+        self.current = None
+
+    def start_maze(self, idx, t):
+        start = tuple(int(x) for x in self.store.starts[idx])
+        self.current = {
+            'maze': idx,
+            'start': start,
+            'goal': tuple(int(x) for x in self.store.goals[idx]),
+            'optimal': self.store.optimal(idx),
+            'ons': t,
+            'moves': []
+        }
+        self.last_t = t
+        self.last_loc = start
+
+    # Log one keypress: where it left the cursor, and how far it is from the goal
+    def move(self, key, t, row, col):
+        rec = self.current
+        rec['moves'].append({
+            'key': key,
+            't': t,
+            'latency': t - self.last_t,
+            'loc': (row, col),
+            'bumped': (row, col) == self.last_loc,
+            'to_goal': self.store.distance(rec['maze'], (row, col), rec['goal'])
+        })
+        self.last_t = t
+        self.last_loc = (row, col)
+
+    def end_maze(self, t, solved=True):
+        rec = self.current
+        moves = rec['moves']
+        rec.update({
+            'dur': t - rec['ons'],
+            'solved': solved,
+            'n_moves': len(moves),
+            'efficiency': rec['optimal']/len(moves) if solved and moves else None,
+            'latency': float(np.median([m['latency'] for m in moves])) if moves else None,
+            'n_bumps': sum(m['bumped'] for m in moves)
+        })
+        self.records.append(rec)
+        if self.trial_log is not None:
+            self.trial_log.append(rec)
+        self.current = None
+
+        print('Maze %i: %i keypresses (optimal: %i), efficiency: %s, median latency: %s' %
+              (rec['maze'], rec['n_moves'], rec['optimal'],
+               '-' if rec['efficiency'] is None else '%.2f' % rec['efficiency'],
+               '-' if rec['latency'] is None else '%.2f s' % rec['latency']))
+        return rec
+
+    # Reasons to check in with the participant before the scan (empty if none)
+    def flags(self):
+        last = self.records[-check_mazes:]
+        if not last:
+            return ['No mazes were completed']
+
+        flags = []
+        unsolved = [rec['maze'] for rec in last if not rec['solved']]
+        if unsolved:
+            flags.append('Mazes not solved: %s' % ', '.join(map(str, unsolved)))
+        effs = [rec['efficiency'] for rec in last if rec['efficiency'] is not None]
+        if effs and np.median(effs) < min_efficiency:
+            flags.append('Paths are long: median efficiency %.2f (< %.2f)' % (np.median(effs), min_efficiency))
+        latencies = [m['latency'] for rec in last for m in rec['moves']]
+        if latencies and np.median(latencies) > max_latency:
+            flags.append('Keypresses are slow: median latency %.2f s (> %.2f s)' % (np.median(latencies), max_latency))
+        return flags
+
+if __name__ == '__main__':
+    # Usage: python teaching_maze_paths.py (prints the optimal # of keypresses for every maze)
+    store = load()
+    for idx in range(len(store)):
+        print('Maze %i: start %s, goal %s, optimal: %i keypresses' %
+              (idx, tuple(store.starts[idx].tolist()), tuple(store.goals[idx].tolist()), store.optimal(idx)))
@@ -6,68 +6,45 @@ Created on Tue Aug 14 20:42:00 2021
 @author: nataliavelez
 """
 import argparse
-import json, random
+import json, os, random, time
 import numpy as np
-from psychopy import gui, core, visual, event, data, monitors # Stimulus presentation
-import PIL # Read image size
-
-### SETUP ###
-# Parse arguments
-# We'll use different key mappings inside vs. outside the scanner
-parser=argparse.ArgumentParser()
-parser.add_argument('-scan', action='store_true',
-                   help='Use this flag when running the practice task in the scanner')
-
-print('\n=== SETTING UP RUN ===')
-print('Passing arguments...')
-args=parser.parse_args()
-
-if args.scan:
-    print('Using scanner keymap')
-    keylist = ('0', '1', '2', '3', '4', 'q') # in scanner
-    start_prompt = "Press any key to start"
-    start_key = ['0', '1', '2', '3', '4', 'equal']
-    width, height = (800, 600) # scanning monitor
-    w = visual.Window(fullscr=True, size=(width, height), screen = 0, color='black') # debug
 
-    
-	
-else: 
-    print('Using laptop keymap')
-    keylist = ('space', 'j','k','l','semicolon', 'q') # outside of scanner
-    start_prompt = "Press = to start"
-    start_key = ['equal']
-    width, height = (1024, 768) # practice laptop
-    w = visual.Window(fullscr=False, size=(width, height), screen = 0, color='black') # debug
-
-# Set up monitor
-aspect = width/height
-w.mouseVisible = False # uncomment for production
-
-# Load mazes
-with open('inputs/mazes.json') as file:
-    mazes = json.load(file)
+# Experiment-specific modules
+import teaching_datalog as datalog
+import teaching_maze_paths as paths
 
 # Experiment parameters
 colordict = {
     'ground': [(94, 93, 95), (214, 214, 214), (238, 188, 64)],
     'cursor': (72, 160, 248)
 }
-keymap = dict(zip(keylist, ((0,0,True), (0,-1,False), (-1,0,False),(1,0,False),(0,1,False),(0,0,False))))
-
-# Tile locations
-x = np.linspace(-.5, .5, 6)
-y = np.linspace(-.5*aspect, .5*aspect, 6)
-y = np.flip(y)
-xys = [(x_i, y_i) for y_i in y for x_i in x]
 sq_size = (1/6)*.95
 
+# Prompts introducing the keys
+key_explanation = """In this task, you'll use a button box to move a cursor.
+Each button moves the cursor in a different direction.
+First, we're going to practice using the buttons!\n\n
+Press any button to continue.
+"""
+
+button_check = """To begin, make sure that each of your fingers is resting on a different button.\n\n
+Press any button to continue.
+"""
+
+# Window, key mappings and tile locations: set up in main(), since they
+# depend on whether we're in the scanner (importing this module does nothing)
+w = visual = None
+width = height = aspect = None
+keylist = keymap = None
+x = y = xys = None
+
 ### DRAWING FUNCTIONS ###
 # Helper function: Draw hand
 def draw_hand():
     hand_img = 'assets/hand_diagram.png'
 
     # Image dimensions
+    import PIL.Image
     hand_w_pix, hand_h_pix = PIL.Image.open(hand_img).size
     hand_w = hand_w_pix/width
     hand_h = hand_h_pix/height
@@ -141,130 +118,206 @@ def update_location(maze,r0,c0,key):
 
     return row,col,win_state
 
-### START SCAN ###
-if args.scan:
-    countdown = 5
-    for sec in range(countdown):
-        txt = "Please lie very still!\nWe will begin in:\n\n%i" % (countdown-sec) 
-        still_txt = visual.TextStim(w, text=txt, pos=(0,0.1), wrapWidth=2)
-        still_txt.draw()
-        w.flip()
-        core.wait(1)
-
-start_txt = visual.TextStim(w, text=start_prompt, pos=(0,0), wrapWidth=2)
-start_txt.draw()
-w.flip()
-event.waitKeys(keyList=start_key)
-
-### INTRODUCE KEYS ###
-# Write prompts
-key_explanation = """In this task, you'll use a button box to move a cursor.
-Each button moves the cursor in a different direction.
-First, we're going to practice using the buttons!\n\n
-Press any button to continue.
-"""
-
-button_check = """To begin, make sure that each of your fingers is resting on a different button.\n\n
-Press any button to continue.
-"""
-
-for prompt in [key_explanation, button_check]:
-    txt = visual.TextStim(w, text=prompt, pos=(0,0), wrapWidth=1.75)
-    txt.draw()
+# main method: run the maze practice
+def main():
+    global w, visual, width, height, aspect, keylist, keymap, x, y, xys
+    from psychopy import core, visual, event # Stimulus presentation
+    import PIL.Image # Read image size
+
+    ### SETUP ###
+    # Parse arguments
+    # We'll use different key mappings inside vs. outside the scanner
+    parser=argparse.ArgumentParser()
+    parser.add_argument('-scan', action='store_true',
+                       help='Use this flag when running the practice task in the scanner')
+    parser.add_argument('--sub', help='Subject # (int)')
+
+    print('\n=== SETTING UP RUN ===')
+    print('Passing arguments...')
+    args=parser.parse_args()
+
+    if args.sub is not None:
+        sub=int(args.sub)
+    else:
+        print('No subject, running debug')
+        sub=0
+
+    if args.scan:
+        print('Using scanner keymap')
+        keylist = ('0', '1', '2', '3', '4', 'q') # in scanner
+        start_prompt = "Press any key to start"
+        start_key = ['0', '1', '2', '3', '4', 'equal']
+        width, height = (800, 600) # scanning monitor
+        w = visual.Window(fullscr=True, size=(width, height), screen = 0, color='black') # debug
+
+    else: 
+        print('Using laptop keymap')
+        keylist = ('space', 'j','k','l','semicolon', 'q') # outside of scanner
+        start_prompt = "Press = to start"
+        start_key = ['equal']
+        width, height = (1024, 768) # practice laptop
+        w = visual.Window(fullscr=False, size=(width, height), screen = 0, color='black') # debug
+
+    # Set up monitor
+    aspect = width/height
+    w.mouseVisible = False # uncomment for production
+
+    # Load mazes, and their shortest paths (see teaching_maze_paths)
+    mazes_file = paths.mazes_file(args.sub)
+    print('Loading mazes from: %s' % mazes_file)
+    with open(mazes_file) as file:
+        mazes = json.load(file)
+    maze_store = paths.load(mazes_file)
+
+    # Every keypress in the mazes is logged (see teaching_datalog.TrialLog)
+    os.makedirs('data', exist_ok=True)
+    out_file = 'data/sub-%02d_task-mazes_behavioral_%i.json' % (sub, int(time.time()))
+    maze_log = paths.MazeLog(maze_store, datalog.TrialLog(out_file))
+
+    # Experiment parameters
+    keymap = dict(zip(keylist, ((0,0,True), (0,-1,False), (-1,0,False),(1,0,False),(0,1,False),(0,0,False))))
+
+    # Tile locations
+    x = np.linspace(-.5, .5, 6)
+    y = np.linspace(-.5*aspect, .5*aspect, 6)
+    y = np.flip(y)
+    xys = [(x_i, y_i) for y_i in y for x_i in x]
+
+    ### START SCAN ###
+    if args.scan:
+        countdown = 5
+        for sec in range(countdown):
+            txt = "Please lie very still!\nWe will begin in:\n\n%i" % (countdown-sec) 
+            still_txt = visual.TextStim(w, text=txt, pos=(0,0.1), wrapWidth=2)
+            still_txt.draw()
+            w.flip()
+            core.wait(1)
+
+    start_txt = visual.TextStim(w, text=start_prompt, pos=(0,0), wrapWidth=2)
+    start_txt.draw()
     w.flip()
-    event.waitKeys(keyList=keylist)
-
-### PRACTICE USING KEYS ###
-# Round 1: In order, with colors
-practice_cmds = list(zip(
-    keylist[:-1],
-    ('ACTION', 'LEFT', 'UP', 'DOWN', 'RIGHT'),
-    ('#e25a25', '#d973a9', '#f1e507', '#00a170', '#33b5e8')
-))
+    event.waitKeys(keyList=start_key)
 
-# Round 2: Shuffled, with colors
-shuffled_cmds = practice_cmds[:]
-random.shuffle(shuffled_cmds)
-
-# Round 3: Shuffled, no colors
-colorless_cmds = practice_cmds[:]
-colorless_cmds = [(key, prompt, '#ffffff') for key,prompt,_ in colorless_cmds]
-random.shuffle(colorless_cmds)
-
-# Putting everything together
-all_cmds = practice_cmds+shuffled_cmds+colorless_cmds
-
-for correct, prompt, color in all_cmds:
-    
-    # Write prompts
-    prompt_txt = visual.TextStim(w, text='Please press the following key', pos=(0,.75), wrapWidth=2)
-    cmd_txt = visual.TextStim(w, text=prompt, pos=(0,.5), color=color, bold=True)
-
-    # Draw stimuli
-    prompt_txt.draw()
-    cmd_txt.draw()
-    draw_hand()
-    w.flip()
+    ### INTRODUCE KEYS ###
+    # Write prompts (see key_explanation, button_check above)
+    for prompt in [key_explanation, button_check]:
+        txt = visual.TextStim(w, text=prompt, pos=(0,0), wrapWidth=1.75)
+        txt.draw()
+        w.flip()
+        event.waitKeys(keyList=keylist)
+
+    ### PRACTICE USING KEYS ###
+    # Round 1: In order, with colors
+    practice_cmds = list(zip(
+        keylist[:-1],
+        ('ACTION', 'LEFT', 'UP', 'DOWN', 'RIGHT'),
+        ('#e25a25', '#d973a9', '#f1e507', '#00a170', '#33b5e8')
+    ))
+
+    # Round 2: Shuffled, with colors
+    shuffled_cmds = practice_cmds[:]
+    random.shuffle(shuffled_cmds)
+
+    # Round 3: Shuffled, no colors
+    colorless_cmds = practice_cmds[:]
+    colorless_cmds = [(key, prompt, '#ffffff') for key,prompt,_ in colorless_cmds]
+    random.shuffle(colorless_cmds)
+
+    # Putting everything together
+    all_cmds = practice_cmds+shuffled_cmds+colorless_cmds
+
+    for correct, prompt, color in all_cmds:
+
+        # Write prompts
+        prompt_txt = visual.TextStim(w, text='Please press the following key', pos=(0,.75), wrapWidth=2)
+        cmd_txt = visual.TextStim(w, text=prompt, pos=(0,.5), color=color, bold=True)
+
+        # Draw stimuli
+        prompt_txt.draw()
+        cmd_txt.draw()
+        draw_hand()
+        w.flip()
 
-    # Wait for correct key to continue
-    keys = event.waitKeys(keyList=[correct, 'equal'])
-    if keys[0] == 'q': # manual exit
-        core.quit()
-
-# draw_hand()
-# w.flip()
-
-### EXPLAIN MAZES ###
-maze_img = 'assets/maze_diagram.png'
-maze_w_pix, maze_h_pix = PIL.Image.open(maze_img).size
-maze_w = maze_w_pix/width
-maze_h = maze_h_pix/height
-
-# Draw diagam and explanatory text
-maze_prompts = [("Let's apply what you've learned! In the next slides, you'll see mazes like this one.",
-                 "Press ACTION to continue"),
-                 ("Move your cursor towards the gold square, then press ACTION to pick up the treasure",
-                 "Press ACTION to start")]
-
-for prompts in maze_prompts:
-    top_stim = visual.TextStim(w, text = prompts[0], pos=(0,maze_h/2+.1), wrapWidth=2)
-    bottom_stim = visual.TextStim(w, text = prompts[1], pos=(0,-1*(maze_h/2+.1)), wrapWidth=2)
-    maze_diagram_stim = visual.ImageStim(w, image=maze_img, pos = (0,0), interpolate='linear', size=(maze_w, maze_h))
-
-    top_stim.draw()
-    bottom_stim.draw()
-    maze_diagram_stim.draw()
-    w.flip()
-    event.waitKeys(keyList=keylist[:1])
+        # Wait for correct key to continue
+        keys = event.waitKeys(keyList=[correct, 'equal'])
+        if keys[0] == 'q': # manual exit
+            core.quit()
+
+    # draw_hand()
+    # w.flip()
+
+    ### EXPLAIN MAZES ###
+    maze_img = 'assets/maze_diagram.png'
+    maze_w_pix, maze_h_pix = PIL.Image.open(maze_img).size
+    maze_w = maze_w_pix/width
+    maze_h = maze_h_pix/height
+
+    # Draw diagam and explanatory text
+    maze_prompts = [("Let's apply what you've learned! In the next slides, you'll see mazes like this one.",
+                     "Press ACTION to continue"),
+                     ("Move your cursor towards the gold square, then press ACTION to pick up the treasure",
+                     "Press ACTION to start")]
+
+    for prompts in maze_prompts:
+        top_stim = visual.TextStim(w, text = prompts[0], pos=(0,maze_h/2+.1), wrapWidth=2)
+        bottom_stim = visual.TextStim(w, text = prompts[1], pos=(0,-1*(maze_h/2+.1)), wrapWidth=2)
+        maze_diagram_stim = visual.ImageStim(w, image=maze_img, pos = (0,0), interpolate='linear', size=(maze_w, maze_h))
+
+        top_stim.draw()
+        bottom_stim.draw()
+        maze_diagram_stim.draw()
+        w.flip()
+        event.waitKeys(keyList=keylist[:1])
 
-### MAIN EXPERIMENT LOOP ###
-for maze in mazes:
-    # initialize maze
-    r,c = maze['start']
-    win = False
+    ### MAIN EXPERIMENT LOOP ###
+    clock = core.MonotonicClock()
+    for maze_idx, maze in enumerate(mazes):
+        # initialize maze
+        r,c = maze['start']
+        win = False
 
-    while not win:
-        # Draw map
+        # Draw first map
         draw_cursor(r,c)
         draw_maze(maze)
         w.flip()
-
-        # Get user input
-        keys = event.waitKeys(keyList=keylist)
-        if keys[0] == 'q': # manually exit exp
+        maze_log.start_maze(maze_idx, clock.getTime())
+
+        while not win:
+            # Get user input (with the time of the keypress)
+            keys = event.waitKeys(keyList=keylist, timeStamped=clock)
+            key, key_t = keys[0]
+            if key == 'q': # manually exit exp
+                break
+            else:
+                r,c,win = update_location(maze,r,c,key)
+                maze_log.move(key, key_t, r, c)
+
+            # Draw map
+            draw_cursor(r,c)
+            draw_maze(maze)
+            w.flip()
+
+        maze_log.end_maze(clock.getTime(), solved=win)
+        if key == 'q': # manually exit exp, continued
             break
-        else:
-            r,c,win = update_location(maze,r,c,keys[0])
-    
-    if keys[0] == 'q': # manually exit exp, continued
-        break
-       
-### END EXPERIMENT ###
-# End message
-end_text = 'Great job!\nYour next task will begin shortly.'
-end_stim = visual.TextStim(w, text = end_text, pos=(0,0), wrapWidth=2)
-end_stim.draw()
-w.flip()
-core.wait(5)
-
-w.close()
\ No newline at end of file
+
+    # Check that the participant has learned the button box before the scan
+    maze_log.trial_log.finalize()
+    flags = maze_log.flags()
+    print('\n=== MAZES: %s ===' % ('CHECK IN WITH PARTICIPANT' if flags else 'BUTTON BOX OK'))
+    for flag in flags:
+        print(flag)
+    print('Saved keypresses to: %s' % out_file)
+
+    ### END EXPERIMENT ###
+    # End message
+    end_text = 'Great job!\nYour next task will begin shortly.'
+    end_stim = visual.TextStim(w, text = end_text, pos=(0,0), wrapWidth=2)
+    end_stim.draw()
+    w.flip()
+    core.wait(5)
+
+    w.close()
+
+if __name__ == '__main__':
+    main()
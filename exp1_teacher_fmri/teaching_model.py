@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, itertools
+import numpy as np
+
+import teaching_problems
+
+# Grid conventions (same as teaching_game_logic.update_location):
+# square (row, col) of the 6x6 board is index row*6 + col, and hypotheses
+# are in teaching_problems.hypothesis_keys order, i.e. 0 = 'A' = true
+n_rows, n_cols = 6, 6
+n_squares = n_rows*n_cols
+
+# log(n!) for n = 0..36
+log_fact = np.concatenate([[0], np.cumsum(np.log(np.arange(1, n_squares+1)))])
+
+### HYPOTHESES AND EXAMPLES ###
+# Hypotheses of every problem, as an (n_problems, 4, 36) boolean array
+def hypotheses(store):
+    grids = np.asarray(store.grids)
+    return grids.reshape(len(grids), len(teaching_problems.hypothesis_keys), n_squares).astype(bool)
+
+# Helper function: Board states (..., 6, 6) -> example sets (..., 36)
+def state_masks(states):
+    states = np.asarray(states)
+    return states.reshape(states.shape[:-2] + (n_squares,)).astype(bool)
+
+# Helper function: List of examples [(row, col), ...] -> example set (36,)
+def examples_mask(examples):
+    mask = np.zeros(n_squares, dtype=bool)
+    for r, c in examples:
+        mask[r*n_cols + c] = True
+    return mask
+
+# Every set of up to max_examples squares, as an (n_sets, 36) boolean array
+def enumerate_example_sets(max_examples):
+    combos = [c for k in range(max_examples+1)
+              for c in itertools.combinations(range(n_squares), k)]
+    masks = np.zeros((len(combos), n_squares), dtype=bool)
+    for i, combo in enumerate(combos):
+        masks[i, list(combo)] = True
+    return masks
+
+### LEARNER MODEL ###
+# log P(examples | h) for every hypothesis and example set.
+# hyps: (..., 4, 36) and masks: (..., n_sets, 36) -> (..., n_sets, 4)
+#
+# strong sampling: examples are drawn from h without replacement (size principle)
+# weak sampling: examples are any squares consistent with h
+def log_likelihood(hyps, masks, sampling='strong'):
+    hyps = np.asarray(hyps, dtype=bool)
+    masks = np.asarray(masks, dtype=bool)
+
+    # Examples that fall outside each hypothesis
+    outside = np.matmul(masks.astype(np.float32), (~hyps).astype(np.float32).swapaxes(-1, -2))
+    consistent = outside == 0
+
+    if sampling == 'strong':
+        size = hyps.sum(-1)[..., None, :] # (..., 1, 4)
+        k = masks.sum(-1)[..., :, None] # (..., n_sets, 1)
+        log_lik = -(log_fact[size] - log_fact[np.maximum(size - k, 0)])
+    elif sampling == 'weak':
+        log_lik = np.zeros(consistent.shape)
+    else:
+        raise ValueError('Unknown sampling assumption: %s' % sampling)
+
+    return np.where(consistent, log_lik, -np.inf)
+
+# Learner's posterior over hypotheses A-D, (..., n_sets, 4); uniform prior by default
+def posterior(hyps, masks, sampling='strong', prior=None):
+    log_post = log_likelihood(hyps, masks, sampling)
+    if prior is not None:
+        log_post = log_post + np.log(prior)
+
+    # Normalize (sets that no hypothesis can explain get NaN)
+    log_max = np.max(log_post, axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore'):
+        post = np.exp(log_post - log_max)
+        post = post / post.sum(-1, keepdims=True)
+    return post
+
+# Posteriors for every problem and every set of up to max_examples squares:
+# returns masks (n_sets, 36) and posteriors (n_problems, n_sets, 4)
+def all_posteriors(store, max_examples=3, sampling='strong'):
+    masks = enumerate_example_sets(max_examples)
+    return masks, posterior(hypotheses(store), masks, sampling)
+
+### SCORING BEHAVIORAL DATA ###
+# Learner's posterior after each choose trial in a behavioral file, (n_choose, 4)
+def score_choices(data, store, sampling='strong'):
+    choices = [trial for trial in data if trial['type'] == 'choose']
+    if not choices:
+        return np.zeros((0, len(teaching_problems.hypothesis_keys)))
+
+    hyps = hypotheses(store)[[trial['problem'] for trial in choices]]
+    masks = state_masks([trial['state'] for trial in choices])
+    return posterior(hyps, masks[:, None, :], sampling)[:, 0, :]
+
+# Learner's posteriors for every behavioral file, (n_choose, 4) each. They are
+# kept in the derived cache (see teaching_cache), keyed by the file, the
+# problems file and this code (with the modules it imports), so only new or
+# changed files are scored.
+def score_files(in_files, problems_file='inputs/problems.json', sampling='strong', use_cache=True):
+    import teaching_bids as bids
+    import teaching_cache
+    store = teaching_problems.load(problems_file)
+    derived = teaching_cache.DerivedCache()
+
+    posts = []
+    for in_file in in_files:
+        key = derived.key('posteriors', [in_file], deps=[problems_file], modules=['teaching_model'],
+                          params={'sampling': sampling})
+        post = derived.get('posteriors', key) if use_cache else None
+        if post is None:
+            post = score_choices(list(bids.iter_records(in_file)), store, sampling)
+            derived.put('posteriors', key, post)
+        posts.append(post)
+    derived.save()
+    return posts
+
+if __name__ == '__main__':
+    # Usage: python teaching_model.py data/sub-01_task-teaching_run-01_behavioral_<tstamp>.json
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='Behavioral files to score')
+    parser.add_argument('--sampling', default='strong', choices=['strong', 'weak'])
+    parser.add_argument('--problems', default='inputs/problems.json')
+    parser.add_argument('-force', action='store_true', help='Use this flag to score every file again (ignoring the cache)')
+    args = parser.parse_args()
+
+    for in_file, post in zip(args.files, score_files(args.files, args.problems, args.sampling, not args.force)):
+        print('%s: P(A) after each example = %s' % (in_file, np.round(post[:, 0], 3)))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, os
+from math import comb
+import numpy as np
+
+import teaching_problems
+import teaching_timing
+import teaching_model as model
+
+### INDEXING BOARD STATES ###
+# Board states (sets of examples shown so far) are ranked with the
+# combinatorial number system: states with k examples come after all states
+# with fewer examples, and within size k, squares c_1 < ... < c_k map to
+# sum_i C(c_i, i). Ranking a state only takes k steps.
+binom = np.array([[comb(n, k) for k in range(model.n_squares+1)]
+                  for n in range(model.n_squares+1)], dtype=np.int64)
+
+# Helper function: # of states with up to max_examples examples
+def n_states(max_examples):
+    return int(binom[model.n_squares, :max_examples+1].sum())
+
+# Helper function: Rank of a set of squares (sorted square indices)
+def state_rank(squares):
+    k = len(squares)
+    rank = binom[model.n_squares, :k].sum()
+    for i, sq in enumerate(squares):
+        rank += binom[sq, i+1]
+    return int(rank)
+
+# Helper function: Rank of a board state (6x6 grid)
+def board_rank(state):
+    return state_rank(np.flatnonzero(np.asarray(state).ravel()))
+
+# Every state with up to max_examples examples, in rank order: (n_states, 36)
+def enumerate_states(max_examples):
+    masks = model.enumerate_example_sets(max_examples)
+    ranks = [state_rank(np.flatnonzero(m)) for m in masks]
+    states = np.zeros_like(masks)
+    states[ranks] = masks
+    return states
+
+### BUILDING THE TABLE ###
+# Most examples shown before any choose trial, according to the timing files
+def max_prior_examples(timing_dir='inputs/timing'):
+    trials = teaching_timing.load(timing_dir).trials
+    choose = trials['type'] == teaching_timing.type_idx['choose']
+    return int(trials['ex_idx'][choose].max()) if choose.any() else 0
+
+# Gain in the learner's posterior on the true hypothesis for every problem,
+# reachable state and candidate square: (n_problems, n_states, 36).
+# Entries are NaN for unreachable states (not all examples in 'A') and for
+# squares that are not valid examples (not in 'A' or already shown).
+def build_table(store, max_examples, sampling='strong'):
+    hyps = model.hypotheses(store)
+    n_problems = len(hyps)
+    states = enumerate_states(max_examples)
+
+    # Every state + every candidate square
+    candidates = np.eye(model.n_squares, dtype=bool)
+    next_states = (states[:, None, :] | candidates[None, :, :]).reshape(-1, model.n_squares)
+
+    post_now = model.posterior(hyps, states, sampling)[..., 0]
+    post_next = model.posterior(hyps, next_states, sampling)[..., 0]
+    post_next = post_next.reshape(n_problems, len(states), model.n_squares)
+    gain = (post_next - post_now[:, :, None]).astype(np.float32)
+
+    # Mask out unreachable states and invalid examples
+    true_h = hyps[:, 0, :] # (n_problems, 36)
+    reachable = ~np.any(states[None, :, :] & ~true_h[:, None, :], axis=-1)
+    valid = reachable[:, :, None] & true_h[:, None, :] & ~states[None, :, :]
+    gain[~valid] = np.nan
+
+    # Best next example (-1 if there is none)
+    has_valid = valid.any(-1)
+    best = np.where(has_valid, np.argmax(np.where(valid, gain, -np.inf), axis=-1), -1).astype(np.int8)
+    return gain, best
+
+# Helper function: Where to cache the table (and the key it was built with)
+def table_files(problems_file, sampling):
+    name = os.path.splitext(os.path.basename(problems_file))[0]
+    base = os.path.join(teaching_problems.cache_dir, 'optimal_%s_%s' % (name, sampling))
+    return base + '_gain.npy', base + '_best.npy', base + '_key.txt'
+
+# Helper function: Key of a table, as for derived products (see
+# teaching_cache): the contents of the problems file, the code that builds
+# the table and the sampling assumption
+def table_key(problems_file, sampling):
+    import teaching_cache
+    return teaching_cache.DerivedCache().key('optimal', [problems_file], modules=['teaching_optimal'],
+                                             params={'sampling': sampling})
+
+def save_table(problems_file='inputs/problems.json', sampling='strong', max_examples=None):
+    if max_examples is None:
+        max_examples = max_prior_examples()
+    store = teaching_problems.load(problems_file)
+    gain, best = build_table(store, max_examples, sampling)
+
+    os.makedirs(teaching_problems.cache_dir, exist_ok=True)
+    gain_file, best_file, key_file = table_files(problems_file, sampling)
+    for out_file, arr in ((gain_file, gain), (best_file, best)):
+        tmp_file = out_file + '.%i.tmp' % os.getpid()
+        with open(tmp_file, 'wb') as f:
+            np.save(f, arr)
+        os.replace(tmp_file, out_file)
+
+    # Key last, so a table that was only partly saved is built again
+    tmp_file = key_file + '.%i.tmp' % os.getpid()
+    with open(tmp_file, 'w') as f:
+        f.write(table_key(problems_file, sampling))
+    os.replace(tmp_file, key_file)
+    return gain_file, best_file
+
+# Helper function: Is the cached table missing, or built from other problems or code?
+def table_stale(problems_file, sampling):
+    gain_file, best_file, key_file = table_files(problems_file, sampling)
+    if not os.path.exists(gain_file) or not os.path.exists(best_file):
+        return True
+    try:
+        with open(key_file) as f:
+            return f.read().strip() != table_key(problems_file, sampling)
+    except OSError:
+        return True
+
+### LOOKUPS ###
+# Memory-mapped table; building it first if it is missing or stale
+class OptimalTeacher:
+    def __init__(self, problems_file='inputs/problems.json', sampling='strong'):
+        gain_file, best_file, _ = table_files(problems_file, sampling)
+        if table_stale(problems_file, sampling):
+            print('Building optimal teacher table: %s' % gain_file)
+            save_table(problems_file, sampling)
+
+        self.gain = np.load(gain_file, mmap_mode='r')
+        self.best = np.load(best_file, mmap_mode='r')
+        self.sampling = sampling
+        self.max_examples = int(np.searchsorted(np.cumsum(binom[model.n_squares]), self.gain.shape[1]))
+
+    def rank(self, state):
+        squares = np.flatnonzero(np.asarray(state).ravel())
+        if len(squares) > self.max_examples:
+            raise ValueError('Table only covers states with up to %i examples' % self.max_examples)
+        return state_rank(squares)
+
+    # Posterior gain of every candidate square (36,), given the examples shown so far
+    def gains(self, problem, state):
+        return self.gain[problem, self.rank(state)]
+
+    # Best next example as (row, col), or None if no example is left
+    def best_example(self, problem, state):
+        sq = int(self.best[problem, self.rank(state)])
+        if sq < 0:
+            return None
+        return divmod(sq, model.n_cols)
+
+if __name__ == '__main__':
+    # Usage: python teaching_optimal.py --sampling strong
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--problems', default='inputs/problems.json')
+    parser.add_argument('--sampling', default='strong', choices=['strong', 'weak'])
+    parser.add_argument('--max-examples', type=int, default=None,
+                        help='Most examples already shown (default: from the timing files)')
+    args = parser.parse_args()
+
+    gain_file, best_file = save_table(args.problems, args.sampling, args.max_examples)
+    print('Saved optimal teacher table to: %s, %s' % (gain_file, best_file))
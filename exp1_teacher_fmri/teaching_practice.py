@@ -6,13 +6,17 @@ Created on Mon Jun 14 08:46:01 2021
 @author: aliciachen, nataliavelez
 """
 
-import argparse, sys, time, json, random, copy
+import argparse, sys, time
 import numpy as np
-from psychopy import gui, core, visual, event, data
-from signal import signal,SIGINT
+from signal import signal,SIGINT,SIGTERM
 
 # Experiment-specific modules
 import teaching_game_logic as game
+import teaching_window as window
+import teaching_frames as frames
+import teaching_schedule as schedule
+import teaching_datalog as datalog
+import teaching_timing
 
 ### LOAD PROBLEMS AND EXPERIMENT ORDER ###
 # Parse subject ID and run from command line arguments
@@ -20,10 +24,21 @@ parser=argparse.ArgumentParser()
 parser.add_argument('--sub', help='Subject # (int)')
 parser.add_argument('-scan', action='store_true',
                    help='Use this flag when running the practice task in the scanner')
+parser.add_argument('-frames', action='store_true',
+                   help='Use this flag to record frame timings for every trial')
+parser.add_argument('-headless', action='store_true',
+                   help='Use this flag to run without a display (nothing is shown, and time runs as fast as possible)')
+parser.add_argument('--input', default='event', choices=['event', 'keyboard', 'evdev'],
+                   help='Where to read keypresses from: psychopy events (default), psychopy keyboard (psychtoolbox) or evdev, timestamped on a separate thread')
+parser.add_argument('--input-device', help='Input device for --input=evdev (e.g. /dev/input/by-id/...)')
+parser.add_argument('--simulate', choices=['random', 'optimal'],
+                   help='Simulate a participant (implies -headless)')
 
 print('\n=== SETTING UP RUN ===')
 print('Passing arguments...')
 args=parser.parse_args()
+if args.simulate:
+    args.headless = True
 
 if args.sub is not None:
     sub=int(args.sub)
@@ -38,13 +53,9 @@ print('SUBJECT: %s | RUN: PRACTICE' % str(sub))
 # Load timing information
 in_file = 'inputs/timing/sub-debug_task-teaching_run-01_timing.json'
 print('\nLoading timing info from: %s' % in_file)
-with open(in_file, 'r') as f:
-    timing = json.load(f)
-
-# Sanity check: Run length matches # of images in protocol
-last_trial = timing[-1]
-run_length = last_trial['ons'] + last_trial['dur']
-n_images = np.ceil(run_length/2)
+timings = teaching_timing.load() # compiled and checked in advance (see teaching_timing)
+timing = timings.load_run('debug', 1)
+n_images = timings.run_info('debug', 1)['n_images']
 print('# images: %i' % n_images)
 print('Run length: %02d:%02d' % (np.floor(n_images*2/60), (n_images*2) % 60))
 
@@ -54,18 +65,43 @@ out_file = 'data/sub-%02d_task-teaching_run-practice_behavioral_%i.json' % (sub,
 data = []
 print('\nSaving data to: %s' % out_file)
 
+# Stream trials to disk from a background thread (see teaching_datalog.TrialLog)
+trial_log = datalog.TrialLog(out_file)
+
 # Helper function: Save data
 def save_data():
-    with open(out_file, 'w') as out:
-        json.dump(data, out)
+    trial_log.finalize()
+
 
+# Helper function: Save frame timings (if recorded)
+def save_frames():
+    if game.frame_timer is not None:
+        game.frame_timer.save(frames.frames_file(out_file))
+
+# Helper function: Save onset timings (once trials have started)
+def save_onsets():
+    if game.scheduler is not None:
+        game.scheduler.save(schedule.onsets_file(out_file))
+
+# Helper function: Stop reading keypresses (if read on a separate thread)
+def close_input():
+    if game.key_source is not None and hasattr(game.key_source, 'close'):
+        game.key_source.close()
+        game.key_source = None
 
 # Set up emergency exit
 def emergency_exit(signum, frame):
     print('Task interrupted! Saving data...')
-    json.dump(data, open(out_file, 'w'))
+    save_data()
+    save_frames()
+    save_onsets()
+    close_input()
+    if args.headless:
+        sys.exit(1)
+    from psychopy import core
     core.quit()
 signal(SIGINT, emergency_exit)
+signal(SIGTERM, emergency_exit)
 
 ### HARDWARE SETUP ###
 # Set up monitor
@@ -87,12 +123,30 @@ else:
     width, height = (1024, 768)
     is_fullscr=False
 
-game.practice_mode()
+game.practice_mode(sub)
 aspect = width/height
-w = visual.Window(fullscr=is_fullscr, size=(width, height), screen = 0, 
+w = window.open_window(headless=args.headless, fullscr=is_fullscr, size=(width, height), screen = 0, 
     color='black', useRetina=True)
+visual = window.visual_for(w)
+
+# Optional: Read keypresses with timestamps from the device, on a separate thread
+if args.input != 'event' and not args.simulate:
+    import teaching_input
+    print('Reading keypresses from: %s' % args.input)
+    game.key_source = teaching_input.make_input(args.input, args.input_device)
+
+# Optional: Simulated participant
+if args.simulate:
+    import teaching_simulate
+    print('Simulating a participant: %s' % args.simulate)
+    game.key_source = teaching_simulate.make_key_source(args.simulate)
 w.mouseVisible = False # uncomment for production
 
+# Optional: Time every frame
+if args.frames:
+    print('Recording frame timings to: %s' % frames.frames_file(out_file))
+    game.frame_timer = frames.FrameTimer(w)
+
 # # ### WAIT FOR SCANNER TRIGGER ###
 # countdown = 5
 # for sec in range(countdown):
@@ -105,66 +159,22 @@ w.mouseVisible = False # uncomment for production
 start_txt = visual.TextStim(w, text=instruct_prompt+start_prompt, pos=(0,0), wrapWidth=1.75)
 start_txt.draw()
 w.flip()
-event.waitKeys(keyList=start_key)
-
-### INITIALIZE PROBLEMS ###
-# starting points
-new_state = [
-    [0,0,0,0,0,0],
-    [0,0,0,0,0,0],
-    [0,0,0,0,0,0],
-    [0,0,0,0,0,0],
-    [0,0,0,0,0,0],
-    [0,0,0,0,0,0]
-]
-corners = [(0,0),(0,5),(5,0),(5,5)] # where to start cursor
-random.shuffle(corners)
-
-# init exp loop
-problem_counter = 0
-state = copy.deepcopy(new_state)
-cursor = corners.pop()
+if not args.headless:
+    from psychopy import event
+    event.waitKeys(keyList=start_key)
 
 ### MAIN EXPERIMENT LOOP ###
 print('Starting clock')
-t = core.MonotonicClock() # start clock
-
-for trial in timing:
-    # is this a new problem?
-    if 'problem_idx' in trial:
-        if  trial['problem_idx'] > problem_counter:
-            
-            # if so, refresh the game state
-            print('\n==== NEW PROBLEM: %i ====' % trial['problem'])
-            state = copy.deepcopy(new_state)
-            cursor = corners.pop()
-
-            # and update counter
-            problem_counter = trial['problem_idx']
-
-    # hacky workaround to show off the last-selected example
-    if trial['type'] == 'show':
-        trial_data = game.present(w,t,trial,state,highlight)
-    else:
-        trial_data = game.present(w,t,trial,state,cursor)
-    data.append(trial_data)
-    save_data() # new: save data after every trial
-
-    # update state and cursor after choose trials
-    if trial['type'] == 'choose':
-        cursor = trial_data['cursor']
-        state = trial_data['state']
-
-        last_example = trial_data['example']
-        if last_example is not None:
-            highlight = cursor
-        else:
-            highlight = None
+t = window.run_clock(w) # start clock
+game.run(w,t,timing,data,trial_log)
+close_input()
 
 # Save data at the end
 print('All done! Saving data')
 print(data)
 save_data()
+save_frames()
+save_onsets()
 
 if args.scan:
     end_text = 'Great job!\nPlease stay still until the end of the scan.\
@@ -176,6 +186,8 @@ else:
 end_stim = visual.TextStim(w, text = end_text, pos=(0,0), wrapWidth=2)
 end_stim.draw()
 w.flip()
-event.waitKeys(keyList=['equal'])
+if not args.headless:
+    from psychopy import event
+    event.waitKeys(keyList=['equal'])
 
 w.close()
\ No newline at end of file
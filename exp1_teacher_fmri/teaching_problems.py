@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json, os
+import numpy as np
+
+# Hypotheses in each problem; 'A' is always the true hypothesis
+hypothesis_keys = ('A', 'B', 'C', 'D')
+key_idx = {key: i for i, key in enumerate(hypothesis_keys)}
+
+# Compiled problems are cached here
+cache_dir = 'inputs/cache'
+
+# Practice problems, and per-subject practice sets (see teaching_generate)
+practice_file = 'inputs/practice_problems.json'
+practice_dir = 'inputs/practice'
+
+### COMPILING PROBLEMS ###
+# Turn a problems file into one (n_problems, 4, 6, 6) uint8 array
+def compile_problems(in_file):
+    with open(in_file) as file:
+        problems = json.load(file)
+    return np.array([[p[key] for key in hypothesis_keys] for p in problems], dtype=np.uint8)
+
+# Helper function: Where to cache a compiled problems file
+def cache_file(in_file):
+    name = os.path.splitext(os.path.basename(in_file))[0]
+    return os.path.join(cache_dir, name + '.npy')
+
+# Load compiled problems (memory-mapped), recompiling them if the cache is stale
+def load_grids(in_file):
+    npy_file = cache_file(in_file)
+    if os.path.exists(npy_file) and os.path.getmtime(npy_file) >= os.path.getmtime(in_file):
+        return np.load(npy_file, mmap_mode='r')
+
+    grids = compile_problems(in_file)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = npy_file + '.%i.tmp' % os.getpid()
+        with open(tmp_file, 'wb') as f:
+            np.save(f, grids)
+        os.replace(tmp_file, npy_file)
+    except OSError:
+        print('Could not cache problems to: %s' % npy_file)
+        return grids
+    return np.load(npy_file, mmap_mode='r')
+
+### PROBLEM STORE ###
+class ProblemStore:
+    def __init__(self, grids, colordict=None):
+        self.grids = grids # (n_problems, 4, 6, 6)
+        self.hypothesis_colors = None
+        self.canvas_palette = None
+
+        # Precompute tile colors for every hypothesis
+        if colordict is not None:
+            palette = np.array(colordict['hypothesis'], dtype=np.uint8)
+            self.hypothesis_colors = palette[self.grids].reshape(len(self.grids), 4, 36, 3)
+            self.canvas_palette = np.array(colordict['canvas'], dtype=np.uint8)
+
+        self.problems = [Problem(self, idx) for idx in range(len(self.grids))]
+
+    def __len__(self):
+        return len(self.problems)
+
+    def __getitem__(self, idx):
+        return self.problems[idx]
+
+    def __iter__(self):
+        return iter(self.problems)
+
+# Lightweight view of a single problem: prob['A'] etc. index into the store
+class Problem:
+    def __init__(self, store, idx):
+        self.store = store
+        self.idx = idx
+
+    def __getitem__(self, key):
+        return self.store.grids[self.idx, key_idx[key]]
+
+    def keys(self):
+        return hypothesis_keys
+
+    # Tile colors of one hypothesis, as a (36, 3) array
+    def hypothesis_colors(self, key):
+        return self.store.hypothesis_colors[self.idx, key_idx[key]]
+
+    # Canvas tile colors for a given board state
+    def canvas_colors(self, state, teacher_view):
+        sqs = self.store.grids[self.idx, 0] + state
+
+        # Hide the rest of the true hypothesis in student's view
+        if not teacher_view:
+            sqs = sqs * (sqs > 1)
+        return self.store.canvas_palette[sqs.ravel()]
+
+# Practice problems for a subject: their own set if one was generated
+def practice_problems(sub=None):
+    if sub is not None:
+        sub_file = os.path.join(practice_dir, 'sub-%02d_practice_problems.json' % int(sub))
+        if os.path.exists(sub_file):
+            return sub_file
+    return practice_file
+
+# main method: load a problems file into a problem store
+def load(in_file='inputs/problems.json', colordict=None):
+    return ProblemStore(load_grids(in_file), colordict)
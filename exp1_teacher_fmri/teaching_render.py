@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, contextlib, glob, io, json, os, time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Experiment-specific modules
+import teaching_game_logic as game
+import teaching_window as window
+import teaching_simulate as sim
+import teaching_timing
+
+# Frames are rendered at this size (width, height); same aspect as the task window
+render_size = (200, 150)
+
+# Luminance of RGB (0-255) pixels, Rec. 709 weights on gamma-encoded values (0-1)
+luma_weights = np.array([.2126, .7152, .0722])/255
+
+### SAMPLING FRAMES ###
+# Wraps w.flip() on a rendering NullWindow, and calls on_sample(i, frame)
+# with the frame on screen at each of sample_times (on the run clock t).
+# Also keeps the luminance of every frame and how long it was on screen.
+class FrameSampler:
+    def __init__(self, w, t, sample_times, on_sample):
+        self.w = w
+        self.t = t
+        self.sample_times = np.asarray(sample_times)
+        self.on_sample = on_sample
+        self.next = 0
+
+        # What is on screen now, and since when
+        self.frame = w.front.copy()
+        self.since = 0.
+        self.segments = [] # (start, end, luminance)
+
+        self._flip = w.flip
+        w.flip = self.flip
+
+    def flip(self, *args, **kwargs):
+        out = self._flip(*args, **kwargs)
+        self.advance(self.t.getTime())
+        self.frame = self.w.front.copy()
+        return out
+
+    # Hand out samples up to time now, and close the current frame's segment
+    def advance(self, now):
+        while self.next < len(self.sample_times) and self.sample_times[self.next] < now:
+            self.on_sample(self.next, self.frame)
+            self.next += 1
+        if now > self.since:
+            self.segments.append((self.since, now, luminance(self.frame)))
+        self.since = now
+
+    # Fill in samples after the last flip, up to the end of the run
+    def finish(self, end):
+        self.advance(max(end, self.sample_times[-1] + 1e-9) if len(self.sample_times) else end)
+        self.w.flip = self._flip
+
+    # Mean luminance over each bin [edges[i], edges[i+1]), weighted by time on screen
+    def mean_luminance(self, edges):
+        starts, ends, lums = np.array(self.segments).T
+        times = np.concatenate([[starts[0]], ends])
+        integral = np.concatenate([[0], np.cumsum((ends - starts)*lums)])
+        at_edges = np.interp(edges, times, integral)
+        return np.diff(at_edges)/np.diff(edges)
+
+# Helper function: Mean luminance of a frame (0-1)
+def luminance(frame):
+    return float((frame.reshape(-1, 3) @ luma_weights).mean())
+
+### RENDERING RUNS ###
+# Helper function: Where to save a run's frames
+def render_files(in_file, out_dir):
+    name = os.path.splitext(os.path.basename(in_file))[0].replace('_behavioral_', '_frames-%s_')
+    return (os.path.join(out_dir, name % 'tr' + '.npy'),
+            os.path.join(out_dir, name % 'luminance' + '.npy'),
+            os.path.join(out_dir, name % 'video' + '.mp4'))
+
+# Re-run a recorded run on a rendering headless window, with the recorded
+# keypresses (see teaching_simulate.ReplayKeys). Saves the frame on screen
+# in the middle of every image as a (n_images, height, width, 3) uint8 array,
+# the mean luminance during every image, and (optionally) a video.
+def render_run(in_file, out_dir='data/render', size=render_size, fps=None, verbose=False):
+    with open(in_file) as f:
+        records = json.load(f)
+    practice = '_run-practice_' in in_file
+    if practice: # worker processes are reused, so switch back afterwards
+        main_problems = game.problems_file
+        game.practice_mode(sim.record_sub(in_file))
+    timing = sim.record_timing(in_file, records)
+
+    tr = teaching_timing.tr
+    end = timing[-1]['ons'] + timing[-1]['dur']
+    n_images = int(np.ceil(np.round(end/tr, 6)))
+
+    os.makedirs(out_dir, exist_ok=True)
+    frames_file, luminance_file, video_file = render_files(in_file, out_dir)
+    tmp_file = frames_file + '.%i.tmp' % os.getpid()
+    frames = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.uint8,
+                                       shape=(n_images, size[1], size[0], 3))
+
+    w = window.open_window(headless=True, size=(800, 600), color='black', render=True, render_size=size)
+    t = window.run_clock(w)
+    samplers = [FrameSampler(w, t, (np.arange(n_images) + .5)*tr,
+                             lambda i, frame: frames.__setitem__(i, frame))]
+
+    # Optional: video at fps frames per second
+    writer = None
+    if fps is not None:
+        try:
+            import imageio
+        except ImportError:
+            raise ImportError('Saving videos needs imageio (pip install imageio imageio-ffmpeg)')
+        writer = imageio.get_writer(video_file, fps=fps)
+        samplers.append(FrameSampler(w, t, np.arange(0, n_images*tr, 1/fps),
+                                     lambda i, frame: writer.append_data(frame)))
+
+    game.key_source = sim.ReplayKeys(records)
+    try:
+        with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+            game.run(w, t, timing, [], corners=sim.replay_corners(records))
+    finally:
+        game.key_source = None
+        if practice:
+            game.load(main_problems)
+    for sampler in samplers:
+        sampler.finish(n_images*tr)
+    if writer is not None:
+        writer.close()
+
+    frames.flush()
+    del frames
+    os.replace(tmp_file, frames_file)
+    lum = samplers[0].mean_luminance(np.arange(n_images + 1)*tr).astype(np.float32)
+    np.save(luminance_file, lum)
+    return frames_file, luminance_file
+
+# Helper function: Render one run (runs in a worker process)
+def render_job(args):
+    in_file, out_dir, size, fps = args
+    t0 = time.time()
+    render_run(in_file, out_dir, size, fps)
+    return in_file, time.time() - t0
+
+# main method: render many runs in parallel
+def render_all(in_files, out_dir='data/render', size=render_size, fps=None, workers=None):
+    jobs = [(in_file, out_dir, size, fps) for in_file in in_files]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(render_job, jobs))
+
+# Load a rendered run: frames (memory-mapped) and luminance per image
+def load_frames(in_file, out_dir='data/render'):
+    frames_file, luminance_file, _ = render_files(in_file, out_dir)
+    return np.load(frames_file, mmap_mode='r'), np.load(luminance_file)
+
+if __name__ == '__main__':
+    # Usage: python teaching_render.py data/sub-01_task-teaching_run-01_behavioral_<tstamp>.json
+    #        python teaching_render.py data/*_behavioral_*.json --fps 10   (also saves videos)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='Behavioral files to render')
+    parser.add_argument('--out', default='data/render')
+    parser.add_argument('--width', type=int, default=render_size[0])
+    parser.add_argument('--height', type=int, default=render_size[1])
+    parser.add_argument('--fps', type=float, default=None, help='Also save a video at this frame rate')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    in_files = sorted(f for pattern in args.files for f in glob.glob(pattern) if f.endswith('.json'))
+    t0 = time.time()
+    for in_file, secs in render_all(in_files, args.out, (args.width, args.height), args.fps, args.workers):
+        print('Rendered %s (%.1f s)' % (in_file, secs))
+    print('Rendered %i runs in %.1f s' % (len(in_files), time.time() - t0))
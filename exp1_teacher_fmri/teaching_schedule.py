@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json, time
+import numpy as np
+
+import teaching_window as window
+
+# How often to check for keypresses (in seconds) between frames
+poll_interval = .001
+
+# Longest stretch to sleep at once while nothing changes on screen
+max_idle = .05
+
+### SCHEDULER ###
+# Owns the timeline of a run: every trial ends (and the next one starts) on
+# the refresh nearest its scheduled onset, and frames are only redrawn when
+# something visible changes (a keypress, a countdown digit...), instead of
+# redrawing identical frames for the whole trial
+class Scheduler:
+    def __init__(self, w, t, timing=(), frame_timer=None):
+        self.w = w
+        self.t = t
+        self.frame = w.monitorFramePeriod
+        self.frame_timer = frame_timer
+        self.virtual = isinstance(w, window.NullWindow)
+
+        # Deadline of every trial in the timing file, worked out in advance
+        self.deadlines = {id(trial): self.deadline(trial) for trial in timing}
+
+        # Scheduled vs. actual onsets (first flip) of each trial
+        self.onsets = []
+        self.true_onsets = []
+        self.n_flips = 0
+
+    # Helper function: Trials end half a refresh early, so that the next
+    # trial's first flip lands on the refresh nearest its onset
+    def deadline(self, trial):
+        return trial['ons'] + trial['dur'] - self.frame/2
+
+    # Wait without drawing; real windows keep handling their events (so the
+    # OS does not flag the window as unresponsive during long trials)
+    def idle(self, secs):
+        if self.virtual:
+            window.wait(self.w, max(secs, 1e-6))
+        else:
+            self.w.dispatchAllWindowEvents()
+            time.sleep(max(secs, 0))
+
+    # main method: keep a trial on screen until its deadline. draw() draws the
+    # current frame; update() (optional) checks for input and returns True if
+    # anything visible changed since the last frame. Returns the trial's
+    # actual onset (the time of its first flip)
+    def hold(self, trial, draw, update=None):
+        deadline = self.deadlines.get(id(trial))
+        if deadline is None:
+            deadline = self.deadline(trial)
+        true_ons = None
+        dirty = True
+
+        # The first flip should land on the refresh nearest the onset
+        target = round(trial['ons']/self.frame)*self.frame
+
+        # On virtual time, no need to check for keys more than once a frame
+        poll = self.frame if self.virtual else poll_interval
+        while True:
+            now = self.t.getTime()
+            if now >= deadline:
+                break
+
+            if update is not None and update():
+                dirty = True
+
+            if dirty:
+                if self.frame_timer is not None:
+                    self.frame_timer.begin_frame(target if true_ons is None else None)
+                draw()
+                self.w.flip()
+                self.n_flips += 1
+                dirty = False
+
+                if true_ons is None:
+                    true_ons = self.t.getTime()
+                    self.onsets.append(trial['ons'])
+                    self.true_onsets.append(true_ons)
+
+            # Nothing to do until the next check
+            elif update is not None:
+                self.idle(min(poll, deadline - now))
+            else:
+                self.idle(min(max_idle, deadline - now))
+
+        # Trials that ended before their first flip (e.g. already past their
+        # deadline) were never shown
+        return true_ons if true_ons is not None else self.t.getTime()
+
+    ### REPORTING ###
+    def onset_errors(self):
+        return np.array(self.true_onsets) - np.array(self.onsets)
+
+    def report(self):
+        errors = self.onset_errors()
+        if not len(errors):
+            return None
+
+        # Trials whose first flip missed the refresh nearest their onset
+        onset_frames = np.round(np.array(self.onsets)/self.frame)
+        true_frames = np.round(np.array(self.true_onsets)/self.frame)
+
+        summary = {
+            'n_trials': len(errors),
+            'n_flips': self.n_flips,
+            'n_missed': int(np.sum(onset_frames != true_frames)),
+            'max_onset_error': float(np.max(np.abs(errors))),
+            'mean_onset_error': float(np.mean(errors)),
+            'frame': self.frame
+        }
+        print('Onsets: %i trials, %i flips, max error %.1f ms (refresh: %.1f ms), %i missed refreshes' %
+              (summary['n_trials'], summary['n_flips'], summary['max_onset_error']*1000, self.frame*1000,
+               summary['n_missed']))
+        return summary
+
+    # Save the report with the run, along with scheduled and actual onsets
+    def save(self, out_file):
+        summary = self.report()
+        if summary is None:
+            return None
+        summary['onsets'] = [round(ons, 5) for ons in self.onsets]
+        summary['true_onsets'] = [round(ons, 5) for ons in self.true_onsets]
+        with open(out_file, 'w') as out:
+            json.dump(summary, out)
+        return summary
+
+# Helper function: Where to save onset timings for a behavioral file
+def onsets_file(out_file):
+    return out_file.replace('_behavioral_', '_onsets_')
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse, sys, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from signal import signal,SIGINT,SIGTERM
+
+# Experiment-specific modules
+import teaching_game_logic as game
+import teaching_window as window
+import teaching_frames as frames
+import teaching_schedule as schedule
+import teaching_datalog as datalog
+import teaching_timing
+
+### SESSION SETUP ###
+# Runs every remaining run of a subject in one process, with one window:
+# psychopy, the window, problems and stimuli are set up once, and the next
+# run's timing is loaded while the current run is going
+parser=argparse.ArgumentParser()
+parser.add_argument('--sub', help='Subject # (int)')
+parser.add_argument('--start', type=int, default=1, help='First run (to resume a session)')
+parser.add_argument('--end', type=int, default=None, help='Last run (default: the subject\'s last run)')
+parser.add_argument('-frames', action='store_true',
+                   help='Use this flag to record frame timings for every trial')
+parser.add_argument('-headless', action='store_true',
+                   help='Use this flag to run without a display (nothing is shown, and time runs as fast as possible)')
+parser.add_argument('--input', default='event', choices=['event', 'keyboard', 'evdev'],
+                   help='Where to read keypresses from: psychopy events (default), psychopy keyboard (psychtoolbox) or evdev, timestamped on a separate thread')
+parser.add_argument('--input-device', help='Input device for --input=evdev (e.g. /dev/input/by-id/...)')
+parser.add_argument('--simulate', choices=['random', 'optimal'],
+                   help='Simulate a participant (implies -headless)')
+
+print('\n=== SETTING UP SESSION ===')
+print('Passing arguments...')
+args=parser.parse_args()
+if args.simulate:
+    args.headless = True
+
+if args.sub is not None:
+    sub=int(args.sub)
+else:
+    print('No subject, running debug')
+    sub='debug'
+
+# Runs left in the session
+timings = teaching_timing.load() # compiled and checked in advance (see teaching_timing)
+sub_runs = sorted(run for label, run in timings.index if label == teaching_timing.sub_label(sub))
+end = args.end if args.end is not None else max(sub_runs, default=0)
+runs = [run for run in sub_runs if args.start <= run <= end]
+if not runs:
+    parser.error('No timing files for sub-%s, runs %i-%i' % (teaching_timing.sub_label(sub), args.start, end))
+
+# Confirm before launching session
+print('SUBJECT: %s | RUNS: %s' % (str(sub), ', '.join(map(str, runs))))
+if not args.headless:
+    input('Press Enter to confirm') # uncomment for production
+
+# Load the first run's timing and the problems now; later runs' timings are
+# loaded in the background (see below)
+timing = timings.load_run(sub, runs[0])
+game.load()
+prefetch = ThreadPoolExecutor(max_workers=1)
+
+# Helper function: Where to save a run's data
+def behavioral_file(run, tstamp):
+    label = '%02d' % sub if isinstance(sub, int) else sub
+    return 'data/sub-%s_task-teaching_run-%02d_behavioral_%i.json' % (label, run, tstamp)
+
+# The run in progress: (run, out_file, trial log), or None between runs
+current = None
+
+# Helper function: Save the current run's data and frame timings
+def save_run():
+    global current
+    if current is None:
+        return
+    run, out_file, trial_log = current
+    current = None
+    trial_log.finalize()
+    if game.frame_timer is not None:
+        game.frame_timer.save(frames.frames_file(out_file))
+        game.frame_timer.close()
+        game.frame_timer = None
+    if game.scheduler is not None:
+        game.scheduler.save(schedule.onsets_file(out_file))
+        game.scheduler = None
+
+# Helper function: Stop reading keypresses (if read on a separate thread)
+def close_input():
+    if game.key_source is not None and hasattr(game.key_source, 'close'):
+        game.key_source.close()
+        game.key_source = None
+
+# Set up emergency exit
+def emergency_exit(signum, frame):
+    print('Session interrupted! Saving data...')
+    if current is not None:
+        print('Resume with: --start=%i' % (current[0] + 1))
+        print('(and the rest of this run with: python teaching_task.py --sub=%s --run=%i --resume)' % (args.sub, current[0]))
+    save_run()
+    close_input()
+    if args.headless:
+        sys.exit(1)
+    from psychopy import core
+    core.quit()
+signal(SIGINT, emergency_exit)
+signal(SIGTERM, emergency_exit)
+
+### HARDWARE SETUP ###
+# Set up monitor (once for the whole session)
+width, height = (800, 600) # uncomment for scanning monitor
+aspect = width/height
+w = window.open_window(headless=args.headless, fullscr=True, size=(width, height), screen = 0, color='black')
+visual = window.visual_for(w)
+
+# Optional: Read keypresses with timestamps from the device, on a separate thread
+if args.input != 'event' and not args.simulate:
+    import teaching_input
+    print('Reading keypresses from: %s' % args.input)
+    game.key_source = teaching_input.make_input(args.input, args.input_device)
+
+# Optional: Simulated participant
+if args.simulate:
+    import teaching_simulate
+    print('Simulating a participant: %s' % args.simulate)
+    game.key_source = teaching_simulate.make_key_source(args.simulate)
+w.mouseVisible = False # uncomment for production
+
+# Helper function: Show a message until the scanner trigger
+def wait_for_scanner(txt):
+    wait_txt = visual.TextStim(w, text=txt, pos=(0,0), wrapWidth=2)
+    wait_txt.draw()
+    w.flip()
+    if not args.headless:
+        from psychopy import event
+        event.clearEvents(eventType='keyboard')
+        event.waitKeys(keyList=['equal'])
+
+# ### WAIT FOR SCANNER TRIGGER ###
+# Countdown before the first run only
+countdown = 5
+for sec in range(countdown):
+    txt = "Please lie very still!\nWe will begin in:\n\n%i" % (countdown-sec)
+    still_txt = visual.TextStim(w, text=txt, pos=(0,0.1), wrapWidth=2)
+    still_txt.draw()
+    w.flip()
+    window.wait(w, 1)
+
+### MAIN SESSION LOOP ###
+session_start = time.perf_counter()
+run_end = None
+gaps = []
+for i, run in enumerate(runs):
+    n_images = timings.run_info(sub, run)['n_images']
+    print('\n=== RUN %i (%i of %i) ===' % (run, i + 1, len(runs)))
+    print('# images: %i' % n_images)
+    print('Run length: %02d:%02d' % (np.floor(n_images*2/60), (n_images*2) % 60))
+
+    # Start loading the next run's timing while this one is going
+    next_timing = prefetch.submit(timings.load_run, sub, runs[i + 1]) if i + 1 < len(runs) else None
+
+    # Stream trials to disk from a background thread (see teaching_datalog.TrialLog)
+    out_file = behavioral_file(run, int(time.time()))
+    print('Saving data to: %s' % out_file)
+    current = (run, out_file, datalog.TrialLog(out_file, datalog.checkpoint_file(out_file)))
+
+    # Optional: Time every frame
+    if args.frames:
+        print('Recording frame timings to: %s' % frames.frames_file(out_file))
+        game.frame_timer = frames.FrameTimer(w)
+
+    if i == 0:
+        wait_for_scanner("Waiting for scanner")
+    else:
+        wait_for_scanner("Great job! Please keep lying still.\n\nThe next part will begin shortly.")
+        gaps.append(time.perf_counter() - run_end)
+        print('Time between runs: %.1f s' % gaps[-1])
+
+    print('Starting clock')
+    t = window.run_clock(w) # start clock
+    game.run(w,t,timing,[],current[2])
+    run_end = time.perf_counter()
+
+    # Save data at the end of every run
+    print('Run %i done! Saving data' % run)
+    save_run()
+    if next_timing is not None:
+        timing = next_timing.result()
+
+# End of session
+prefetch.shutdown()
+end_txt = visual.TextStim(w, text="All done!\nThank you!", pos=(0,0), wrapWidth=2)
+end_txt.draw()
+w.flip()
+close_input()
+
+print('\n=== SESSION DONE ===')
+print('%i runs in %.1f min' % (len(runs), (time.perf_counter() - session_start)/60))
+if gaps:
+    print('Time between runs: mean %.1f s, max %.1f s' % (np.mean(gaps), np.max(gaps)))
+w.close()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, glob, json, os, random, re, time
+import numpy as np
+
+# Experiment-specific modules
+import teaching_game_logic as game
+import teaching_window as window
+import teaching_datalog as datalog
+import teaching_timing
+
+# Simulated participants press a key every key_interval seconds (on average)
+key_interval = .35
+min_interval = .15
+
+### SIMULATED KEYPRESSES ###
+# Base class: keypresses are planned at the start of each trial, as
+# (time on the run clock, key), and handed out once their time comes
+class KeySource:
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.pending = []
+
+    def start_trial(self, t, trial, state, cursor):
+        self.pending = self.plan(t.getTime(), trial, state, cursor)
+
+    def plan(self, t0, trial, state, cursor):
+        return []
+
+    def get_keys(self, keylist, t):
+        now = t.getTime()
+        due = [(key, key_t) for key_t, key in self.pending if key_t <= now and key in keylist]
+        self.pending = [(key_t, key) for key_t, key in self.pending if key_t > now]
+        return due
+
+    def clear_keys(self):
+        pass
+
+    # Helper function: Times of n keypresses, starting at t0
+    def press_times(self, t0, n):
+        gaps = min_interval + self.rng.exponential(key_interval - min_interval, n)
+        return t0 + np.cumsum(gaps)
+
+# Helper function: Key that makes a given move, e.g. (0, 1, False) = right
+def move_key(move):
+    for key, key_move in game.keymap.items():
+        if key_move == move:
+            return key
+
+# Helper function: Keys that move the cursor from one square to another, then select it
+def path_keys(cursor, target):
+    r, c = cursor
+    keys = []
+    dr = int(np.sign(target[0] - r))
+    keys += [move_key((dr, 0, False))]*abs(target[0] - r)
+    dc = int(np.sign(target[1] - c))
+    keys += [move_key((0, dc, False))]*abs(target[1] - c)
+    keys.append(move_key((0, 0, True)))
+    return keys
+
+# Random participant: wanders around the board, pressing random keys
+class RandomKeys(KeySource):
+    def plan(self, t0, trial, state, cursor):
+        keys = [key for key in game.keylist if key != 'q']
+        if trial['type'] == 'choose':
+            n = int(trial['dur']/min_interval)
+            times = self.press_times(t0, n)
+            return [(key_t, keys[i]) for key_t, i in zip(times, self.rng.integers(len(keys), size=n))]
+        if trial['type'] == 'rate':
+            return [(t0 + self.rng.uniform(.3, 1.5), keys[self.rng.integers(5)])]
+        return []
+
+# Optimal teacher: walks to the example that most helps the learner (see
+# teaching_optimal), and rates how likely the learner is to be right
+class OptimalKeys(KeySource):
+    def __init__(self, seed=None, sampling='strong'):
+        super().__init__(seed)
+        import teaching_optimal, teaching_model
+        self.model = teaching_model
+        self.teacher = teaching_optimal.OptimalTeacher(game.problems_file, sampling)
+        self.hyps = teaching_model.hypotheses(game.load())
+        self.sampling = sampling
+
+    def plan(self, t0, trial, state, cursor):
+        if trial['type'] == 'choose':
+            target = self.teacher.best_example(trial['problem'], state)
+            if target is None:
+                return []
+            keys = path_keys(cursor, target)
+            return list(zip(self.press_times(t0, len(keys)), keys))
+
+        if trial['type'] == 'rate':
+            mask = self.model.state_masks(state)[None, :]
+            p_true = self.model.posterior(self.hyps[trial['problem']], mask, self.sampling)[0, 0]
+            rating = int(np.round(p_true*4))
+            return [(t0 + self.rng.uniform(.3, 1.5), game.keylist[rating])]
+        return []
+
+# Replay: presses the same keys, at the same times, as a recorded run (RTs
+# are measured from each trial's scheduled onset)
+class ReplayKeys(KeySource):
+    def __init__(self, records):
+        super().__init__()
+        self.records = iter(records)
+
+    def plan(self, t0, trial, state, cursor):
+        t0 = trial['ons']
+        rec = next(self.records)
+        if rec['type'] != trial['type'] or rec['ons'] != trial['ons']:
+            raise ValueError('Recorded trials do not match the timing file')
+
+        if trial['type'] == 'choose':
+            events = []
+            r, c = cursor
+            n_moves = len(rec['movements'])
+            for i, ((r1, c1), rt) in enumerate(rec['movements']):
+                if (r1, c1) != (r, c):
+                    key = move_key((r1 - r, c1 - c, False))
+                elif i == n_moves - 1 and rec['example'] is not None:
+                    key = move_key((0, 0, True)) # picked an example
+                else:
+                    # no movement and no pick (bumped into an edge, or pressed
+                    # ACTION on a square that can't be picked): replayed as the
+                    # no-op key, which can never select a square
+                    key = move_key((0, 0, False))
+                events.append((t0 + rt, key))
+                r, c = r1, c1
+            return events
+
+        if trial['type'] == 'rate' and rec['rating'] is not None:
+            return [(t0 + rec['rt'], game.keylist[rec['rating']])]
+        return []
+
+# Where the cursor started on each problem of a recorded run, in the order
+# game.run pops them
+def replay_corners(records):
+    all_corners = [(0,0),(0,5),(5,0),(5,5)]
+    starts = []
+    for rec in records:
+        if rec['type'] != 'choose' or rec['ex_idx'] != 0:
+            continue
+        if not rec['movements']:
+            starts.append(tuple(rec['cursor']))
+            continue
+
+        # first position must be one keypress away from the starting corner
+        r1, c1 = rec['movements'][0][0]
+        start = [corner for corner in all_corners
+                 if abs(corner[0] - r1) + abs(corner[1] - c1) <= 1][0]
+        starts.append(start)
+
+    unused = [corner for corner in all_corners if corner not in starts]
+    return (unused + starts[::-1])
+
+def make_key_source(policy, seed=None):
+    if policy == 'random':
+        return RandomKeys(seed)
+    if policy == 'optimal':
+        return OptimalKeys(seed)
+    raise ValueError('Unknown policy: %s' % policy)
+
+### SIMULATED RUNS ###
+# Run one timing file with a simulated participant, on a headless window
+# (or the given trials, e.g. those of a resumed run)
+def simulate_run(in_file, out_file, key_source, corners=None, w=None, timing=None):
+    if timing is None:
+        timing = teaching_timing.load_file(in_file)
+
+    if w is None:
+        w = window.open_window(headless=True, size=(800, 600), color='black')
+    game.key_source = key_source
+    try:
+        t = window.run_clock(w)
+        data = game.run(w, t, timing, [], corners=corners)
+    finally:
+        game.key_source = None
+
+    with open(out_file, 'w') as out:
+        json.dump(data, out, default=datalog.to_json)
+    return data
+
+# Helper function: Timing file used for a recorded run
+def timing_file(rec_file):
+    name = os.path.basename(rec_file)
+    if '_run-practice_' in name:
+        return 'inputs/timing/sub-debug_task-teaching_run-01_timing.json' # see teaching_practice.py
+    return os.path.join('inputs/timing', re.sub(r'_behavioral_\d+', '_timing', name))
+
+# Helper function: Trials of a recorded run, as they were run: those left
+# after the checkpoint for a resumed run (see teaching_checkpoint.save_resume),
+# up to the last one saved for a run that was interrupted
+def record_timing(rec_file, records):
+    resume = datalog.load_resume(rec_file)
+    if resume is not None:
+        timing = resume['timing']
+    else:
+        timing = teaching_timing.load_file(timing_file(rec_file))
+    return timing[:len(records)]
+
+# Helper function: Subject # of a recorded run (None if not in the file name)
+def record_sub(rec_file):
+    match = re.match(r'sub-(\d+)_', os.path.basename(rec_file))
+    return int(match.group(1)) if match else None
+
+# Helper function: Where to save a simulated run
+def sim_file(in_file, policy, out_dir):
+    name = os.path.basename(in_file).replace('_timing', '_behavioral_sim-%s' % policy)
+    return os.path.join(out_dir, name)
+
+if __name__ == '__main__':
+    # Usage:
+    # python teaching_simulate.py --sub=1 --policy=random    (all runs of one subject)
+    # python teaching_simulate.py --all --policy=optimal     (every timing file)
+    # python teaching_simulate.py --replay data/sub-01_task-teaching_run-01_behavioral_<tstamp>.json
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sub', help='Subject # (int)')
+    parser.add_argument('--all', action='store_true', help='Simulate every timing file')
+    parser.add_argument('--policy', default='random', choices=['random', 'optimal'])
+    parser.add_argument('--replay', nargs='+', help='Behavioral files to replay')
+    parser.add_argument('--practice', action='store_true', help='Use practice problems')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--out', default='data/sim', help='Where to save simulated data')
+    args = parser.parse_args()
+
+    if args.practice:
+        game.practice_mode(args.sub)
+    random.seed(args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    w = window.open_window(headless=True, size=(800, 600), color='black')
+
+    # Replay recorded runs
+    if args.replay:
+        for rec_file in args.replay:
+            with open(rec_file) as f:
+                records = json.load(f)
+            in_file = timing_file(rec_file)
+            if '_run-practice_' in rec_file:
+                game.practice_mode(record_sub(rec_file))
+            out_file = os.path.join(args.out, os.path.basename(rec_file).replace('_behavioral_', '_replay_'))
+            simulate_run(in_file, out_file, ReplayKeys(records), replay_corners(records), w, record_timing(rec_file, records))
+            print('Replayed %s -> %s' % (rec_file, out_file))
+
+    # Simulate new participants
+    else:
+        if args.all:
+            in_files = sorted(glob.glob('inputs/timing/sub-*_task-teaching_run-*_timing.json'))
+        elif args.sub is not None:
+            in_files = sorted(glob.glob('inputs/timing/sub-%02d_task-teaching_run-*_timing.json' % int(args.sub)))
+        else:
+            parser.error('Specify --sub, --all or --replay')
+
+        key_source = make_key_source(args.policy, args.seed)
+        t0 = time.time()
+        for in_file in in_files:
+            out_file = sim_file(in_file, args.policy, args.out)
+            simulate_run(in_file, out_file, key_source, w=w)
+        print('Simulated %i runs in %.1f s' % (len(in_files), time.time() - t0))
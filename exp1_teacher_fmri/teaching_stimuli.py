@@ -7,9 +7,11 @@ Created on Mon Aug 9 12:44:01 2021
 """
 
 # Stimulus presentation
-from psychopy import visual # Stimulus presentation
+import functools, weakref
 import numpy as np
 
+import teaching_window as window # Stimulus presentation (psychopy or headless)
+
 # Key parameters
 aspect = 800/600
 
@@ -28,21 +30,6 @@ ltr_y0 = h_y0+.33
 hypothesis_centers = [(-.75, h_y0), (-.25, h_y0), (.25, h_y0), (.75, h_y0)]
 sq_size = .05
 
-# Hypothesis square locations
-hypothesis_locations = []
-for loc in hypothesis_centers:
-
-    x_low, x_high = loc[0] - 3*sq_size, loc[0] + 3*sq_size
-    y_low, y_high = loc[1] - 3*sq_size*aspect, loc[1] + 3*sq_size*aspect
-
-    x = np.linspace(x_low, x_high, 6)
-    y = np.linspace(y_low, y_high, 6)
-    y = np.flip(y)
-    xys = [(x_i, y_i) for y_i in y for x_i in x]
-
-    hypothesis_locations.append(xys)
-
-# Canvas params
 # Canvas params
 canv_sq_size = .08
 canvas_center = [0, -.25]
@@ -50,94 +37,166 @@ canvas_center = [0, -.25]
 cx_low, cx_high = canvas_center[0] - 3*canv_sq_size, canvas_center[0] + 3*canv_sq_size
 cy_low, cy_high = canvas_center[1] - 3*aspect*canv_sq_size, canvas_center[1] + 3*aspect*canv_sq_size
 
-cx = np.linspace(cx_low, cx_high, 6)
-cy = np.linspace(cy_low, cy_high, 6)
-cy = np.flip(cy)
-canvas_locations = [(x_i, y_i) for y_i in cy for x_i in cx]
-
-def draw_canvas(prob, state, w, teacher_view):
-    h = prob['A']
-
-    # Hide the rest of the true hypothesis in student's view
-    sqs = np.add(h, state)
-    if not teacher_view:
-        sqs = np.multiply(sqs, np.greater(sqs, 1))
-
-    tile_colors = [colordict['canvas'][sq] for row in sqs for sq in row]
-    canvas_stim = visual.ElementArrayStim(win=w, 
-                                        xys=canvas_locations, 
-                                        colors = tile_colors,
+##### LAYOUT #####
+# Tile locations are computed on first use, rather than when this module is
+# imported: {'hypothesis_locations': one list of (x, y) per hypothesis,
+# 'canvas_locations': list of (x, y), 'cx', 'cy': tile centers by column/row}
+@functools.lru_cache(maxsize=None)
+def layout():
+    # Hypothesis square locations
+    hypothesis_locations = []
+    for loc in hypothesis_centers:
+
+        x_low, x_high = loc[0] - 3*sq_size, loc[0] + 3*sq_size
+        y_low, y_high = loc[1] - 3*sq_size*aspect, loc[1] + 3*sq_size*aspect
+
+        x = np.linspace(x_low, x_high, 6)
+        y = np.linspace(y_low, y_high, 6)
+        y = np.flip(y)
+        xys = [(x_i, y_i) for y_i in y for x_i in x]
+
+        hypothesis_locations.append(xys)
+
+    # Canvas square locations
+    cx = np.linspace(cx_low, cx_high, 6)
+    cy = np.linspace(cy_low, cy_high, 6)
+    cy = np.flip(cy)
+    canvas_locations = [(x_i, y_i) for y_i in cy for x_i in cx]
+
+    return {'hypothesis_locations': hypothesis_locations, 'canvas_locations': canvas_locations,
+            'cx': cx, 'cy': cy}
+
+##### STIMULUS CACHE #####
+# Stimuli are built once per window and then updated in place (colors,
+# positions, text), rather than rebuilt on every frame
+stim_cache = weakref.WeakKeyDictionary()
+
+def get_stims(w):
+    if w not in stim_cache:
+        stim_cache[w] = build_stims(w)
+    return stim_cache[w]
+
+def build_stims(w):
+    visual = window.visual_for(w)
+    tiles = layout()
+    stims = {}
+
+    # Canvas: colors are set once per problem/state
+    stims['canvas'] = visual.ElementArrayStim(win=w,
+                                        xys=tiles['canvas_locations'],
+                                        colors=[colordict['canvas'][0]]*36,
                                         colorSpace='rgb255',
                                         fieldShape='sqr',
                                         nElements=36,
                                         elementMask=None,
                                         elementTex=None,
                                         sizes=(canv_sq_size, canv_sq_size*aspect))
-    canvas_stim.draw()
+    stims['canvas_key'] = None
 
-def draw_cursor(row, col, colorkey, w):
-    color = colordict['cursor'][colorkey]
-    cursor_stim = visual.Rect(w, width=canv_sq_size*1.2, height=canv_sq_size*aspect*1.2, pos=(cx[col], cy[row]),
-                            fillColor=color, colorSpace='rgb255',
+    # Cursor: moved around the canvas in place
+    stims['cursor'] = visual.Rect(w, width=canv_sq_size*1.2, height=canv_sq_size*aspect*1.2, pos=(tiles['cx'][0], tiles['cy'][0]),
+                            fillColor=colordict['cursor'][0], colorSpace='rgb255',
                             interpolate=True)
-    cursor_stim.draw()
+    stims['cursor_key'] = None
 
-##### DRAWING PROCEDURES #####
-def draw_hypotheses(prob, order, w, teacher_view):
-    # Draw hypotheses
-    for idx, key in enumerate(order):
-        h = prob[key]
-        tile_colors = [colordict['hypothesis'][sq] for row in h for sq in row]
-        h_stim = visual.ElementArrayStim(win=w, 
-                                        xys=hypothesis_locations[idx], 
-                                        colors = tile_colors,
+    # Hypotheses: one array per slot, recolored when the problem or order changes
+    stims['hypotheses'] = [visual.ElementArrayStim(win=w,
+                                        xys=tiles['hypothesis_locations'][idx],
+                                        colors=[colordict['hypothesis'][0]]*36,
                                         colorSpace='rgb255',
                                         fieldShape='sqr',
                                         nElements=36,
                                         elementMask=None,
                                         elementTex=None,
                                         sizes=(sq_size, sq_size*aspect))
-        h_stim.draw()
+                           for idx in range(len(hypothesis_centers))]
+    stims['hypotheses_key'] = None
 
-    # Add letters on top
+    # Letters on top of each hypothesis
     letters = ['A', 'B', 'C', 'D']
     letter_locs = [(-.75, ltr_y0), (-.25, ltr_y0), (.25, ltr_y0), (.75, ltr_y0)]
+    stims['letters'] = [visual.TextStim(win=w,
+                                        text=letter,
+                                        pos=loc,
+                                        color='white')
+                        for letter, loc in zip(letters, letter_locs)]
+
+    # Border around the true hypothesis (teacher view)
+    stims['true_h_border'] = visual.Rect(w,
+                                size=((6*sq_size + .085), (4/3)*(6*sq_size + .085)),
+                                lineWidth=30,
+                                lineColor=colordict['true'],
+                                colorSpace='rgb255',
+                                pos=hypothesis_centers[0])
+
+    # Rating scale
+    scale_stims = [visual.TextStim(win=w, text="Suppose students saw just these hints.\nHow likely are they to get it right?",
+                               pos=(0, .3),
+                               height=.09,
+                               wrapWidth=2)]
+    scale_xs = np.linspace(-.66,.66,5)
+    for i,x_i in enumerate(scale_xs):
+        scale_stims.append(visual.TextStim(win=w,text=str(i+1), pos=(x_i,0), font='Menlo', height=.13))
+    scale_stims.append(visual.TextStim(win=w, text="No chance", pos=(-.66, -.22), height=.08))
+    scale_stims.append(visual.TextStim(win=w, text="Certainly", pos=(.66, -.22), height=.08))
+    stims['scale'] = scale_stims
 
-    for letter, loc in zip(letters, letter_locs):
-        letter_stim = visual.TextStim(win=w,
-                                      text=letter,
-                                      pos=loc,
-                                      color='white')
+    return stims
+
+##### DRAWING PROCEDURES #####
+def draw_canvas(prob, state, w, teacher_view):
+    stims = get_stims(w)
+    canvas_stim = stims['canvas']
+
+    # Only recolor tiles when the problem, state or view changes
+    # (board states are read-only, see teaching_game_logic.new_board)
+    key = stims['canvas_key']
+    if key is None or key[0] is not prob or key[1] is not state or key[2] != teacher_view:
+        tile_colors = prob.canvas_colors(state, teacher_view)
+        canvas_stim.setColors(tile_colors, colorSpace='rgb255')
+        stims['canvas_key'] = (prob, state, teacher_view)
+
+    canvas_stim.draw()
+
+def draw_cursor(row, col, colorkey, w):
+    stims = get_stims(w)
+    cursor_stim = stims['cursor']
+
+    # Move/recolor cursor only if it changed
+    key = (row, col, colorkey)
+    if key != stims['cursor_key']:
+        tiles = layout()
+        cursor_stim.pos = (tiles['cx'][col], tiles['cy'][row])
+        cursor_stim.setFillColor(colordict['cursor'][colorkey], colorSpace='rgb255')
+        stims['cursor_key'] = key
+
+    cursor_stim.draw()
+
+def draw_hypotheses(prob, order, w, teacher_view):
+    stims = get_stims(w)
+
+    # Recolor hypotheses only when the problem or order changes
+    key = stims['hypotheses_key']
+    if key is None or key[0] is not prob or key[1] != order:
+        for idx, key in enumerate(order):
+            tile_colors = prob.hypothesis_colors(key)
+            stims['hypotheses'][idx].setColors(tile_colors, colorSpace='rgb255')
+        stims['true_h_border'].pos = hypothesis_centers[order.index('A')]
+        stims['hypotheses_key'] = (prob, list(order))
+
+    # Draw hypotheses
+    for h_stim in stims['hypotheses']:
+        h_stim.draw()
+
+    # Add letters on top
+    for letter_stim in stims['letters']:
         letter_stim.draw()
-    
+
     # In teacher view: Highlight true hypothesis
     if teacher_view:
-        true_h = order.index('A')
-        true_h_border = visual.Rect(w,
-                                    size=((6*sq_size + .085), (4/3)*(6*sq_size + .085)),
-                                    lineWidth=30,
-                                    lineColor=colordict['true'],
-                                    colorSpace='rgb255',
-                                    pos=hypothesis_centers[true_h]) 
-        true_h_border.draw()
+        stims['true_h_border'].draw()
 
 def draw_scale(w):
-    # prompt
-    scale_prompt = visual.TextStim(win=w, text="Suppose students saw just these hints.\nHow likely are they to get it right?",
-                               pos=(0, .3),
-                               height=.09,
-                               wrapWidth=2)
-    scale_prompt.draw()
-
-    # scale
-    scale_xs = np.linspace(-.66,.66,5)
-    for i,x_i in enumerate(scale_xs):
-        scale_stim = visual.TextStim(win=w,text=str(i+1), pos=(x_i,0), font='Menlo', height=.13)
+    # prompt, scale and endpoints
+    for scale_stim in get_stims(w)['scale']:
         scale_stim.draw()
-
-    # endpoints
-    yestext = visual.TextStim(win=w, text="No chance", pos=(-.66, -.22), height=.08)
-    yestext.draw()
-
-    notext = visual.TextStim(win=w, text="Certainly", pos=(.66, -.22), height=.08)
-    notext.draw()
\ No newline at end of file
@@ -6,23 +6,41 @@ Created on Mon Jun 14 08:46:01 2021
 @author: aliciachen, nataliavelez
 """
 
-import argparse, sys, time, json, random, copy
+import argparse, sys, time
 import numpy as np
-from psychopy import gui, core, visual, event, data
 from signal import signal,SIGINT,SIGTERM
 
 # Experiment-specific modules
 import teaching_game_logic as game
+import teaching_window as window
+import teaching_frames as frames
+import teaching_schedule as schedule
+import teaching_datalog as datalog
+import teaching_timing
+import teaching_checkpoint as checkpoint
 
 ### LOAD PROBLEMS AND EXPERIMENT ORDER ###
 # Parse subject ID and run from command line arguments
 parser=argparse.ArgumentParser()
 parser.add_argument('--sub', help='Subject # (int)')
 parser.add_argument('--run', help='Run # (int)')
+parser.add_argument('-frames', action='store_true',
+                   help='Use this flag to record frame timings for every trial')
+parser.add_argument('-headless', action='store_true',
+                   help='Use this flag to run without a display (nothing is shown, and time runs as fast as possible)')
+parser.add_argument('--input', default='event', choices=['event', 'keyboard', 'evdev'],
+                   help='Where to read keypresses from: psychopy events (default), psychopy keyboard (psychtoolbox) or evdev, timestamped on a separate thread')
+parser.add_argument('--input-device', help='Input device for --input=evdev (e.g. /dev/input/by-id/...)')
+parser.add_argument('--simulate', choices=['random', 'optimal'],
+                   help='Simulate a participant (implies -headless)')
+parser.add_argument('--resume', nargs='?', const='latest',
+                   help='Resume an interrupted run from the next problem, from a checkpoint file (default: the run\'s latest checkpoint)')
 
 print('\n=== SETTING UP RUN ===')
 print('Passing arguments...')
 args=parser.parse_args()
+if args.simulate:
+    args.headless = True
 
 if args.sub is not None:
     sub=int(args.sub)
@@ -38,7 +56,8 @@ else:
 
 # Confirm before launching run
 print('SUBJECT: %s | RUN: %i' % (str(sub), run))
-input('Press Enter to confirm') # uncomment for production
+if not args.headless:
+    input('Press Enter to confirm') # uncomment for production
 
 # Load timing information
 if isinstance(sub, int):
@@ -46,13 +65,24 @@ if isinstance(sub, int):
 else:
     in_file = 'inputs/timing/sub-%s_task-teaching_run-%02d_timing.json' % (sub, run) # debug
 print('\nLoading timing info from: %s' % in_file)
-with open(in_file, 'r') as f:
-    timing = json.load(f)
-
-# Sanity check: Run length matches # of images in protocol
-last_trial = timing[-1]
-run_length = last_trial['ons'] + last_trial['dur']
-n_images = np.ceil(run_length/2)
+timings = teaching_timing.load() # compiled and checked in advance (see teaching_timing)
+timing = timings.load_run(sub, run)
+game.load() # problems are read now, not once the run has started
+n_images = timings.run_info(sub, run)['n_images']
+
+# Optional: Resume an interrupted run (see teaching_checkpoint)
+offset, corners = 0., None
+if args.resume:
+    ckpt_file = checkpoint.latest(sub, run) if args.resume == 'latest' else args.resume
+    if ckpt_file is None:
+        parser.error('No checkpoint for this run in data/, start it again without --resume')
+    print('Resuming from checkpoint: %s' % ckpt_file)
+    try:
+        timing, offset, corners = checkpoint.resume_timing(timing, checkpoint.load(ckpt_file))
+    except ValueError as err:
+        parser.error(str(err))
+    n_images -= int(round(offset/teaching_timing.tr))
+    print('Skipping the first %.1f s of the run, starting with problem %i' % (offset, timing[1]['problem']))
 print('# images: %i' % n_images)
 print('Run length: %02d:%02d' % (np.floor(n_images*2/60), (n_images*2) % 60))
 
@@ -62,15 +92,41 @@ out_file = in_file.replace('inputs/timing', 'data').replace('_timing', '_behavio
 data = []
 print('\nSaving data to: %s' % out_file)
 
+# Stream trials to disk from a background thread (see teaching_datalog.TrialLog)
+trial_log = datalog.TrialLog(out_file, datalog.checkpoint_file(out_file))
+if args.resume:
+    checkpoint.save_resume(out_file, ckpt_file, timing, offset, n_images)
+
 # Helper function: Save data
 def save_data():
-    with open(out_file, 'w') as out:
-        json.dump(data, out)
+    trial_log.finalize()
+
+# Helper function: Save frame timings (if recorded)
+def save_frames():
+    if game.frame_timer is not None:
+        game.frame_timer.save(frames.frames_file(out_file))
+
+# Helper function: Save onset timings (once trials have started)
+def save_onsets():
+    if game.scheduler is not None:
+        game.scheduler.save(schedule.onsets_file(out_file))
+
+# Helper function: Stop reading keypresses (if read on a separate thread)
+def close_input():
+    if game.key_source is not None and hasattr(game.key_source, 'close'):
+        game.key_source.close()
+        game.key_source = None
 
 # Set up emergency exit
 def emergency_exit(signum, frame):
     print('Task interrupted! Saving data...')
     save_data()
+    save_frames()
+    save_onsets()
+    close_input()
+    if args.headless:
+        sys.exit(1)
+    from psychopy import core
     core.quit()
 signal(SIGINT, emergency_exit)
 signal(SIGTERM, emergency_exit)
@@ -79,9 +135,27 @@ signal(SIGTERM, emergency_exit)
 # Set up monitor
 width, height = (800, 600) # uncomment for scanning monitor
 aspect = width/height
-w = visual.Window(fullscr=True, size=(width, height), screen = 0, color='black')
+w = window.open_window(headless=args.headless, fullscr=True, size=(width, height), screen = 0, color='black')
+visual = window.visual_for(w)
+
+# Optional: Read keypresses with timestamps from the device, on a separate thread
+if args.input != 'event' and not args.simulate:
+    import teaching_input
+    print('Reading keypresses from: %s' % args.input)
+    game.key_source = teaching_input.make_input(args.input, args.input_device)
+
+# Optional: Simulated participant
+if args.simulate:
+    import teaching_simulate
+    print('Simulating a participant: %s' % args.simulate)
+    game.key_source = teaching_simulate.make_key_source(args.simulate)
 w.mouseVisible = False # uncomment for production
 
+# Optional: Time every frame
+if args.frames:
+    print('Recording frame timings to: %s' % frames.frames_file(out_file))
+    game.frame_timer = frames.FrameTimer(w)
+
 # Set up keys
 # keylist = ('space', 'j','k','l','semicolon', 'q') # debug
 keylist = ('0', '1', '2', '3', '4', 'q') # uncomment for production
@@ -94,69 +168,24 @@ for sec in range(countdown):
     still_txt = visual.TextStim(w, text=txt, pos=(0,0.1), wrapWidth=2)
     still_txt.draw()
     w.flip()
-    core.wait(1)
+    window.wait(w, 1)
 
 start_txt = visual.TextStim(w, text="Waiting for scanner", pos=(0,0), wrapWidth=2)
 start_txt.draw()
 w.flip()
-event.waitKeys(keyList=['equal'])
-
-### INITIALIZE PROBLEMS ###
-# starting points
-new_state = [
-    [0,0,0,0,0,0],
-    [0,0,0,0,0,0],
-    [0,0,0,0,0,0],
-    [0,0,0,0,0,0],
-    [0,0,0,0,0,0],
-    [0,0,0,0,0,0]
-]
-corners = [(0,0),(0,5),(5,0),(5,5)] # where to start cursor
-random.shuffle(corners)
-
-# init exp loop
-problem_counter = 0
-state = copy.deepcopy(new_state)
-cursor = corners.pop()
+if not args.headless:
+    from psychopy import event
+    event.waitKeys(keyList=['equal'])
 
 ### MAIN EXPERIMENT LOOP ###
 print('Starting clock')
-t = core.MonotonicClock() # start clock
-
-for trial in timing:
-    # is this a new problem?
-    if 'problem_idx' in trial:
-        if  trial['problem_idx'] > problem_counter:
-            
-            # if so, refresh the game state
-            print('\n==== NEW PROBLEM: %i ====' % trial['problem'])
-            state = copy.deepcopy(new_state)
-            cursor = corners.pop()
-
-            # and update counter
-            problem_counter = trial['problem_idx']
-
-    # hacky workaround to show off the last-selected example
-    if trial['type'] == 'show':
-        trial_data = game.present(w,t,trial,state,highlight)
-    else:
-        trial_data = game.present(w,t,trial,state,cursor)
-    data.append(trial_data)
-    save_data() # new: save data after each trial
-
-    # update state and cursor after choose trials
-    if trial['type'] == 'choose':
-
-        state = trial_data['state']
-        cursor = trial_data['cursor']
-
-        last_example = trial_data['example']
-        if last_example is not None:
-            highlight = cursor
-        else:
-            highlight = None
+t = window.run_clock(w) # start clock
+game.run(w,t,timing,data,trial_log,corners,offset)
+close_input()
 
 # Save data at the end
 print('All done! Saving data')
 print(data)
 save_data()
+save_frames()
+save_onsets()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse, glob, hashlib, json, os, re
+import numpy as np
+
+import teaching_problems
+
+# Timing files, one per subject and run
+timing_dir = 'inputs/timing'
+timing_pattern = 'sub-*_task-teaching_run-*_timing.json'
+
+# Scanner protocol: one image every 2 s; onsets and durations lie on a 50 ms
+# grid (40 steps per image)
+tr = 2.0
+grid_step = .05
+
+# Trial types, in the order they are coded in the store
+trial_types = ('pause', 'study', 'choose', 'pre', 'show', 'rate')
+type_idx = {name: i for i, name in enumerate(trial_types)}
+example_types = ('choose', 'pre', 'show', 'rate') # trials that show one example, in order
+
+### COMPILED STORE ###
+# Every trial of every run, as one structured array. Missing fields
+# (e.g. the problem of a pause) are -1 / ''.
+trial_dtype = np.dtype([
+    ('type', 'i1'),
+    ('ons', 'f8'),
+    ('dur', 'f8'),
+    ('problem', 'i2'),
+    ('problem_idx', 'i1'),
+    ('ex_idx', 'i1'),
+    ('order', 'U4')
+])
+
+# One row per run: where its trials are in the trial array, and how many
+# images the scanner needs to acquire
+run_dtype = np.dtype([
+    ('sub', 'U8'),
+    ('run', 'i2'),
+    ('start', 'i4'),
+    ('stop', 'i4'),
+    ('n_images', 'i2'),
+    ('valid', '?')
+])
+
+# Helper function: Subject and run from a timing file name
+def parse_name(in_file):
+    match = re.match(r'sub-(\w+?)_task-teaching_run-(\d+)_timing\.json$', os.path.basename(in_file))
+    if match is None:
+        raise ValueError('Not a timing file: %s' % in_file)
+    return match.group(1), int(match.group(2))
+
+# Helper function: Subject label, as in file names (1 -> '01')
+def sub_label(sub):
+    return '%02d' % sub if isinstance(sub, (int, np.integer)) else str(sub)
+
+# Helper function: Trial dict -> row of the trial array
+def to_row(trial):
+    return (type_idx[trial['type']], trial['ons'], trial['dur'],
+            trial.get('problem', -1), trial.get('problem_idx', -1), trial.get('ex_idx', -1),
+            ''.join(trial.get('order', '')))
+
+# Helper function: whole numbers as ints, as in the timing files
+def to_number(x):
+    x = float(x)
+    return int(x) if x.is_integer() else x
+
+# Helper function: Row of the trial array -> trial dict (same keys as the timing files)
+def to_trial(row):
+    name = trial_types[row['type']]
+    trial = {'type': name, 'ons': to_number(row['ons']), 'dur': to_number(row['dur'])}
+    if name != 'pause':
+        trial['problem'] = int(row['problem'])
+        trial['problem_idx'] = int(row['problem_idx'])
+        trial['order'] = list(str(row['order']))
+    if name in example_types:
+        trial['ex_idx'] = int(row['ex_idx'])
+    return trial
+
+# Compile runs given as (sub, run, timing): returns (trials, runs)
+def compile_runs(timings):
+    rows, runs = [], []
+    for sub, run, timing in timings:
+        runs.append((sub, run, len(rows), len(rows) + len(timing), 0, True))
+        rows += [to_row(trial) for trial in timing]
+
+    trials = np.array(rows, dtype=trial_dtype)
+    runs = np.array(runs, dtype=run_dtype)
+    ends = [trials['ons'][stop-1] + trials['dur'][stop-1] for stop in runs['stop']]
+    runs['n_images'] = np.ceil(np.round(np.array(ends)/tr, 6))
+    return trials, runs
+
+# Compile every timing file in timing_dir
+def compile_timing(in_dir=timing_dir):
+    timings = []
+    for in_file in sorted(glob.glob(os.path.join(in_dir, timing_pattern))):
+        with open(in_file) as f:
+            timings.append(parse_name(in_file) + (json.load(f),))
+    return compile_runs(timings)
+
+### VALIDATION ###
+# Check every run; returns a list of (sub, run, message) and marks invalid
+# runs in runs['valid']
+def validate(trials, runs, n_problems=None):
+    errors = []
+    ons, dur = trials['ons'], trials['dur']
+
+    # Checks that can be done on all trials at once
+    on_grid = (np.isclose(ons/grid_step, np.round(ons/grid_step)) &
+               np.isclose(dur/grid_step, np.round(dur/grid_step)) & (dur > 0))
+    if n_problems is not None:
+        bad_problem = (trials['type'] != type_idx['pause']) & (
+            (trials['problem'] < 0) | (trials['problem'] >= n_problems))
+    else:
+        bad_problem = np.zeros(len(trials), dtype=bool)
+
+    # The scanner protocol is the same for every run
+    n_images = np.bincount(runs['n_images']).argmax() if len(runs) else 0
+
+    for i, (sub, run, start, stop, run_images, _) in enumerate(runs):
+        def error(msg, trial=None):
+            errors.append((str(sub), int(run), msg if trial is None else 'trial %i: %s' % (trial - start, msg)))
+            runs['valid'][i] = False
+
+        if stop == start:
+            error('no trials')
+            continue
+
+        # Run starts with the first image, and trials follow each other without gaps or overlaps
+        if not np.isclose(ons[start], 0):
+            error('first trial starts at %.3f s, not 0' % ons[start])
+        offsets = ons[start+1:stop] - (ons[start:stop-1] + dur[start:stop-1])
+        for j in np.flatnonzero(~np.isclose(offsets, 0)):
+            if offsets[j] > 0:
+                error('%.3f s gap after the previous trial' % offsets[j], start + j + 1)
+            else:
+                error('overlaps the previous trial by %.3f s' % -offsets[j], start + j + 1)
+
+        # Onsets and durations are aligned to the scanner images
+        for j in np.flatnonzero(~on_grid[start:stop]):
+            error('onset/duration not on the %i ms grid' % (grid_step*1000), start + j)
+
+        # Run ends within the last image of the protocol
+        if run_images != n_images:
+            error('run needs %i images, other runs need %i' % (run_images, n_images))
+
+        for j in np.flatnonzero(bad_problem[start:stop]):
+            error('problem %i out of range' % trials['problem'][start + j], start + j)
+
+        # Problems are studied, then shown one example at a time:
+        # study, then (choose, pre, show, rate) for ex_idx = 0, 1, ...
+        problem_idx, expected = -1, None
+        for j in range(start, stop):
+            row = trials[j]
+            name = trial_types[row['type']]
+            if name == 'pause':
+                continue
+
+            if name == 'study':
+                if row['problem_idx'] != problem_idx + 1:
+                    error('problem_idx %i after problem_idx %i' % (row['problem_idx'], problem_idx), j)
+                if expected is not None and expected[0] != 'choose':
+                    error('problem_idx %i ends mid-example' % problem_idx, j)
+                problem_idx = row['problem_idx']
+                problem, order = row['problem'], row['order']
+                expected = ('choose', 0)
+                if sorted(order) != list(teaching_problems.hypothesis_keys):
+                    error('order %r is not a permutation of A-D' % str(order), j)
+                continue
+
+            if expected is None:
+                error('%s before the first study trial' % name, j)
+                continue
+            if (row['problem_idx'], row['problem'], row['order']) != (problem_idx, problem, order):
+                error('%s does not match the problem being studied' % name, j)
+            if (name, row['ex_idx']) != expected:
+                error('expected %s (ex_idx %i), got %s (ex_idx %i)' %
+                      (expected + (name, row['ex_idx'])), j)
+
+            # Next trial in the cycle
+            k = example_types.index(name)
+            if k == len(example_types) - 1:
+                expected = ('choose', row['ex_idx'] + 1)
+            else:
+                expected = (example_types[k+1], row['ex_idx'])
+
+        if expected is not None and expected[0] != 'choose':
+            error('problem_idx %i ends mid-example' % problem_idx)
+
+    return errors
+
+### CACHE ###
+# Helper function: Where to cache the compiled timing files (one cache per
+# folder of timing files)
+def cache_files(in_dir=timing_dir):
+    name = 'timing'
+    if os.path.normpath(in_dir) != os.path.normpath(timing_dir):
+        name += '-' + hashlib.sha1(os.path.abspath(in_dir).encode()).hexdigest()[:12]
+    base = os.path.join(teaching_problems.cache_dir, name)
+    return base + '_trials.npy', base + '_runs.npy'
+
+# Helper function: Most recent change to the timing files (including files
+# being added or removed)
+def last_modified(in_dir=timing_dir):
+    with os.scandir(in_dir) as entries:
+        mtimes = [entry.stat().st_mtime for entry in entries]
+    return max(mtimes + [os.path.getmtime(in_dir)])
+
+# Compile, validate and cache every timing file
+def save_store(in_dir=timing_dir, problems_file='inputs/problems.json'):
+    trials, runs = compile_timing(in_dir)
+    n_problems = len(teaching_problems.load_grids(problems_file)) if os.path.exists(problems_file) else None
+    errors = validate(trials, runs, n_problems)
+
+    os.makedirs(teaching_problems.cache_dir, exist_ok=True)
+    for out_file, arr in zip(cache_files(in_dir), (trials, runs)): # runs last: its mtime marks the cache as fresh
+        tmp_file = out_file + '.%i.tmp' % os.getpid()
+        with open(tmp_file, 'wb') as f:
+            np.save(f, arr)
+        os.replace(tmp_file, out_file)
+    return errors
+
+### LOOKUPS ###
+class TimingStore:
+    def __init__(self, trials, runs):
+        self.trials = trials
+        self.runs = runs
+        self.index = {(str(sub), int(run)): i for i, (sub, run) in enumerate(zip(runs['sub'], runs['run']))}
+
+    def __len__(self):
+        return len(self.runs)
+
+    def __contains__(self, key):
+        return (sub_label(key[0]), int(key[1])) in self.index
+
+    # Index row of one run
+    def run_info(self, sub, run):
+        key = (sub_label(sub), int(run))
+        if key not in self.index:
+            raise KeyError('No timing file for sub-%s, run-%02d' % key)
+        return self.runs[self.index[key]]
+
+    # Trials of one (valid) run, as a list of dicts
+    def load_run(self, sub, run):
+        info = self.run_info(sub, run)
+        if not info['valid']:
+            raise ValueError('Timing for sub-%s, run-%02d failed validation (see python teaching_timing.py)' %
+                             (info['sub'], info['run']))
+        return [to_trial(row) for row in self.trials[info['start']:info['stop']]]
+
+    # Trials of one run, by timing file name
+    def load_file(self, in_file):
+        return self.load_run(*parse_name(in_file))
+
+# main method: memory-mapped store of every timing file, recompiled if stale
+def load(in_dir=timing_dir):
+    trials_file, runs_file = cache_files(in_dir)
+    fresh = (os.path.exists(trials_file) and os.path.exists(runs_file) and
+             os.path.getmtime(runs_file) >= last_modified(in_dir))
+    if not fresh:
+        errors = save_store(in_dir)
+        for sub, run, msg in errors:
+            print('Timing error (sub-%s, run-%02d): %s' % (sub, run, msg))
+
+    return TimingStore(np.load(trials_file, mmap_mode='r'), np.load(runs_file, mmap_mode='r'))
+
+# Helper function: Trials of one run
+def load_run(sub, run):
+    return load().load_run(sub, run)
+
+# Helper function: Trials of a timing file (from the compiled files of its folder)
+def load_file(in_file):
+    return load(os.path.dirname(in_file) or '.').load_file(in_file)
+
+if __name__ == '__main__':
+    # Usage: python teaching_timing.py (compiles and checks every timing file)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=timing_dir, help='Folder with timing files')
+    args = parser.parse_args()
+
+    errors = save_store(args.dir)
+    store = load(args.dir)
+    for sub, run, msg in errors:
+        print('sub-%s, run-%02d: %s' % (sub, run, msg))
+
+    runs = store.runs
+    print('Compiled %i runs (%i trials) to: %s' % (len(runs), len(store.trials), cache_files(args.dir)[0]))
+    print('%i valid, %i invalid; # images: %s' %
+          (runs['valid'].sum(), (~runs['valid']).sum(), ', '.join(map(str, np.unique(runs['n_images'])))))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+
+# Named colors used in the task, as RGB (0-255)
+named_colors = {
+    'black': (0, 0, 0),
+    'white': (255, 255, 255)
+}
+
+### OPENING WINDOWS ###
+# Open a psychopy window, or a window that doesn't need a display (headless)
+def open_window(headless=False, **kwargs):
+    if headless:
+        return NullWindow(**kwargs)
+
+    from psychopy import visual
+    return visual.Window(**kwargs)
+
+# Helper function: Stimulus classes to use with a window
+def visual_for(w):
+    if isinstance(w, NullWindow):
+        return null_visual
+
+    from psychopy import visual
+    return visual
+
+# Helper function: Clock for a run, starting at 0
+def run_clock(w):
+    if isinstance(w, NullWindow):
+        return VirtualClock(w)
+
+    from psychopy import core
+    return core.MonotonicClock()
+
+# Helper function: Wait on a window's clock
+def wait(w, secs):
+    if isinstance(w, NullWindow):
+        w.now += secs
+    else:
+        from psychopy import core
+        core.wait(secs)
+
+### HEADLESS WINDOW ###
+# Stands in for visual.Window without a display: time is virtual (every flip
+# jumps to the next refresh), stimuli record what was drawn on each frame,
+# and (optionally) frames are rendered into NumPy arrays
+class NullWindow:
+    def __init__(self, size=(800, 600), color='black', frame_rate=60, render=False,
+                 render_size=None, **kwargs):
+        self.size = np.array(size)
+        self.color = color
+        self.units = 'norm'
+        self.mouseVisible = True
+        self.monitorFramePeriod = 1/frame_rate
+
+        # Virtual time, in seconds
+        self.now = 0.0
+        self.n_flips = 0
+
+        # Stimuli drawn on the current/last frame
+        self.draw_calls = []
+        self.last_frame = []
+
+        # Frame buffers (height, width, RGB)
+        self.render = render
+        if render:
+            width, height = render_size if render_size is not None else size
+            self.bg = np.array(to_rgb255(color), dtype=np.uint8)
+            self.back = np.empty((height, width, 3), dtype=np.uint8)
+            self.back[:] = self.bg
+            self.front = self.back.copy()
+
+    def flip(self, clearBuffer=True):
+        # Wait for the next refresh
+        period = self.monitorFramePeriod
+        self.now = (math.floor(self.now/period + 1e-6) + 1)*period
+        self.n_flips += 1
+
+        self.last_frame = self.draw_calls
+        self.draw_calls = []
+        if self.render:
+            self.front, self.back = self.back, self.front
+            if clearBuffer:
+                self.back[:] = self.bg
+            else:
+                self.back[:] = self.front
+        return self.now
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return 1/self.monitorFramePeriod
+
+    def close(self):
+        pass
+
+    ### RENDERING ###
+    # Helper function: Normalized units -> pixel box (x0, x1, y0, y1)
+    def to_pixels(self, pos, size):
+        height, width = self.back.shape[:2]
+        x0 = int(round((pos[0] - size[0]/2 + 1)/2*width))
+        x1 = int(round((pos[0] + size[0]/2 + 1)/2*width))
+        y0 = int(round((1 - (pos[1] + size[1]/2))/2*height))
+        y1 = int(round((1 - (pos[1] - size[1]/2))/2*height))
+        return max(x0, 0), min(x1, width), max(y0, 0), min(y1, height)
+
+    def fill_rect(self, pos, size, color):
+        x0, x1, y0, y1 = self.to_pixels(pos, size)
+        if x1 > x0 and y1 > y0:
+            self.back[y0:y1, x0:x1] = color
+
+    def outline_rect(self, pos, size, color, line_width):
+        x0, x1, y0, y1 = self.to_pixels(pos, size)
+        lw = max(int(round(line_width)), 1)
+        self.back[y0:y0+lw, x0:x1] = color
+        self.back[max(y1-lw, 0):y1, x0:x1] = color
+        self.back[y0:y1, x0:x0+lw] = color
+        self.back[y0:y1, max(x1-lw, 0):x1] = color
+
+# Helper function: psychopy color -> RGB (0-255), or None if transparent
+def to_rgb255(color, colorSpace='rgb'):
+    if color is None:
+        return None
+    if isinstance(color, str):
+        if color.startswith('#'):
+            return tuple(int(color[i:i+2], 16) for i in (1, 3, 5))
+        return named_colors[color]
+    color = np.asarray(color, dtype=float)
+    if colorSpace == 'rgb255':
+        return tuple(np.round(color).astype(int))
+    return tuple(np.round((color + 1)/2*255).astype(int)) # psychopy 'rgb' (-1 to 1)
+
+### HEADLESS STIMULI ###
+# Keep psychopy's constructor arguments as attributes, so the task can keep
+# updating them in place (pos, text, colors...)
+class NullStim:
+    def __init__(self, win, **kwargs):
+        self.win = win
+        self.colorSpace = 'rgb'
+        self.pos = (0, 0)
+        self.__dict__.update(kwargs)
+
+    def draw(self):
+        self.win.draw_calls.append(self)
+        if self.win.render:
+            self.render()
+
+    def render(self):
+        pass
+
+    def setPos(self, pos):
+        self.pos = pos
+
+class NullElementArrayStim(NullStim):
+    def setColors(self, colors, colorSpace=None):
+        self.colors = colors
+        if colorSpace is not None:
+            self.colorSpace = colorSpace
+
+    def render(self):
+        sizes = np.broadcast_to(self.sizes, (len(self.xys), 2))
+        for xy, size, color in zip(self.xys, sizes, self.colors):
+            self.win.fill_rect(xy, size, to_rgb255(color, self.colorSpace))
+
+class NullRect(NullStim):
+    def __init__(self, win, **kwargs):
+        self.fillColor = None
+        self.lineColor = None
+        self.lineWidth = 1.5
+        super().__init__(win, **kwargs)
+        if 'size' not in kwargs:
+            self.size = (kwargs.get('width', .5), kwargs.get('height', .5))
+
+    def setFillColor(self, color, colorSpace=None):
+        self.fillColor = color
+        if colorSpace is not None:
+            self.colorSpace = colorSpace
+
+    def render(self):
+        fill = to_rgb255(self.fillColor, self.colorSpace)
+        line = to_rgb255(self.lineColor, self.colorSpace)
+        if fill is not None:
+            self.win.fill_rect(self.pos, self.size, fill)
+        if line is not None:
+            self.win.outline_rect(self.pos, self.size, line, self.lineWidth)
+
+# Text and images are recorded, but not rendered
+class NullTextStim(NullStim):
+    pass
+
+class NullImageStim(NullStim):
+    pass
+
+class null_visual:
+    ElementArrayStim = NullElementArrayStim
+    Rect = NullRect
+    TextStim = NullTextStim
+    ImageStim = NullImageStim
+
+### VIRTUAL CLOCK ###
+# Same interface as psychopy's clocks, but follows a NullWindow's virtual time
+class VirtualClock:
+    def __init__(self, w):
+        self.w = w
+        self.t0 = w.now
+
+    def getTime(self):
+        return self.w.now - self.t0
+
+    def reset(self, newT=0.0):
+        self.t0 = self.w.now + newT